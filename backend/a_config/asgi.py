@@ -12,5 +12,13 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "a_config.settings")
+# Run GraphQL on the event loop instead of one thread per request.
+os.environ.setdefault("GRAPHQL_ASYNC", "1")
 
 application = get_asgi_application()
+
+# Purge stale carts, sessions and tokens in the background when
+# PURGE_STALE["INTERVAL"] is set.
+from shop.purge import start_scheduler  # noqa: E402
+
+start_scheduler()
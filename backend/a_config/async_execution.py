@@ -0,0 +1,90 @@
+from functools import partial
+from inspect import isawaitable, iscoroutinefunction
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db.models import Model
+from graphene.types.resolver import dict_or_attr_resolver
+
+
+def is_async(info):
+    """
+    Return whether the current operation runs on `AsyncGraphQLView`.
+    """
+    return bool(getattr(info.context, "graphql_async", 0))
+
+
+def _resolver_of(info):
+    resolver = info.parent_type.fields[info.field_name].resolve
+    while isinstance(resolver, partial) and not getattr(
+        resolver, "is_async_capable", False
+    ):
+        if resolver.func is dict_or_attr_resolver:
+            return resolver
+        resolver = resolver.func
+    return resolver
+
+
+def _is_loaded(root, resolver):
+    """
+    Return whether a default resolver can read its attribute without a
+    query: plain objects always can, model instances when the column or
+    related object is already loaded.
+    """
+    if not isinstance(root, Model):
+        return True
+    name = resolver.args[0]
+    return name in vars(root) or name in root._state.fields_cache
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
+class AsyncBridgeMiddleware:
+    """
+    Graphene middleware that lets sync and async resolvers share both views.
+
+    On the async view, async resolvers are awaited on the event loop.
+    Default resolvers that read an already loaded attribute stay inline.
+    Every other sync resolver runs, together with the middleware inside
+    this one, through `sync_to_async`, since it may query the database.
+
+    On the sync view, sync resolvers are called as usual and the result of
+    an async one is run to completion with `async_to_sync`, so each
+    resolver needs a single implementation.
+
+    It must come after the optimizer and loader middleware in
+    `GRAPHENE["MIDDLEWARE"]`, so they run inside the thread with the
+    resolver.
+    """
+
+    def resolve(self, next, root, info, **args):
+        if not is_async(info):
+            result = next(root, info, **args)
+            if isawaitable(result):
+                return async_to_sync(_await)(result)
+            return result
+
+        resolver = _resolver_of(info)
+        if getattr(resolver, "is_async_capable", False) or iscoroutinefunction(
+            resolver
+        ):
+            return next(root, info, **args)
+        if (
+            isinstance(resolver, partial)
+            and resolver.func is dict_or_attr_resolver
+            and _is_loaded(root, resolver)
+        ):
+            return next(root, info, **args)
+
+        return sync_to_async(self.resolve_sync)(next, root, info, **args)
+
+    @staticmethod
+    def resolve_sync(next, root, info, **args):
+        result = next(root, info, **args)
+        if isawaitable(result):
+            raise TypeError(
+                f"{info.parent_type.name}.{info.field_name} returned an awaitable "
+                "from a sync resolver not marked `is_async_capable`."
+            )
+        return result
@@ -0,0 +1,226 @@
+from collections import namedtuple
+
+from django.conf import settings
+from graphene.utils.str_converters import to_camel_case
+from graphene_django.settings import graphene_settings
+from graphql import (
+    SKIP,
+    FieldNode,
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    GraphQLError,
+    GraphQLList,
+    InlineFragmentNode,
+    IntValueNode,
+    ValidationRule,
+    VariableNode,
+    get_named_type,
+    get_nullable_type,
+    value_from_ast,
+)
+
+DEFAULTS = {
+    # Deepest chain of nested fields an operation may select.
+    "MAX_DEPTH": 10,
+    # Highest estimated cost an operation may have.
+    "MAX_COST": 5000,
+    # Assumed length of list fields that take no `first` argument.
+    "DEFAULT_LIST_SIZE": 20,
+}
+
+Complexity = namedtuple("Complexity", ("depth", "cost"))
+
+
+def complexity_settings():
+    return {**DEFAULTS, **getattr(settings, "GRAPHQL_QUERY_COMPLEXITY", {})}
+
+
+def measure(schema, operation, fragments, variables=None):
+    """
+    Estimate the depth and cost of `operation`.
+
+    Every field costs its weight (1 unless the type declares `cost_hints`)
+    plus the cost of its selection times the number of rows it returns. The
+    row count is the `first` argument when given, clamped to the page size
+    cap, the cap itself when `first` is a variable whose value is not
+    known, and `DEFAULT_LIST_SIZE`
+    for plain list fields. The `edges` of a connection are not multiplied
+    again. Introspection fields are free.
+
+    Weights are declared on graphene types next to the fields they price:
+
+        class ProductQuery(graphene.ObjectType):
+            cost_hints = {"search_products": 10}
+
+    Args:
+        schema (GraphQLSchema): The executable schema.
+        operation (OperationDefinitionNode): The operation to measure.
+        fragments (dict): Fragment definitions of the document by name.
+        variables (dict): Variable values, or None to price every variable
+            `first` at the page size cap.
+
+    Returns:
+        Complexity: `(depth, cost)` of the operation.
+    """
+    root_type = schema.get_root_type(operation.operation)
+    if root_type is None:
+        return Complexity(0, 0)
+
+    values = {}
+    if variables is not None:
+        for definition in operation.variable_definitions or ():
+            if definition.default_value is not None:
+                values[definition.variable.name.value] = value_from_ast(
+                    definition.default_value
+                )
+        values.update(variables)
+
+    return _measure(
+        root_type, operation.selection_set, fragments, values, complexity_settings()
+    )
+
+
+def _measure(parent_type, selection_set, fragments, variables, options, seen=()):
+    depth = cost = 0
+    for node, node_type, path in iter_fields(
+        parent_type, selection_set, fragments, seen
+    ):
+        name = node.name.value
+        if name.startswith("__"):
+            continue
+        field = getattr(node_type, "fields", {}).get(name)
+        if field is None:
+            continue
+
+        child_depth = child_cost = 0
+        if node.selection_set is not None:
+            child_depth, child_cost = _measure(
+                get_named_type(field.type),
+                node.selection_set,
+                fragments,
+                variables,
+                options,
+                path,
+            )
+
+        size = _list_size(node, field, variables, options)
+        depth = max(depth, child_depth + 1)
+        cost += _weight(node_type, name) + size * child_cost
+    return Complexity(depth, cost)
+
+
+def iter_fields(parent_type, selection_set, fragments, seen=()):
+    """
+    Yield `(field_node, parent_type, seen)` for every field of
+    `selection_set`, expanding fragments onto the type they are conditioned
+    on. `seen` holds the fragments expanded on the way, so a fragment cycle
+    cannot recurse forever.
+    """
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            yield selection, parent_type, seen
+            continue
+
+        path = seen
+        if isinstance(selection, FragmentSpreadNode):
+            name = selection.name.value
+            if name in seen or name not in fragments:
+                continue
+            path = (*seen, name)
+            selection = fragments[name]
+        elif not isinstance(selection, InlineFragmentNode):
+            continue
+
+        fragment_type = parent_type
+        if selection.type_condition is not None:
+            fragment_type = _schema_type(parent_type, selection.type_condition)
+        yield from iter_fields(fragment_type, selection.selection_set, fragments, path)
+
+
+def _schema_type(parent_type, type_condition):
+    name = type_condition.name.value
+    if getattr(parent_type, "name", None) == name:
+        return parent_type
+    for possible_type in getattr(parent_type, "types", ()):
+        if possible_type.name == name:
+            return possible_type
+    return parent_type
+
+
+def _list_size(node, field, variables, options):
+    max_limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+    for argument in node.arguments:
+        if argument.name.value not in ("first", "last"):
+            continue
+        value = None
+        if isinstance(argument.value, IntValueNode):
+            value = int(argument.value.value)
+        elif isinstance(argument.value, VariableNode):
+            value = variables.get(argument.value.name.value)
+        if not isinstance(value, int):
+            return max_limit or options["DEFAULT_LIST_SIZE"]
+        # Pagination never returns more than the page size cap.
+        return min(max(value, 0), max_limit) if max_limit else max(value, 0)
+
+    if isinstance(get_nullable_type(field.type), GraphQLList):
+        return 1 if node.name.value == "edges" else options["DEFAULT_LIST_SIZE"]
+    return 1
+
+
+def _weight(parent_type, name):
+    # Query and Mutation are assembled from one class per app, so hints are
+    # looked up along the whole MRO.
+    graphene_type = getattr(parent_type, "graphene_type", None)
+    for cls in getattr(graphene_type, "__mro__", ()):
+        for field_name, weight in vars(cls).get("cost_hints", {}).items():
+            if to_camel_case(field_name) == name:
+                return weight
+    return 1
+
+
+def complexity_errors(complexity, node=None):
+    """
+    Return the errors for a `complexity` over the configured limits.
+    """
+    options = complexity_settings()
+    errors = []
+    if complexity.depth > options["MAX_DEPTH"]:
+        errors.append(
+            GraphQLError(
+                f"Query depth {complexity.depth} exceeds the maximum of "
+                f"{options['MAX_DEPTH']}.",
+                node,
+                extensions={"code": "QUERY_TOO_DEEP"},
+            )
+        )
+    if complexity.cost > options["MAX_COST"]:
+        errors.append(
+            GraphQLError(
+                f"Query cost {complexity.cost} exceeds the maximum of "
+                f"{options['MAX_COST']}.",
+                node,
+                extensions={"code": "QUERY_TOO_COMPLEX"},
+            )
+        )
+    return errors
+
+
+class QueryComplexityRule(ValidationRule):
+    """
+    Reject operations deeper than `MAX_DEPTH` or costlier than `MAX_COST`.
+
+    Variables are not known during validation, so a `first: $count` is
+    priced at the page size cap. Documents passing this rule are therefore
+    within the limits for any variable values, and can be cached as valid.
+    """
+
+    def enter_operation_definition(self, node, *_args):
+        fragments = {
+            definition.name.value: definition
+            for definition in self.context.document.definitions
+            if isinstance(definition, FragmentDefinitionNode)
+        }
+        complexity = measure(self.context.schema, node, fragments)
+        for error in complexity_errors(complexity, node):
+            self.report_error(error)
+        return SKIP
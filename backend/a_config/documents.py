@@ -0,0 +1,83 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+PERSISTED_QUERY_PREFIX = "graphql:apq:"
+
+
+def query_hash(query):
+    """
+    Return the sha256 hex digest used by Apollo's automatic persisted queries.
+    """
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+class DocumentCache:
+    """
+    A bounded, thread-safe LRU of parsed and validated GraphQL documents.
+
+    Documents are keyed by the sha256 of their query text, so a repeated
+    operation skips both `parse()` and `validate()`. Only documents that
+    passed validation are stored.
+
+    Attributes:
+        maxsize (int): Number of documents kept before the least recently
+            used one is evicted.
+
+    Example:
+        >>> documents = DocumentCache(maxsize=2)
+        >>> documents.set("abc", document)
+        >>> documents.get("abc") is document
+        True
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            document = self._documents.get(key)
+            if document is not None:
+                self._documents.move_to_end(key)
+            return document
+
+    def set(self, key, document):
+        with self._lock:
+            self._documents[key] = document
+            self._documents.move_to_end(key)
+            while len(self._documents) > self.maxsize:
+                self._documents.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+
+    def __len__(self):
+        return len(self._documents)
+
+
+documents = DocumentCache(getattr(settings, "GRAPHQL_DOCUMENT_CACHE_SIZE", 256))
+
+
+def get_persisted_query(sha256):
+    """
+    Return the query text registered under `sha256`, or None.
+    """
+    return cache.get(PERSISTED_QUERY_PREFIX + sha256)
+
+
+def register_persisted_query(sha256, query):
+    """
+    Remember `query` under `sha256` in the shared cache so every worker can
+    serve later hash-only requests.
+    """
+    cache.set(
+        PERSISTED_QUERY_PREFIX + sha256,
+        query,
+        getattr(settings, "GRAPHQL_PERSISTED_QUERY_TIMEOUT", None),
+    )
@@ -0,0 +1,147 @@
+import atexit
+import json
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+
+logger = logging.getLogger("graphql.operations")
+
+DEFAULTS = {
+    # Share of successful operations that are logged; failures always are.
+    "SAMPLE_RATE": 1.0,
+    # "operation" logs the name only, "variables" adds the redacted
+    # variables and "full" also adds the query text.
+    "MODE": "operation",
+    # Variable names (case-insensitive, at any depth) whose values are
+    # replaced by REDACTED.
+    "REDACT": (
+        "password",
+        "password1",
+        "password2",
+        "oldPassword",
+        "newPassword",
+        "token",
+        "refreshToken",
+    ),
+}
+
+REDACTED = "[REDACTED]"
+
+
+def logging_settings():
+    return {**DEFAULTS, **getattr(settings, "GRAPHQL_LOGGING", {})}
+
+
+def redact(value, names):
+    """
+    Return a copy of `value` with the entries named in `names` masked.
+
+    Args:
+        value: Decoded JSON variables.
+        names (frozenset): Lower-cased keys to mask.
+    """
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if key.lower() in names else redact(item, names)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [redact(item, names) for item in value]
+    return value
+
+
+class OperationLog:
+    """
+    Decides whether an operation is logged and builds its log line.
+
+    `should_log` is all a successful, unsampled request pays for, so the
+    payload is only assembled for operations that are actually written.
+    """
+
+    def __init__(self, options=None):
+        options = options or logging_settings()
+        self.sample_rate = options["SAMPLE_RATE"]
+        self.mode = options["MODE"]
+        self.redact = frozenset(name.lower() for name in options["REDACT"])
+
+    def should_log(self, failed):
+        if not logger.isEnabledFor(logging.INFO):
+            return False
+        return failed or self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def emit(self, operation, status, duration, variables=None, query=None, **extra):
+        payload = {
+            "operation": operation,
+            "status": status,
+            "duration_ms": round(duration * 1000, 2),
+            **extra,
+        }
+        if self.mode in ("variables", "full") and variables:
+            payload["variables"] = redact(variables, self.redact)
+        if self.mode == "full" and query:
+            payload["query"] = query
+        logger.info(operation, extra={"graphql": payload})
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as one JSON object per line.
+
+    The `graphql` payload attached by `OperationLog` is merged into the
+    object; other records are written with their message.
+    """
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        payload = getattr(record, "graphql", None)
+        if payload is not None:
+            data.update(payload)
+        else:
+            data["message"] = record.getMessage()
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+class QueueLogHandler(QueueHandler):
+    """
+    Hand records to a background thread that writes them.
+
+    The request thread only enqueues; formatting and I/O happen in a
+    `QueueListener` feeding `handler` (stderr with `JsonFormatter` by
+    default). Use it from `LOGGING` with the `()` factory key.
+    """
+
+    def __init__(self, handler=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        if handler is None:
+            handler = logging.StreamHandler()
+            handler.setFormatter(JsonFormatter())
+        self.listener = QueueListener(self.queue, handler, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def prepare(self, record):
+        # The listener's handler does the formatting; keep the record as is
+        # apart from what cannot cross threads.
+        record.exc_text = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Dropping a log line beats blocking a request on a slow sink.
+            pass
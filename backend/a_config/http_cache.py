@@ -0,0 +1,109 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from graphql import OperationType, get_named_type
+
+from a_config.complexity import iter_fields
+
+DEFAULTS = {
+    # Seconds a browser or proxy may reuse a response without revalidating.
+    "MAX_AGE": 60,
+    # Seconds a proxy may keep serving a stale response while it revalidates.
+    "STALE_WHILE_REVALIDATE": 300,
+    # Dotted path to a callable returning the current data version. Every
+    # write to the data behind the cacheable fields must change it.
+    "VERSION": "shop.cache.catalogue_version",
+    # Root query fields that may be cached...
+    "ROOT_FIELDS": (),
+    # ...and the only object types their selections may reach.
+    "TYPES": (),
+}
+
+
+def http_cache_settings():
+    return {**DEFAULTS, **getattr(settings, "GRAPHQL_HTTP_CACHE", {})}
+
+
+def is_cacheable(request, schema, operation_ast, fragments, options=None):
+    """
+    Return whether the response to `operation_ast` is the same for every
+    visitor and may be cached by browsers and proxies.
+
+    That is the case for anonymous GET queries whose root fields are all
+    in `ROOT_FIELDS` and whose selections reach only `TYPES`.
+    """
+    options = options or http_cache_settings()
+    if (
+        request.method not in ("GET", "HEAD")
+        or operation_ast is None
+        or operation_ast.operation != OperationType.QUERY
+        or "Authorization" in request.headers
+        or getattr(getattr(request, "user", None), "is_authenticated", False)
+    ):
+        return False
+
+    root_fields = set(options["ROOT_FIELDS"])
+    types = set(options["TYPES"])
+    for node, _parent, _seen in iter_fields(
+        schema.query_type, operation_ast.selection_set, fragments
+    ):
+        if node.name.value == "__typename":
+            continue
+        if node.name.value not in root_fields:
+            return False
+    return _reaches_only(
+        schema.query_type, operation_ast.selection_set, fragments, types
+    )
+
+
+def _reaches_only(parent_type, selection_set, fragments, types):
+    for node, node_type, seen in iter_fields(parent_type, selection_set, fragments):
+        if node.selection_set is None:
+            continue
+        field = getattr(node_type, "fields", {}).get(node.name.value)
+        if field is None:
+            return False
+        field_type = get_named_type(field.type)
+        if field_type.name not in types:
+            return False
+        if not _reaches_only(field_type, node.selection_set, fragments, types):
+            return False
+    return True
+
+
+def etag(document_key, variables, operation_name, options=None):
+    """
+    Return a weak validator for an operation at the current data version.
+
+    It is computed before execution, so a matching `If-None-Match` can be
+    answered with 304 without running any resolver.
+    """
+    options = options or http_cache_settings()
+    version = import_string(options["VERSION"])()
+    digest = hashlib.sha256(
+        json.dumps(
+            [document_key, variables or {}, operation_name],
+            sort_keys=True,
+            default=str,
+        ).encode()
+    ).hexdigest()[:32]
+    return f'W/"{version}-{digest}"'
+
+
+def cache_control(options=None):
+    options = options or http_cache_settings()
+    return (
+        f"public, max-age={options['MAX_AGE']}, "
+        f"stale-while-revalidate={options['STALE_WHILE_REVALIDATE']}"
+    )
+
+
+def etag_matches(request, value):
+    header = request.headers.get("If-None-Match", "")
+    if header.strip() == "*":
+        return True
+    candidates = {tag.strip() for tag in header.split(",")}
+    # Weak comparison: W/"x" and "x" match.
+    return value in candidates or value.removeprefix("W/") in candidates
@@ -0,0 +1,265 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from inspect import isawaitable
+
+from django.db import connection
+from django.db.backends.signals import connection_created
+from graphql import get_named_type, is_leaf_type
+
+DURATION_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Operation names come from clients; past this many series per histogram new
+# label values are folded into OVERFLOW_LABEL.
+MAX_SERIES = 1000
+OVERFLOW_LABEL = "__other__"
+
+# SQL counters of the innermost resolver and of the operation being run.
+_resolver_sql = ContextVar("graphql_resolver_sql", default=None)
+_operation_sql = ContextVar("graphql_operation_sql", default=None)
+
+
+class Histogram:
+    """
+    A Prometheus-style cumulative histogram, one series per label set.
+
+    Attributes:
+        name (str): Metric name.
+        documentation (str): Text for the `# HELP` line.
+        label_names (tuple): Names of the labels every observation carries.
+        buckets (tuple): Sorted upper bounds; `+Inf` is implicit.
+
+    Example:
+        >>> histogram = Histogram("job_seconds", "Job time.", ("job",))
+        >>> histogram.observe(0.2, job="import")
+    """
+
+    def __init__(self, name, documentation, label_names, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None and len(self._series) >= MAX_SERIES:
+                key = (OVERFLOW_LABEL,) * len(key)
+                series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0]
+            series[0][index] += 1
+            series[1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def collect(self):
+        """
+        Yield the lines of this histogram in the Prometheus text format.
+        """
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = [
+                (key, list(counts), total)
+                for key, (counts, total) in sorted(self._series.items())
+            ]
+        for key, counts, total in series:
+            labels = [
+                f'{name}="{_escape(value)}"'
+                for name, value in zip(self.label_names, key)
+            ]
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = ",".join([*labels, f'le="{bound}"'])
+                yield f"{self.name}_bucket{{{le}}} {cumulative}"
+            yield f"{self.name}_sum{{{','.join(labels)}}} {total}"
+            yield f"{self.name}_count{{{','.join(labels)}}} {cumulative}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Registry:
+    def __init__(self):
+        self.histograms = []
+
+    def histogram(self, *args, **kwargs):
+        histogram = Histogram(*args, **kwargs)
+        self.histograms.append(histogram)
+        return histogram
+
+    def clear(self):
+        for histogram in self.histograms:
+            histogram.clear()
+
+    def render(self):
+        """
+        Return every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+resolver_duration = registry.histogram(
+    "graphql_resolver_duration_seconds",
+    "Wall time spent in a resolver, including its middleware.",
+    ("field",),
+)
+resolver_sql_queries = registry.histogram(
+    "graphql_resolver_sql_queries",
+    "SQL queries run inside a resolver.",
+    ("field",),
+    QUERY_COUNT_BUCKETS,
+)
+resolver_sql_duration = registry.histogram(
+    "graphql_resolver_sql_duration_seconds",
+    "Time spent in SQL inside a resolver.",
+    ("field",),
+)
+operation_duration = registry.histogram(
+    "graphql_operation_duration_seconds",
+    "Wall time of a GraphQL operation, from validation to the result.",
+    ("operation",),
+)
+operation_sql_queries = registry.histogram(
+    "graphql_operation_sql_queries",
+    "SQL queries run by a GraphQL operation.",
+    ("operation",),
+    QUERY_COUNT_BUCKETS,
+)
+operation_sql_duration = registry.histogram(
+    "graphql_operation_sql_duration_seconds",
+    "Time spent in SQL by a GraphQL operation.",
+    ("operation",),
+)
+
+
+def _count_sql(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        for counter in (_operation_sql.get(), _resolver_sql.get()):
+            if counter is not None:
+                counter[0] += 1
+                counter[1] += elapsed
+
+
+def install_sql_counter(connection, **kwargs):
+    if _count_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_sql)
+
+
+# The counter stays installed on every connection: the async ORM runs
+# queries on another thread's connection, and the context variables it
+# reads travel with `sync_to_async`.
+connection_created.connect(install_sql_counter)
+
+
+@contextmanager
+def track_operation(name):
+    """
+    Record the duration and SQL usage of one GraphQL operation.
+
+    SQL is counted by a database execute wrapper and attributed both to the
+    operation and to whichever resolver `MetricsMiddleware` is running at
+    the time, including queries run through `sync_to_async`.
+
+    Args:
+        name (str): Operation name used as the `operation` label.
+    """
+    install_sql_counter(connection)
+    counter = [0, 0.0]
+    token = _operation_sql.set(counter)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _operation_sql.reset(token)
+        operation_duration.observe(elapsed, operation=name)
+        operation_sql_queries.observe(counter[0], operation=name)
+        operation_sql_duration.observe(counter[1], operation=name)
+
+
+class MetricsMiddleware:
+    """
+    Graphene middleware recording wall time and SQL usage per resolver.
+
+    Series are labelled `Type.field` rather than by response path, so list
+    items share a series. Leaf fields below the root types are skipped:
+    they are plain attribute reads, and timing every one of them would cost
+    more than it tells.
+
+    It should be the last entry of `GRAPHENE["MIDDLEWARE"]` so its timings
+    include the other middleware.
+    """
+
+    def resolve(self, next, root, info, **args):
+        schema = info.schema
+        if info.parent_type not in (
+            schema.query_type,
+            schema.mutation_type,
+        ) and is_leaf_type(get_named_type(info.return_type)):
+            return next(root, info, **args)
+
+        field = f"{info.parent_type.name}.{info.field_name}"
+        counter = [0, 0.0]
+        token = _resolver_sql.set(counter)
+        start = time.perf_counter()
+        try:
+            result = next(root, info, **args)
+        except Exception:
+            self.observe(field, start, counter)
+            raise
+        finally:
+            _resolver_sql.reset(token)
+        if isawaitable(result):
+            return self.observe_async(result, field, start, counter)
+        self.observe(field, start, counter)
+        return result
+
+    async def observe_async(self, result, field, start, counter):
+        token = _resolver_sql.set(counter)
+        try:
+            return await result
+        finally:
+            _resolver_sql.reset(token)
+            self.observe(field, start, counter)
+
+    @staticmethod
+    def observe(field, start, counter):
+        resolver_duration.observe(time.perf_counter() - start, field=field)
+        resolver_sql_queries.observe(counter[0], field=field)
+        resolver_sql_duration.observe(counter[1], field=field)
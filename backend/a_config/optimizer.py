@@ -0,0 +1,243 @@
+from django.db.models import Prefetch, QuerySet
+from graphene.utils.str_converters import to_camel_case
+from graphene_django import DjangoObjectType
+from graphql import (
+    FieldNode,
+    FragmentSpreadNode,
+    GraphQLUnionType,
+    InlineFragmentNode,
+    get_named_type,
+)
+
+
+def optimize_queryset(queryset, info, path=(), required_fields=()):
+    """
+    Shape `queryset` after the GraphQL selection set of the current field.
+
+    Scalar fields that were not requested are left out with `.only()` (which
+    defers every other column), forward relations are joined with
+    `select_related` and reverse / many-to-many relations are fetched with
+    `prefetch_related`, recursively for nested selections.
+
+    Fields the optimizer cannot map to a model field (custom resolvers) load
+    every column of their model unless the type declares `optimizer_hints`:
+
+        class CartItemType(DjangoObjectType):
+            optimizer_hints = {"total_price": {"only": ("quantity", "product")}}
+
+    Args:
+        queryset (QuerySet): The unevaluated queryset returned by a resolver.
+        info (GraphQLResolveInfo): The resolve info of that resolver.
+        path (tuple): Field names leading from the current field to the rows,
+            e.g. `("edges", "node")` for a connection.
+        required_fields (tuple): Model fields the caller reads itself, such
+            as the ordering fields of a cursor.
+
+    Returns:
+        QuerySet: The optimized queryset, or `queryset` unchanged when it
+        cannot be optimized safely.
+    """
+    if not _can_optimize(queryset):
+        return queryset
+
+    graphql_type = info.return_type
+    nodes = info.field_nodes
+    for name in path:
+        graphql_type = get_named_type(graphql_type).fields[name].type
+        nodes = [
+            node
+            for node in _sub_selections(nodes)
+            if isinstance(node, FieldNode) and node.name.value == name
+        ]
+        if not nodes:
+            return queryset
+
+    object_type = _object_type_for(graphql_type, queryset.model)
+    if object_type is None:
+        return queryset
+
+    fields = _collect_fields(info, _sub_selections(nodes), object_type._meta.name)
+    only, select_related, prefetch = _plan(info, queryset.model, object_type, fields)
+    only.update(required_fields)
+    return _apply(queryset, only, select_related, prefetch)
+
+
+def _can_optimize(queryset):
+    query = queryset.query
+    return (
+        queryset._result_cache is None
+        and queryset._fields is None
+        and not query.combinator
+        and query.deferred_loading == (frozenset(), True)
+    )
+
+
+def _apply(queryset, only, select_related, prefetch):
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset.only(*only)
+
+
+def _plan(info, model, object_type, fields, prefix=""):
+    """
+    Work out the `only` / `select_related` / `prefetch_related` arguments
+    needed to resolve `fields` of `object_type` backed by `model`.
+    """
+    only = {prefix + model._meta.pk.name}
+    select_related = []
+    prefetch = []
+    restricted = True
+
+    graphql_type = info.schema.get_type(object_type._meta.name)
+    names = _field_names(object_type)
+    hints = getattr(object_type, "optimizer_hints", {})
+
+    for graphql_name, nodes in fields.items():
+        name = names.get(graphql_name)
+        if name is None:
+            continue
+
+        if name in hints:
+            hint = hints[name]
+            only.update(prefix + f for f in hint.get("only", ()))
+            select_related.extend(prefix + f for f in hint.get("select_related", ()))
+            continue
+
+        field = _model_field(model, name)
+        if field is None:
+            restricted = False
+            continue
+        if not field.is_relation:
+            only.add(prefix + field.name)
+            continue
+
+        related_model = field.related_model
+        related_type = _object_type_for(
+            graphql_type.fields[graphql_name].type, related_model
+        )
+        sub_fields = (
+            _collect_fields(info, _sub_selections(nodes), related_type._meta.name)
+            if related_type
+            else {}
+        )
+
+        if field.many_to_one or field.one_to_one:
+            lookup = prefix + field.name
+            if field.concrete:
+                only.add(lookup)
+            select_related.append(lookup)
+            if related_type is None:
+                only.update(
+                    f"{lookup}__{f.name}" for f in related_model._meta.concrete_fields
+                )
+                continue
+            sub_only, sub_select, sub_prefetch = _plan(
+                info, related_model, related_type, sub_fields, lookup + "__"
+            )
+            only.update(sub_only)
+            select_related.extend(sub_select)
+            prefetch.extend(sub_prefetch)
+        else:
+            related_qs = related_model._default_manager.order_by("pk")
+            if related_type is not None:
+                sub_only, sub_select, sub_prefetch = _plan(
+                    info, related_model, related_type, sub_fields
+                )
+                if field.one_to_many:
+                    sub_only.add(field.field.name)
+                related_qs = _apply(related_qs, sub_only, sub_select, sub_prefetch)
+            prefetch.append(Prefetch(prefix + _accessor_name(field), related_qs))
+
+    if not restricted:
+        only.update(prefix + f.name for f in model._meta.concrete_fields)
+    return only, select_related, prefetch
+
+
+def _object_type_for(graphql_type, model):
+    """
+    Return the DjangoObjectType for `model` behind a (possibly wrapped or
+    union) GraphQL output type.
+    """
+    named = get_named_type(graphql_type)
+    candidates = named.types if isinstance(named, GraphQLUnionType) else [named]
+    for candidate in candidates:
+        graphene_type = getattr(candidate, "graphene_type", None)
+        if (
+            graphene_type is not None
+            and issubclass(graphene_type, DjangoObjectType)
+            and issubclass(model, graphene_type._meta.model)
+        ):
+            return graphene_type
+    return None
+
+
+def _field_names(object_type):
+    """
+    Map GraphQL field names of `object_type` to their python names.
+    """
+    return {
+        getattr(field, "name", None) or to_camel_case(name): name
+        for name, field in object_type._meta.fields.items()
+    }
+
+
+def _model_field(model, name):
+    for field in model._meta.get_fields():
+        if _accessor_name(field) == name:
+            return field
+    return None
+
+
+def _accessor_name(field):
+    if field.auto_created and not field.concrete:
+        return field.get_accessor_name()
+    return field.name
+
+
+def _sub_selections(field_nodes):
+    return [
+        selection
+        for node in field_nodes
+        if node.selection_set
+        for selection in node.selection_set.selections
+    ]
+
+
+def _collect_fields(info, selections, type_name, fields=None):
+    """
+    Group the field nodes of a selection set by field name, expanding
+    fragments that apply to `type_name`.
+    """
+    if fields is None:
+        fields = {}
+    for selection in selections:
+        if isinstance(selection, FieldNode):
+            fields.setdefault(selection.name.value, []).append(selection)
+            continue
+
+        if isinstance(selection, FragmentSpreadNode):
+            selection = info.fragments[selection.name.value]
+        elif not isinstance(selection, InlineFragmentNode):
+            continue
+        condition = selection.type_condition
+        if condition is None or condition.name.value == type_name:
+            _collect_fields(info, selection.selection_set.selections, type_name, fields)
+    return fields
+
+
+class QueryOptimizerMiddleware:
+    """
+    Graphene middleware that runs `optimize_queryset` on every QuerySet
+    returned by a resolver.
+
+    It must be listed before `shop.loaders.LoaderMiddleware` so it sees the
+    queryset before it is evaluated.
+    """
+
+    def resolve(self, next, root, info, **args):
+        result = next(root, info, **args)
+        if isinstance(result, QuerySet):
+            result = optimize_queryset(result, info)
+        return result
@@ -0,0 +1,302 @@
+import base64
+import json
+from functools import partial
+
+import graphene
+from asgiref.sync import sync_to_async
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connection as db_connection
+from django.db.models import Q
+from graphene_django.settings import graphene_settings
+from graphql import GraphQLError
+
+from a_config.async_execution import is_async
+from a_config.optimizer import optimize_queryset
+
+
+class CountableConnection(graphene.relay.Connection):
+    """
+    A Relay connection with an optional `totalCount`.
+
+    The count is only computed when the client selects it. On PostgreSQL an
+    unfiltered table is estimated from the planner statistics instead of
+    running a full `COUNT(*)`.
+    """
+
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int()
+
+    def resolve_total_count(root, info):
+        return estimated_count(root.queryset)
+
+
+def estimated_count(queryset):
+    """
+    Return the row count of `queryset`, estimated when that is cheap.
+
+    Args:
+        queryset (QuerySet): The filtered, unpaginated queryset.
+
+    Returns:
+        int: `reltuples` for an unfiltered PostgreSQL table, otherwise the
+        exact `COUNT(*)`.
+    """
+    if db_connection.vendor == "postgresql" and not queryset.query.where:
+        with db_connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row and row[0] > 0:
+            return row[0]
+    return queryset.count()
+
+
+def encode_cursor(values):
+    payload = json.dumps(values, default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor made by `encode_cursor` into its list of values.
+
+    Raises:
+        GraphQLError: "Invalid cursor" unless the cursor decodes to a list
+            of strings and numbers.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, TypeError):
+        raise GraphQLError("Invalid cursor")
+    if not isinstance(values, list) or not all(
+        isinstance(value, (str, int, float)) and not isinstance(value, bool)
+        for value in values
+    ):
+        raise GraphQLError("Invalid cursor")
+    return values
+
+
+def keyset_filter(model, ordering, values):
+    """
+    Build the `WHERE` clause selecting rows strictly after `values`.
+
+    For an ordering `(a, b)` this is `a > x OR (a = x AND b > y)`, with `>`
+    replaced by `<` for descending fields.
+
+    Args:
+        model (Model): The model being paginated.
+        ordering (tuple): Field or annotation names, optionally prefixed
+            with "-".
+        values (list): The cursor values, one per ordering field.
+
+    Returns:
+        Q: The keyset condition.
+
+    Raises:
+        GraphQLError: "Invalid cursor" if `values` do not match `ordering`.
+    """
+    if len(values) != len(ordering):
+        raise GraphQLError("Invalid cursor")
+
+    condition = Q()
+    equal = Q()
+    for name, raw in zip(ordering, values):
+        descending = name.startswith("-")
+        field_name = name.lstrip("-")
+        field = _model_field(model, field_name)
+        if field is None:
+            # Annotations (e.g. a search rank) are numbers, compared as
+            # decoded from JSON.
+            if not isinstance(raw, (int, float)):
+                raise GraphQLError("Invalid cursor")
+            value = raw
+        else:
+            try:
+                value = field.to_python(raw)
+            except (ValidationError, TypeError, ValueError):
+                raise GraphQLError("Invalid cursor")
+        lookup = "lt" if descending else "gt"
+        condition |= equal & Q(**{f"{field_name}__{lookup}": value})
+        equal &= Q(**{field_name: value})
+    return condition
+
+
+def _model_field(model, name):
+    if name == "pk":
+        return model._meta.pk
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+
+def paginate(
+    queryset,
+    info,
+    connection_type,
+    ordering,
+    first=None,
+    after=None,
+    fetch_rows=None,
+):
+    """
+    Return one page of `queryset` as an instance of `connection_type`.
+
+    Pages are addressed with keyset cursors over `ordering`, so fetching a
+    deep page costs the same as fetching the first one.
+
+    Args:
+        queryset (QuerySet): The rows to paginate.
+        info (GraphQLResolveInfo): The resolve info of the connection field.
+        connection_type (type): A `CountableConnection` subclass.
+        ordering (tuple): Field or annotation names, optionally prefixed
+            with "-". The last one must be unique (usually "pk").
+        first (int): Page size, capped at `RELAY_CONNECTION_MAX_LIMIT`.
+        after (str): Cursor of the last row of the previous page.
+        fetch_rows (callable): Optional `fetch_rows(queryset, limit)` used
+            instead of slicing the queryset, e.g. to serve rows from a cache.
+            The rows must be fully loaded, so the selection-set optimizer is
+            skipped.
+
+    Returns:
+        CountableConnection: The page with `edges`, `page_info` and the
+        unpaginated queryset for `total_count`.
+    """
+    queryset, page, fields, first = _page_query(
+        queryset, info, ordering, first, after, fetch_rows
+    )
+    if fetch_rows is not None:
+        rows = fetch_rows(page, first + 1)
+    else:
+        rows = list(page[: first + 1])
+    return _connection(connection_type, queryset, rows, fields, first, after)
+
+
+async def apaginate(
+    queryset,
+    info,
+    connection_type,
+    ordering,
+    first=None,
+    after=None,
+    fetch_rows=None,
+):
+    """
+    Async variant of `paginate`, reading the page with `async for` (or
+    `fetch_rows` through `sync_to_async`).
+    """
+    queryset, page, fields, first = _page_query(
+        queryset, info, ordering, first, after, fetch_rows
+    )
+    if fetch_rows is not None:
+        rows = await sync_to_async(fetch_rows)(page, first + 1)
+    else:
+        rows = [row async for row in page[: first + 1]]
+    return _connection(connection_type, queryset, rows, fields, first, after)
+
+
+def _page_query(queryset, info, ordering, first, after, fetch_rows):
+    max_limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+    if first is None:
+        first = max_limit
+    if first < 0:
+        raise GraphQLError("Argument 'first' must be a non-negative integer.")
+    first = min(first, max_limit)
+
+    queryset = queryset.order_by(*ordering)
+    page = queryset
+    if after:
+        page = page.filter(
+            keyset_filter(queryset.model, ordering, decode_cursor(after))
+        )
+    fields = [name.lstrip("-") for name in ordering]
+    if fetch_rows is None:
+        page = optimize_queryset(
+            page,
+            info,
+            path=("edges", "node"),
+            required_fields=[f for f in fields if _model_field(queryset.model, f)],
+        )
+    return queryset, page, fields, first
+
+
+def _connection(connection_type, queryset, rows, fields, first, after):
+    has_next_page = len(rows) > first
+    rows = rows[:first]
+
+    edge_type = connection_type.Edge
+    edges = [
+        edge_type(
+            node=row,
+            cursor=encode_cursor([getattr(row, field) for field in fields]),
+        )
+        for row in rows
+    ]
+    page_info = graphene.relay.PageInfo(
+        start_cursor=edges[0].cursor if edges else None,
+        end_cursor=edges[-1].cursor if edges else None,
+        has_previous_page=bool(after),
+        has_next_page=has_next_page,
+    )
+    result = connection_type(edges=edges, page_info=page_info)
+    result.queryset = queryset
+    return result
+
+
+class KeysetConnectionField(graphene.Field):
+    """
+    A connection field paginated with keyset cursors.
+
+    The wrapped resolver returns a plain QuerySet (filtering and permission
+    checks stay where they were); this field slices out the page selected
+    by `first` / `after` (with `apaginate` on the async view). Rows are
+    ordered by the resolver's own `order_by()` if it set one, otherwise by
+    `ordering`; "pk" is appended when needed so the cursor is unique.
+
+    Example:
+        >>> all_products = KeysetConnectionField(ProductConnection, ordering=("pk",))
+    """
+
+    def __init__(self, type_, ordering=("pk",), fetch_rows=None, *args, **kwargs):
+        kwargs.setdefault("first", graphene.Int())
+        kwargs.setdefault("after", graphene.String())
+        super().__init__(type_, *args, **kwargs)
+        self.ordering = tuple(ordering)
+        self.fetch_rows = fetch_rows
+
+    def wrap_resolve(self, parent_resolver):
+        resolver = super().wrap_resolve(parent_resolver)
+        connection_resolver = partial(
+            self.connection_resolver,
+            resolver,
+            self.type,
+            self.ordering,
+            self.fetch_rows,
+        )
+        connection_resolver.is_async_capable = True
+        return connection_resolver
+
+    @staticmethod
+    def connection_resolver(
+        resolver,
+        connection_type,
+        ordering,
+        fetch_rows,
+        root,
+        info,
+        first=None,
+        after=None,
+        **args,
+    ):
+        queryset = resolver(root, info, **args)
+        ordering = tuple(queryset.query.order_by) or ordering
+        if ordering[-1].lstrip("-") not in ("pk", "id"):
+            ordering += ("pk",)
+        paginator = apaginate if is_async(info) else paginate
+        return paginator(
+            queryset, info, connection_type, ordering, first, after, fetch_rows
+        )
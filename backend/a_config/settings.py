@@ -103,6 +103,105 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory works for a single process; point this at a shared backend
+# (e.g. "django.core.cache.backends.filebased.FileBasedCache") to share the
+# catalogue cache between workers.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "shop",
+    },
+    # Local stand-in for the shared cart store (CART_BACKEND).
+    "carts": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "carts",
+    },
+}
+
+CATALOGUE_CACHE_TIMEOUT = 60 * 15
+
+# Threads resizing uploaded product images (shop.images); 0 resizes inline
+# when the upload is committed.
+PRODUCT_IMAGE_WORKERS = int(os.getenv("PRODUCT_IMAGE_WORKERS", "2"))
+
+# Serve /graphql/ with the async view; a_config/asgi.py turns it on.
+GRAPHQL_ASYNC = os.getenv("GRAPHQL_ASYNC") == "1"
+
+# Parsed GraphQL documents kept in memory per process, and how long queries
+# registered through automatic persisted queries stay in the cache (None
+# keeps them until evicted).
+GRAPHQL_DOCUMENT_CACHE_SIZE = 256
+GRAPHQL_PERSISTED_QUERY_TIMEOUT = None
+
+# A JSON array posted to /graphql/ is run as a batch sharing one request.
+# On the async view consecutive queries of a batch run concurrently when
+# GRAPHQL_BATCH_PARALLEL is set.
+GRAPHQL_BATCH_MAX_SIZE = 20
+GRAPHQL_BATCH_PARALLEL = True
+
+# One JSON line per GraphQL operation, see a_config.graphql_logging. MODE is
+# "operation" (name only), "variables" (plus redacted variables) or "full".
+GRAPHQL_LOGGING = {
+    "SAMPLE_RATE": float(os.getenv("GRAPHQL_LOG_SAMPLE_RATE", "1.0")),
+    "MODE": os.getenv("GRAPHQL_LOG_MODE", "operation"),
+}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "graphql": {"()": "a_config.graphql_logging.QueueLogHandler"},
+    },
+    "loggers": {
+        "graphql.operations": {
+            "handlers": ["graphql"],
+            "level": "INFO",
+            "propagate": False,
+        },
+    },
+}
+
+# When set, /metrics requires `Authorization: Bearer <METRICS_TOKEN>`;
+# otherwise it is only served to staff users, or to anyone with DEBUG.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Limits enforced by a_config.complexity.QueryComplexityRule.
+GRAPHQL_QUERY_COMPLEXITY = {
+    "MAX_DEPTH": 10,
+    "MAX_COST": 5000,
+    "DEFAULT_LIST_SIZE": 20,
+}
+
+# ETag / Cache-Control for anonymous catalogue queries sent with GET, see
+# a_config.http_cache. TYPES must not reach per-user data such as orders.
+GRAPHQL_HTTP_CACHE = {
+    "MAX_AGE": 60,
+    "STALE_WHILE_REVALIDATE": 300,
+    "VERSION": "shop.cache.catalogue_version",
+    "ROOT_FIELDS": (
+        "allProducts",
+        "product",
+        "allCategories",
+        "category",
+        "searchProducts",
+        "productFacets",
+    ),
+    "TYPES": (
+        "ProductType",
+        "CategoryType",
+        "ProductConnection",
+        "ProductEdge",
+        "PageInfo",
+        "ProductFacetsType",
+        "CategoryFacetType",
+        "PriceBucketType",
+    ),
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -147,7 +246,22 @@ AUTH_USER_MODEL = "account.User"
 
 GRAPHENE = {
     "SCHEMA": "a_config.schema.schema",
+    # Listed innermost first: the optimizer must see querysets before the
+    # loader middleware evaluates them, the async bridge moves both into a
+    # thread together with the resolver, and metrics time all of it.
+    "MIDDLEWARE": [
+        "a_config.optimizer.QueryOptimizerMiddleware",
+        "shop.loaders.LoaderMiddleware",
+        "a_config.async_execution.AsyncBridgeMiddleware",
+        "a_config.metrics.MetricsMiddleware",
+    ],
 }
+# Record SQL for the `_debug` field. Opt-in and sync view only: the
+# middleware wraps the connection's cursor, which LoggingGraphQLView unwraps
+# after each operation (see `after_operation`).
+GRAPHQL_DEBUG_SQL = os.getenv("GRAPHQL_DEBUG_SQL") == "1" and not GRAPHQL_ASYNC
+if GRAPHQL_DEBUG_SQL:
+    GRAPHENE["MIDDLEWARE"].append("graphene_django.debug.DjangoDebugMiddleware")
 
 AUTHENTICATION_BACKENDS = [
     "graphql_jwt.backends.JSONWebTokenBackend",
@@ -178,4 +292,26 @@ EMAIL_HOST_USER = os.environ.get("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = os.environ.get("EMAIL_HOST_USER")
 
+# Retention and pacing of `manage.py purge_stale` (shop.purge).
+PURGE_STALE = {
+    # User cart lines older than this are dropped; guest lines go with
+    # their session after SESSION_COOKIE_AGE.
+    "CART_ITEM_DAYS": 90,
+    "BATCH_SIZE": 500,
+    "SLEEP": 0.05,
+    # Also purge every this many seconds inside each server process; 0 leaves
+    # it to a scheduled `manage.py purge_stale`.
+    "INTERVAL": int(os.getenv("PURGE_STALE_INTERVAL", "0")),
+}
+
 CART_SESSION_ID = "cart"
+# Where guest carts are stored: shop.cart.SessionCartBackend,
+# shop.cart.CacheCartBackend (the CART_CACHE cache; point it at a shared
+# store such as django.core.cache.backends.redis.RedisCache when running
+# several nodes) or shop.cart.DatabaseCartBackend (CartItem rows).
+CART_BACKEND = os.getenv("CART_BACKEND", "shop.cart.SessionCartBackend")
+CART_CACHE = "carts"
+CART_TIMEOUT = 60 * 60 * 24 * 14
+# How a guest cart is merged into the user's cart on login: "sum" the
+# quantities, keep the "max" of both, or "replace" with the guest's.
+CART_MERGE_POLICY = "sum"
@@ -0,0 +1,681 @@
+import asyncio
+import hmac
+import json
+import time
+from contextvars import ContextVar
+from inspect import isawaitable
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import (
+    HttpResponse,
+    HttpResponseForbidden,
+    HttpResponseNotAllowed,
+    HttpResponseNotModified,
+)
+from django.http.response import HttpResponseBadRequest
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import ensure_csrf_cookie
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import GraphQLView, HttpError
+from graphql import (
+    ExecutionResult,
+    FieldNode,
+    FragmentDefinitionNode,
+    GraphQLError,
+    OperationType,
+    execute,
+    get_operation_ast,
+    parse,
+    specified_rules,
+    validate,
+    validate_schema,
+)
+
+from a_config.complexity import QueryComplexityRule, complexity_settings, measure
+from a_config.documents import (
+    documents,
+    get_persisted_query,
+    query_hash,
+    register_persisted_query,
+)
+from a_config.graphql_logging import OperationLog
+from a_config.http_cache import cache_control, etag, etag_matches, is_cacheable
+from a_config.metrics import registry, track_operation
+
+# Label of the operation being run. A context variable rather than a request
+# attribute, so operations of a batch that run concurrently keep their own.
+current_operation = ContextVar("graphql_current_operation", default=None)
+
+
+class NotModified(Exception):
+    """
+    Raised before execution when the client's cached response is current.
+    """
+
+
+def get_fragments(document):
+    return {
+        definition.name.value: definition
+        for definition in document.definitions
+        if isinstance(definition, FragmentDefinitionNode)
+    }
+
+
+class LoggingGraphQLView(GraphQLView):
+    """
+    The project's GraphQL endpoint.
+
+    On top of graphene-django's view it supports Apollo's automatic
+    persisted queries (APQ) and keeps parsed, validated documents in an LRU
+    keyed by the query hash, so the operations the frontend sends over and
+    over are neither re-sent in full nor re-parsed.
+
+    Anonymous catalogue queries sent with GET carry an ETag derived from
+    the catalogue version and are answered with 304 when the client still
+    has them (see `a_config.http_cache`).
+
+    Operations are priced by `QueryComplexityRule` before they run, and
+    the cost of each executed one is returned under `extensions.cost`.
+    Each operation is logged as one JSON line through `OperationLog`.
+
+    A JSON array of operations is run as a batch, up to
+    `GRAPHQL_BATCH_MAX_SIZE` of them. They share the request, so the
+    session, the user and the DataLoaders are loaded once for all of them,
+    and the answer is an array of results in the same order.
+    """
+
+    validation_rules = (*specified_rules, QueryComplexityRule)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        except NotModified:
+            response = HttpResponseNotModified()
+        return self.add_cache_headers(request, response)
+
+    def parse_body(self, request):
+        if self.get_content_type(
+            request
+        ) == "application/json" and request.body.lstrip().startswith(b"["):
+            # The view is instantiated per request, so this only affects the
+            # current one.
+            self.batch = True
+        data = super().parse_body(request)
+        if self.batch and len(data) > settings.GRAPHQL_BATCH_MAX_SIZE:
+            raise HttpError(
+                HttpResponseBadRequest(
+                    "A batch may contain at most {} operations.".format(
+                        settings.GRAPHQL_BATCH_MAX_SIZE
+                    )
+                )
+            )
+        if self.batch and not all(isinstance(entry, dict) for entry in data):
+            raise HttpError(
+                HttpResponseBadRequest("Every operation of a batch must be an object.")
+            )
+        return data
+
+    def get_response(self, request, data, show_graphiql=False):
+        start = time.perf_counter()
+        params = self.get_graphql_params(request, data)
+        query, variables, operation_name, _id = params
+
+        token = current_operation.set(None)
+        try:
+            execution_result = self.execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+            return self.build_response(
+                request, execution_result, params, start, show_graphiql
+            )
+        finally:
+            current_operation.reset(token)
+
+    def build_response(
+        self, request, execution_result, params, start, show_graphiql=False
+    ):
+        query, variables, operation_name, id = params
+
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        status_code = 200
+        if execution_result:
+            response = {}
+
+            if execution_result.errors:
+                set_rollback()
+                response["errors"] = [
+                    self.format_error(e) for e in execution_result.errors
+                ]
+
+            if execution_result.errors and any(
+                not getattr(e, "path", None) for e in execution_result.errors
+            ):
+                status_code = 400
+            else:
+                response["data"] = execution_result.data
+
+            if execution_result.extensions:
+                response["extensions"] = execution_result.extensions
+
+            if self.batch:
+                response["id"] = id
+                response["status"] = status_code
+
+            result = self.json_encode(request, response, pretty=show_graphiql)
+            self.log_operation(
+                request,
+                start,
+                execution_result,
+                status_code,
+                query,
+                variables,
+                operation_name,
+            )
+        else:
+            result = None
+
+        return result, status_code
+
+    def log_operation(
+        self,
+        request,
+        start,
+        execution_result,
+        status_code,
+        query,
+        variables,
+        operation_name,
+    ):
+        failed = bool(execution_result.errors)
+        operation_log = OperationLog()
+        if not operation_log.should_log(failed):
+            return
+        operation_log.emit(
+            current_operation.get() or operation_name or "unknown",
+            "error" if failed else "ok",
+            time.perf_counter() - start,
+            variables=variables,
+            query=query,
+            http_status=status_code,
+            errors=len(execution_result.errors or ()),
+        )
+
+    @staticmethod
+    def get_extensions(request, data):
+        extensions = request.GET.get("extensions") or data.get("extensions") or {}
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+        return extensions
+
+    def resolve_persisted_query(self, request, data, query):
+        """
+        Apply the APQ protocol to the incoming request.
+
+        Returns:
+            tuple: `(query, sha256, error)`. A hash-only request for an
+            unknown hash yields a `PersistedQueryNotFound` error, which tells
+            the client to retry with the full query so it can be registered.
+        """
+        persisted = self.get_extensions(request, data).get("persistedQuery")
+        if not persisted:
+            return query, None, None
+
+        sha256 = persisted.get("sha256Hash")
+        if persisted.get("version") != 1 or not sha256:
+            return query, None, GraphQLError("Unsupported persisted query version.")
+
+        if not query:
+            query = get_persisted_query(sha256)
+            if query is None:
+                return (
+                    None,
+                    sha256,
+                    GraphQLError(
+                        "PersistedQueryNotFound",
+                        extensions={"code": "PERSISTED_QUERY_NOT_FOUND"},
+                    ),
+                )
+            return query, sha256, None
+
+        if query_hash(query) != sha256:
+            return query, None, GraphQLError("Provided sha does not match query.")
+        register_persisted_query(sha256, query)
+        return query, sha256, None
+
+    def get_document(self, query, sha256=None):
+        """
+        Return the parsed and validated document for `query`.
+
+        Returns:
+            tuple: `(document, errors)`; `document` is None when parsing or
+            validation failed.
+        """
+        key = sha256 or query_hash(query)
+        document = documents.get(key)
+        if document is not None:
+            return document, None
+
+        try:
+            document = parse(query)
+        except GraphQLError as e:
+            return None, [e]
+
+        validation_errors = validate(
+            self.schema.graphql_schema,
+            document,
+            self.validation_rules,
+            graphene_settings.MAX_VALIDATION_ERRORS,
+        )
+        if validation_errors:
+            return None, validation_errors
+
+        documents.set(key, document)
+        return document, None
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        document, operation_ast, result = self.prepare_operation(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+        if document is None:
+            return result
+
+        with track_operation(current_operation.get()):
+            result = self.execute_document(
+                request, document, operation_ast, variables, operation_name
+            )
+        self.after_operation(request, operation_ast)
+        return self.add_cost(result, document, operation_ast, variables)
+
+    def prepare_operation(
+        self, request, data, query, variables, operation_name, show_graphiql
+    ):
+        """
+        Resolve, parse and validate the requested operation.
+
+        Raises:
+            NotModified: If the client's cached response is still current.
+
+        Returns:
+            tuple: `(document, operation_ast, result)`. When `document` is
+            None the request ends here with `result` (errors, or None to
+            render GraphiQL).
+        """
+        query, sha256, error = self.resolve_persisted_query(request, data, query)
+        if error:
+            return None, None, ExecutionResult(data=None, errors=[error])
+
+        if not query:
+            if show_graphiql:
+                return None, None, None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        schema = self.schema.graphql_schema
+        schema_validation_errors = validate_schema(schema)
+        if schema_validation_errors:
+            return (
+                None,
+                None,
+                ExecutionResult(data=None, errors=schema_validation_errors),
+            )
+
+        document_key = sha256 or query_hash(query)
+        document, errors = self.get_document(query, document_key)
+        if errors:
+            return None, None, ExecutionResult(data=None, errors=errors)
+
+        operation_ast = get_operation_ast(document, operation_name)
+        if (
+            request.method.lower() == "get"
+            and operation_ast is not None
+            and operation_ast.operation != OperationType.QUERY
+        ):
+            if show_graphiql:
+                return None, None, None
+
+            raise HttpError(
+                HttpResponseNotAllowed(
+                    ["POST"],
+                    "Can only perform a {} operation from a POST request.".format(
+                        operation_ast.operation.value
+                    ),
+                )
+            )
+
+        current_operation.set(self.get_operation_label(operation_ast, operation_name))
+        self.check_http_cache(
+            request, document, document_key, operation_ast, variables, operation_name
+        )
+        return document, operation_ast, None
+
+    def check_http_cache(
+        self, request, document, document_key, operation_ast, variables, operation_name
+    ):
+        """
+        Give cacheable catalogue queries an ETag, and stop with
+        `NotModified` before execution when the client already has it.
+        """
+        if self.batch or not is_cacheable(
+            request,
+            self.schema.graphql_schema,
+            operation_ast,
+            get_fragments(document),
+        ):
+            return
+        request.graphql_etag = etag(document_key, variables, operation_name)
+        if etag_matches(request, request.graphql_etag):
+            raise NotModified()
+
+    @staticmethod
+    def add_cache_headers(request, response):
+        validator = getattr(request, "graphql_etag", None)
+        if validator and response.status_code in (200, 304):
+            response["ETag"] = validator
+            response["Cache-Control"] = cache_control()
+            patch_vary_headers(response, ["Accept"])
+        return response
+
+    def add_cost(self, result, document, operation_ast, variables):
+        if operation_ast is not None:
+            result.extensions = {
+                **(result.extensions or {}),
+                "cost": self.get_cost(document, operation_ast, variables),
+            }
+        return result
+
+    @staticmethod
+    def get_operation_label(operation_ast, operation_name):
+        """
+        Name an operation for metrics: its operation name, or its root
+        fields for anonymous operations (e.g. `cart,allProducts`).
+        """
+        if operation_name:
+            return operation_name
+        if operation_ast is None:
+            return "unknown"
+        if operation_ast.name is not None:
+            return operation_ast.name.value
+        return ",".join(
+            selection.name.value if isinstance(selection, FieldNode) else "..."
+            for selection in operation_ast.selection_set.selections
+        )
+
+    def get_cost(self, document, operation_ast, variables):
+        complexity = measure(
+            self.schema.graphql_schema,
+            operation_ast,
+            get_fragments(document),
+            variables or {},
+        )
+        options = complexity_settings()
+        return {
+            "depth": complexity.depth,
+            "maxDepth": options["MAX_DEPTH"],
+            "cost": complexity.cost,
+            "maxCost": options["MAX_COST"],
+        }
+
+    def get_execute_options(self, request, variables, operation_name):
+        execute_options = {
+            "root_value": self.get_root_value(request),
+            "context_value": self.get_context(request),
+            "variable_values": variables,
+            "operation_name": operation_name,
+            "middleware": self.get_middleware(request),
+        }
+        if self.execution_context_class:
+            execute_options["execution_context_class"] = self.execution_context_class
+        return execute_options
+
+    @staticmethod
+    def after_operation(request, operation_ast):
+        debug = getattr(request, "django_debug", None)
+        if debug is not None:
+            # DjangoDebugMiddleware only unwraps the cursors when `_debug`
+            # is selected; never leave them wrapped on the connection.
+            debug.disable_instrumentation()
+            request.django_debug = None
+        if operation_ast is not None and operation_ast.operation == (
+            OperationType.MUTATION
+        ):
+            # Drop the DataLoaders (see `shop.loaders.get_loaders`) so later
+            # operations of a batch do not read rows cached before the write.
+            request.loaders = None
+
+    @staticmethod
+    def is_atomic(operation_ast):
+        return (
+            operation_ast is not None
+            and operation_ast.operation == OperationType.MUTATION
+            and (
+                graphene_settings.ATOMIC_MUTATIONS is True
+                or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+            )
+        )
+
+    def execute_document(
+        self, request, document, operation_ast, variables, operation_name
+    ):
+        try:
+            execute_options = self.get_execute_options(
+                request, variables, operation_name
+            )
+            if self.is_atomic(operation_ast):
+                with transaction.atomic():
+                    result = execute(
+                        self.schema.graphql_schema, document, **execute_options
+                    )
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+                return result
+
+            return execute(self.schema.graphql_schema, document, **execute_options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+
+class AsyncGraphQLView(LoggingGraphQLView):
+    """
+    `LoggingGraphQLView` executing on the event loop, for ASGI deployments.
+
+    The catalogue, cart and order lookups are async resolvers using the
+    async ORM and keyset connections page with it, so a worker can
+    interleave many requests waiting on the database or the cache. Other
+    sync resolvers, and mutations, are moved to `sync_to_async` by
+    `AsyncBridgeMiddleware`; atomic mutations run entirely in a thread,
+    since transactions cannot span awaits. Each resolver has a single
+    implementation, which the sync view runs as well.
+
+    GraphiQL is still rendered by the sync view.
+    """
+
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method.lower() == "get" and self.graphiql:
+            if self.can_display_graphiql(request, {}):
+                return super().dispatch(request, *args, **kwargs)
+
+        try:
+            response = await self.adispatch(request, *args, **kwargs)
+        except NotModified:
+            response = HttpResponseNotModified()
+        return self.add_cache_headers(request, response)
+
+    @method_decorator(ensure_csrf_cookie)
+    async def adispatch(self, request, *args, **kwargs):
+        try:
+            if request.method.lower() not in ("get", "post"):
+                raise HttpError(
+                    HttpResponseNotAllowed(
+                        ["GET", "POST"], "GraphQL only supports GET and POST requests."
+                    )
+                )
+
+            data = self.parse_body(request)
+            await sync_to_async(self.load_request_state)(request)
+
+            if self.batch:
+                responses = await self.aget_responses(request, data)
+                result = "[{}]".format(
+                    ",".join([response[0] for response in responses])
+                )
+                status_code = (
+                    responses
+                    and max(responses, key=lambda response: response[1])[1]
+                    or 200
+                )
+            else:
+                result, status_code = await self.aget_response(request, data)
+
+            return HttpResponse(
+                status=status_code, content=result, content_type="application/json"
+            )
+
+        except HttpError as e:
+            response = e.response
+            response["Content-Type"] = "application/json"
+            response.content = self.json_encode(
+                request, {"errors": [self.format_error(e)]}
+            )
+            return response
+
+    @staticmethod
+    def load_request_state(request):
+        """
+        Load the lazy user and session up front, so resolvers on the event
+        loop can read them without a query.
+        """
+        if hasattr(request, "user"):
+            request.user.is_authenticated
+        if hasattr(request, "session"):
+            request.session.keys()
+
+    async def aget_responses(self, request, data):
+        """
+        Run the operations of a batch in order.
+
+        With `GRAPHQL_BATCH_PARALLEL`, consecutive queries run concurrently;
+        every other operation waits for those before it and holds back
+        those after it, so a mutation is always seen by later operations.
+        """
+        if not settings.GRAPHQL_BATCH_PARALLEL:
+            return [await self.aget_response(request, entry) for entry in data]
+
+        responses = []
+        queries = []
+        for entry in data:
+            if self.is_query(request, entry):
+                queries.append(self.aget_response(request, entry))
+                continue
+            responses.extend(await asyncio.gather(*queries))
+            queries = []
+            responses.append(await self.aget_response(request, entry))
+        responses.extend(await asyncio.gather(*queries))
+        return responses
+
+    def is_query(self, request, data):
+        """
+        Return whether a batch entry is a valid query operation.
+        """
+        query, _variables, operation_name, _id = self.get_graphql_params(request, data)
+        query, sha256, error = self.resolve_persisted_query(request, data, query)
+        if error or not query:
+            return False
+        document, errors = self.get_document(query, sha256)
+        if errors:
+            return False
+        operation_ast = get_operation_ast(document, operation_name)
+        return (
+            operation_ast is not None and operation_ast.operation == OperationType.QUERY
+        )
+
+    async def aget_response(self, request, data, show_graphiql=False):
+        start = time.perf_counter()
+        params = self.get_graphql_params(request, data)
+        query, variables, operation_name, _id = params
+
+        token = current_operation.set(None)
+        try:
+            execution_result = await self.aexecute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+            return self.build_response(
+                request, execution_result, params, start, show_graphiql
+            )
+        finally:
+            current_operation.reset(token)
+
+    async def aexecute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        document, operation_ast, result = self.prepare_operation(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+        if document is None:
+            return result
+
+        with track_operation(current_operation.get()):
+            result = await self.aexecute_document(
+                request, document, operation_ast, variables, operation_name
+            )
+        self.after_operation(request, operation_ast)
+        return self.add_cost(result, document, operation_ast, variables)
+
+    async def aexecute_document(
+        self, request, document, operation_ast, variables, operation_name
+    ):
+        if self.is_atomic(operation_ast):
+            return await sync_to_async(self.execute_document)(
+                request, document, operation_ast, variables, operation_name
+            )
+
+        # A counter, as concurrent operations of a batch share the request.
+        request.graphql_async = getattr(request, "graphql_async", 0) + 1
+        try:
+            result = execute(
+                self.schema.graphql_schema,
+                document,
+                **self.get_execute_options(request, variables, operation_name),
+            )
+            if isawaitable(result):
+                result = await result
+            return result
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+        finally:
+            request.graphql_async -= 1
+
+
+def metrics_view(request):
+    """
+    Expose the GraphQL histograms of this process in the Prometheus text
+    format.
+
+    Denied by default: requires `Authorization: Bearer <METRICS_TOKEN>`
+    when the setting is configured, otherwise a staff user or `DEBUG`.
+    """
+    token = getattr(settings, "METRICS_TOKEN", None)
+    if token:
+        allowed = hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {token}"
+        )
+    else:
+        user = getattr(request, "user", None)
+        allowed = settings.DEBUG or bool(user and user.is_staff)
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
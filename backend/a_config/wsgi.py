@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "a_config.settings")
 
 application = get_wsgi_application()
+
+# Purge stale carts, sessions and tokens in the background when
+# PURGE_STALE["INTERVAL"] is set.
+from shop.purge import start_scheduler  # noqa: E402
+
+start_scheduler()
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0003_user_address"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="order_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:45
+
+import account.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0004_user_order_count"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="refreshtoken",
+            name="expires_at",
+            field=models.DateTimeField(
+                db_index=True,
+                default=account.models.default_expiry,
+                help_text="Expiration date and time for the token (default 7 days from creation).",
+            ),
+        ),
+    ]
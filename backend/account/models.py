@@ -12,6 +12,8 @@ def default_expiry():
 
 class User(AbstractUser):
     address = models.CharField(max_length=1000, blank=True)
+    # Maintained by `shop.counters`; `manage.py recount` repairs drift.
+    order_count = models.PositiveIntegerField(default=0, editable=False)
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = []
@@ -50,6 +52,7 @@ class RefreshToken(models.Model):
     )
     expires_at = models.DateTimeField(
         default=default_expiry,
+        db_index=True,
         help_text="Expiration date and time for the token (default 7 days from creation).",
     )
 
@@ -1,3 +1,4 @@
+import logging
 from datetime import timedelta
 
 import graphene
@@ -9,6 +10,8 @@ from django.utils import timezone
 from graphene_django import DjangoObjectType
 from graphql import GraphQLError
 
+from a_config.pagination import CountableConnection, KeysetConnectionField
+
 from .models import RefreshToken
 from .utils import (
     create_access_token,
@@ -21,13 +24,14 @@ from .utils import (
 )
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 
 # GraphQL Types
 class UserType(DjangoObjectType):
     class Meta:
         model = User
-        fields = ("id", "username", "email", "is_staff", "date_joined")
+        fields = ("id", "username", "email", "is_staff", "date_joined", "order_count")
 
 
 class RefreshTokenType(DjangoObjectType):
@@ -36,8 +40,20 @@ class RefreshTokenType(DjangoObjectType):
         fields = ("id", "token", "revoked", "created_at", "expires_at")
 
 
+class UserConnection(CountableConnection):
+    class Meta:
+        node = UserType
+
+
+class RefreshTokenConnection(CountableConnection):
+    class Meta:
+        node = RefreshTokenType
+
+
 class RefreshTokenQuery(graphene.ObjectType):
-    my_tokens = graphene.List(RefreshTokenType)
+    my_tokens = KeysetConnectionField(
+        RefreshTokenConnection, ordering=("-created_at", "-pk")
+    )
 
     def resolve_my_tokens(self, info):
         user = info.context.user
@@ -49,7 +65,7 @@ class RefreshTokenQuery(graphene.ObjectType):
 
 class UserQuery(graphene.ObjectType):
     me = graphene.Field(UserType)
-    users = graphene.List(UserType)
+    users = KeysetConnectionField(UserConnection, ordering=("pk",))
 
     def resolve_me(self, info):
         user = info.context.user
@@ -78,9 +94,6 @@ class Register(graphene.Mutation):
         password2 = graphene.String(required=True)
 
     def mutate(self, info, email, password1, password2, username=None):
-        print(
-            f"Received: email={email}, username={username}, password1={password1}, password2={password2}"
-        )
         try:
             if User.objects.filter(email=email).exists():
                 raise GraphQLError("Email already registered")
@@ -100,7 +113,7 @@ class Register(graphene.Mutation):
             user.set_password(password1)
             user.save()
 
-            print("User created successfully")
+            logger.info("User %s registered", user.pk)
             send_activation_email(user)
             return Register(
                 user_id=user.id,
@@ -110,7 +123,7 @@ class Register(graphene.Mutation):
                 success=True,
             )
         except Exception as e:
-            print(f"Error in mutation: {str(e)}")
+            logger.exception("Registration failed")
             raise GraphQLError(f"Server error: {str(e)}")
 
 
@@ -0,0 +1,326 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, When
+
+from shop import cache as catalogue_cache
+from shop import counters, facets, search
+from shop.models import Category, Product
+
+# Rows per statement; keeps `IN (...)` lists below SQLite's variable limit.
+BATCH_SIZE = 1000
+# Items accepted by one bulk call.
+MAX_ITEMS = 10000
+
+UPSERT_FIELDS = ("category", "title", "description", "price", "stock")
+
+# Set while a bulk write maintains facets, the search index and the
+# catalogue cache itself, so the per-row handlers in `shop.signals` skip.
+_bulk_write = ContextVar("shop_bulk_write", default=False)
+
+
+class BulkError(Exception):
+    """
+    Raised before anything is written when items are rejected.
+
+    Attributes:
+        errors (list): One message per rejected item, prefixed with its
+            position in the input.
+    """
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} item(s) rejected; nothing was written.")
+        self.errors = errors
+
+
+def in_bulk_write():
+    return _bulk_write.get()
+
+
+@contextmanager
+def bulk_write():
+    token = _bulk_write.set(True)
+    try:
+        yield
+    finally:
+        _bulk_write.reset(token)
+
+
+def _batches(items):
+    for start in range(0, len(items), BATCH_SIZE):
+        yield items[start : start + BATCH_SIZE]
+
+
+def _check_size(items):
+    if len(items) > MAX_ITEMS:
+        raise BulkError([f"At most {MAX_ITEMS} items can be sent at once."])
+
+
+def _facet_keys(products):
+    """
+    Map product id to facet key for `products` in the database.
+    """
+    rows = Product.objects.filter(pk__in=products).values_list(
+        "pk", "category_id", "price", "stock"
+    )
+    return {
+        pk: (category_id, facets.price_floor(price), stock > 0)
+        for pk, category_id, price, stock in rows
+    }
+
+
+def _apply_facets(old_keys, new_keys):
+    """
+    Move products between facets with one update per facet touched,
+    however many products moved, and update the category counters.
+    """
+    deltas = Counter()
+    for key in old_keys:
+        deltas[key] -= 1
+    for key in new_keys:
+        deltas[key] += 1
+    for key, delta in deltas.items():
+        facets.adjust(key, delta)
+    counters.move_products(deltas.items())
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def upsert_products(items):
+    """
+    Insert or update products by SKU in one transaction.
+
+    Every item is validated first and categories are resolved with a
+    single query. Rows are then written with `bulk_create(update_conflicts=True)`
+    in batches of `BATCH_SIZE`, and facets, the search index and the
+    catalogue cache are updated per batch instead of per row.
+
+    Args:
+        items (list[dict]): `sku`, `category_id`, `title`, `price`, `stock`
+            and optionally `description`.
+
+    Raises:
+        BulkError: If any item is invalid.
+
+    Returns:
+        tuple: `(products, created)`, the saved products in input order and
+        how many of them are new.
+
+    Example:
+        >>> upsert_products([
+        ...     {"sku": "LAMP-1", "category_id": 1, "title": "Lamp",
+        ...      "price": Decimal("19.90"), "stock": 4},
+        ... ])
+    """
+    _check_size(items)
+    categories = Category.objects.in_bulk(
+        {_to_int(item["category_id"]) for item in items} - {None}
+    )
+    skus = Counter(item["sku"] for item in items)
+    errors = []
+    products = []
+    for index, item in enumerate(items):
+        category_id = _to_int(item["category_id"])
+        try:
+            price = Decimal(item["price"])
+        except (TypeError, ValueError, InvalidOperation):
+            price = None
+        if not item["sku"]:
+            errors.append(f"{index}: SKU is required")
+        elif skus[item["sku"]] > 1:
+            errors.append(f"{index}: SKU {item['sku']} appears more than once")
+        if not item["title"]:
+            errors.append(f"{index}: Title is required")
+        if price is None or price < 0 or item["stock"] < 0:
+            errors.append(f"{index}: Price and stock must be non-negative")
+        if category_id not in categories:
+            errors.append(f"{index}: Category not found")
+        products.append(
+            Product(
+                sku=item["sku"],
+                category_id=category_id,
+                title=item["title"],
+                description=item.get("description") or "",
+                price=price,
+                stock=item["stock"],
+            )
+        )
+    if errors:
+        raise BulkError(errors)
+
+    saved = {}
+    created = 0
+    with transaction.atomic(), bulk_write():
+        for batch in _batches(products):
+            batch_skus = [product.sku for product in batch]
+            existing = dict(
+                Product.objects.filter(sku__in=batch_skus).values_list("sku", "pk")
+            )
+            old_keys = _facet_keys(existing.values())
+            Product.objects.bulk_create(
+                batch,
+                update_conflicts=True,
+                unique_fields=["sku"],
+                update_fields=UPSERT_FIELDS,
+            )
+            rows = list(Product.objects.filter(sku__in=batch_skus))
+            _apply_facets(old_keys.values(), map(facets.facet_key, rows))
+            search.index_products(rows)
+            saved.update((row.sku, row) for row in rows)
+            created += len(batch) - len(existing)
+        catalogue_cache.invalidate_products([row.pk for row in saved.values()])
+    return [saved[product.sku] for product in products], created
+
+
+def reserve_stock(quantities):
+    """
+    Take units out of stock for an order, all or nothing.
+
+    Each product is decremented by one conditional
+    `UPDATE ... SET stock = stock - n WHERE stock >= n`, so concurrent
+    checkouts can neither lose decrements nor oversell. Facets, category
+    counters and the catalogue cache are then updated once for all of them.
+
+    Args:
+        quantities (dict): Units by product id.
+
+    Raises:
+        BulkError: Naming every product with too little stock; nothing is
+            written.
+    """
+    ids = sorted(quantities)
+    with transaction.atomic(), bulk_write():
+        short = [
+            pk
+            for pk in ids
+            if not Product.objects.filter(pk=pk, stock__gte=quantities[pk]).update(
+                stock=F("stock") - quantities[pk]
+            )
+        ]
+        if short:
+            titles = dict(
+                Product.objects.filter(pk__in=short).values_list("pk", "title")
+            )
+            raise BulkError(
+                [f"Not enough stock for {titles.get(pk, pk)}" for pk in short]
+            )
+
+        # Every product held at least the units taken, so all were in stock.
+        new_keys = _facet_keys(ids)
+        old_keys = [
+            (category_id, floor, True) for category_id, floor, _ in new_keys.values()
+        ]
+        _apply_facets(old_keys, new_keys.values())
+        # Lists only change when a product sells out.
+        sold_out = any(not in_stock for _, _, in_stock in new_keys.values())
+        catalogue_cache.invalidate_products(ids, lists=sold_out)
+
+
+def adjust_stock(deltas):
+    """
+    Add signed deltas to the stock of many products in one transaction.
+
+    Each batch is a single `UPDATE` with `F("stock") + delta` per row, so
+    concurrent orders and adjustments are not lost. The rows are locked
+    and checked first: no product may end up with negative stock.
+
+    Args:
+        deltas (list[tuple]): `(product_id, delta)` pairs; repeated ids add
+            up.
+
+    Raises:
+        BulkError: If a product is missing or would go below zero.
+
+    Returns:
+        list[Product]: The adjusted products, ordered by id.
+    """
+    _check_size(deltas)
+    totals = Counter()
+    errors = []
+    for index, (product_id, delta) in enumerate(deltas):
+        pk = _to_int(product_id)
+        if pk is None:
+            errors.append(f"{index}: Product not found")
+        else:
+            totals[pk] += delta
+    if errors:
+        raise BulkError(errors)
+
+    with transaction.atomic(), bulk_write():
+        stock = {}
+        for batch in _batches(sorted(totals)):
+            stock.update(
+                Product.objects.select_for_update()
+                .filter(pk__in=batch)
+                .values_list("pk", "stock")
+            )
+        for index, (product_id, delta) in enumerate(deltas):
+            pk = _to_int(product_id)
+            if pk not in stock:
+                errors.append(f"{index}: Product not found")
+            elif stock[pk] + totals[pk] < 0:
+                errors.append(f"{index}: Not enough stock for product {pk}")
+        if errors:
+            raise BulkError(errors)
+
+        ids = sorted(pk for pk, delta in totals.items() if delta)
+        restocked = False
+        for batch in _batches(ids):
+            old_keys = _facet_keys(batch)
+            Product.objects.filter(pk__in=batch).update(
+                stock=Case(
+                    *(When(pk=pk, then=F("stock") + totals[pk]) for pk in batch),
+                    default=F("stock"),
+                    output_field=PositiveIntegerField(),
+                )
+            )
+            new_keys = _facet_keys(batch)
+            _apply_facets(old_keys.values(), new_keys.values())
+            restocked = restocked or old_keys != new_keys
+        # Lists only change when a product sells out or comes back in stock.
+        catalogue_cache.invalidate_products(ids, lists=restocked)
+        products = []
+        for batch in _batches(sorted(stock)):
+            products.extend(Product.objects.filter(pk__in=batch).order_by("pk"))
+        return products
+
+
+def delete_products(ids):
+    """
+    Delete many products in one transaction.
+
+    Raises:
+        BulkError: If a product does not exist.
+        ProtectedError: If a product appears on an order.
+
+    Returns:
+        int: The number of products deleted.
+    """
+    _check_size(ids)
+    pks = [_to_int(pk) for pk in ids]
+    with transaction.atomic(), bulk_write():
+        old_keys = {}
+        for batch in _batches(sorted(set(pks) - {None})):
+            old_keys.update(_facet_keys(batch))
+        errors = [
+            f"{index}: Product not found"
+            for index, pk in enumerate(pks)
+            if pk not in old_keys
+        ]
+        if errors:
+            raise BulkError(errors)
+
+        for batch in _batches(sorted(old_keys)):
+            Product.objects.filter(pk__in=batch).delete()
+            search.remove_products(batch)
+        _apply_facets(old_keys.values(), ())
+        catalogue_cache.invalidate_products(list(old_keys))
+    return len(old_keys)
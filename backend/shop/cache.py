@@ -0,0 +1,267 @@
+import hashlib
+import time
+import uuid
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import transaction
+from django.db.models.fields.files import FieldFile
+
+from shop.models import Category, Product
+
+VERSION_KEY = "catalogue:version"
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 0.05
+LOCK_RETRIES = 40
+
+
+def cache_timeout():
+    return getattr(settings, "CATALOGUE_CACHE_TIMEOUT", 60 * 15)
+
+
+def catalogue_version():
+    """
+    Return the current catalogue version.
+
+    The version is bumped by every product or category change that can
+    alter a list. Cached id lists embed it in their key, so such a change
+    makes all of them unreachable at once while single rows are
+    invalidated one by one.
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, None)
+
+
+def get_or_compute(key, compute, timeout=None):
+    """
+    Read `key` from the cache, computing and storing it on a miss.
+
+    Only one caller computes a missing value at a time (single-flight): the
+    others wait for it to appear instead of all hitting the database when a
+    popular key expires. If the holder of the lock takes too long, waiters
+    compute the value themselves rather than fail.
+
+    Args:
+        key (str): Cache key.
+        compute (callable): Returns the value to cache; must not return None.
+        timeout (int): Expiry in seconds, defaults to CATALOGUE_CACHE_TIMEOUT.
+
+    Returns:
+        The cached or freshly computed value.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f"{key}:lock"
+    token = uuid.uuid4().hex
+    if not cache.add(lock_key, token, LOCK_TIMEOUT):
+        for _ in range(LOCK_RETRIES):
+            time.sleep(LOCK_WAIT)
+            value = cache.get(key)
+            if value is not None:
+                return value
+        return compute()
+
+    try:
+        value = compute()
+        cache.set(key, value, timeout or cache_timeout())
+        return value
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+# region Row serialization
+
+
+@lru_cache(maxsize=None)
+def _row_layout(model):
+    """
+    Return the attnames of `model`'s concrete fields and a short signature
+    of them.
+
+    Rows are cached as positional lists, so the signature is part of the
+    row key: after a deploy that adds, drops or retypes a field, rows
+    cached by the old code are simply never read and the new code falls
+    back to the database.
+    """
+    fields = model._meta.concrete_fields
+    names = tuple(field.attname for field in fields)
+    layout = ",".join(f"{f.attname}:{f.get_internal_type()}" for f in fields)
+    return names, hashlib.md5(layout.encode()).hexdigest()[:8]
+
+
+def _row_key(model, pk):
+    return f"catalogue:{model._meta.model_name}:{_row_layout(model)[1]}:{pk}"
+
+
+def _dump(instance):
+    values = []
+    for name in _row_layout(type(instance))[0]:
+        value = getattr(instance, name)
+        if isinstance(value, FieldFile):
+            value = value.name
+        values.append(value)
+    return values
+
+
+def _load(model, values):
+    names = _row_layout(model)[0]
+    return model.from_db(model._default_manager.db, names, values)
+
+
+def cache_rows(instances):
+    """
+    Store fully loaded model instances in the row cache.
+    """
+    cache.set_many(
+        {_row_key(type(obj), obj.pk): _dump(obj) for obj in instances},
+        cache_timeout(),
+    )
+
+
+def get_rows(model, ids):
+    """
+    Return `{pk: instance}` for `ids`, reading the row cache first and
+    fetching every miss with one query.
+
+    Raises:
+        ValidationError: If one of `ids` is not a valid primary key.
+    """
+    ids = list(dict.fromkeys(model._meta.pk.to_python(pk) for pk in ids))
+    keys = {_row_key(model, pk): pk for pk in ids}
+    cached = cache.get_many(keys)
+    rows = {keys[key]: _load(model, values) for key, values in cached.items()}
+
+    missing = [pk for pk in ids if pk not in rows]
+    if missing:
+        fetched = model._default_manager.in_bulk(missing)
+        cache_rows(fetched.values())
+        rows.update(fetched)
+    return rows
+
+
+async def aget_rows(model, ids):
+    """
+    Async variant of `get_rows`, for resolvers using the async ORM.
+    """
+    ids = list(dict.fromkeys(model._meta.pk.to_python(pk) for pk in ids))
+    keys = {_row_key(model, pk): pk for pk in ids}
+    cached = await cache.aget_many(keys)
+    rows = {keys[key]: _load(model, values) for key, values in cached.items()}
+
+    missing = [pk for pk in ids if pk not in rows]
+    if missing:
+        fetched = await model._default_manager.ain_bulk(missing)
+        await cache.aset_many(
+            {_row_key(model, pk): _dump(obj) for pk, obj in fetched.items()},
+            cache_timeout(),
+        )
+        rows.update(fetched)
+    return rows
+
+
+def get_products(ids):
+    return get_rows(Product, ids)
+
+
+def get_categories(ids):
+    return get_rows(Category, ids)
+
+
+# endregion
+# region Lists
+
+
+def all_categories():
+    """
+    Return every category, ordered by id.
+    """
+    key = f"catalogue:v{catalogue_version()}:categories"
+    ids = get_or_compute(
+        key, lambda: list(Category.objects.order_by("pk").values_list("pk", flat=True))
+    )
+    rows = get_categories(ids)
+    return [rows[pk] for pk in ids if pk in rows]
+
+
+def fetch_page(queryset, limit):
+    """
+    Return the first `limit` rows of `queryset` through the catalogue cache.
+
+    The id list is cached under the catalogue version and the SQL of the
+    query, and the rows themselves in the row cache. A warm page costs no
+    query at all; a cold one costs the same single query as before.
+
+    Used as the `fetch_rows` hook of `KeysetConnectionField`.
+    """
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return []
+    digest = hashlib.sha1(f"{sql}|{params}|{limit}".encode()).hexdigest()
+    key = f"catalogue:v{catalogue_version()}:page:{digest}"
+
+    fetched = {}
+
+    def compute():
+        rows = list(queryset[:limit])
+        cache_rows(rows)
+        fetched.update((row.pk, row) for row in rows)
+        return [row.pk for row in rows]
+
+    ids = get_or_compute(key, compute)
+    rows = fetched or get_rows(queryset.model, ids)
+    return [rows[pk] for pk in ids if pk in rows]
+
+
+# endregion
+# region Invalidation
+
+
+def _invalidate(model, ids, lists):
+    cache.delete_many([_row_key(model, pk) for pk in ids])
+    if lists:
+        bump_version()
+
+
+def invalidate(model, ids, lists=True):
+    """
+    Drop the cached rows of `ids` and, with `lists`, every cached list.
+
+    Lists only hold ids, so a change that cannot add, remove or reorder a
+    row in any list (stock that stays above zero, counters, images) should
+    pass `lists=False`: the lists and the ETags derived from the catalogue
+    version then stay valid.
+
+    Runs immediately and again when the surrounding transaction commits, so
+    a reader that repopulates the cache between the write and the commit
+    cannot leave a stale row behind.
+    """
+    ids = list(ids)
+    _invalidate(model, ids, lists)
+    transaction.on_commit(lambda: _invalidate(model, ids, lists))
+
+
+def invalidate_products(ids, lists=True):
+    invalidate(Product, ids, lists)
+
+
+def invalidate_categories(ids, lists=True):
+    invalidate(Category, ids, lists)
+
+
+# endregion
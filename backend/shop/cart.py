@@ -1,31 +1,404 @@
+import hashlib
+import json
+import uuid
+from collections import namedtuple
 from decimal import Decimal
-from django.conf import settings
-from shop.models import Product
 
-from decimal import Decimal
 from django.conf import settings
-from shop.models import Product  # adjust import according to your app structure
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from shop import cache as catalogue_cache
+from shop.bulk import MAX_ITEMS, BulkError
+from shop.models import CartItem, Product
+
+CartSummary = namedtuple("CartSummary", ("items", "total_items", "total_price"))
+
+
+def snapshot(product):
+    """
+    Return the compact product data kept in the session cart.
+
+    The `version` is a digest of the other fields, so a stored snapshot is
+    known to be stale as soon as the product's title, price or image change.
+
+    Example:
+        >>> snapshot(product)
+        {'title': 'Lamp', 'price': '20.00', 'image': 'products/lamp.png', 'version': '4f1c...'}
+    """
+    data = {
+        "title": product.title,
+        "price": str(product.price),
+        "image": product.image.name if product.image else "",
+    }
+    encoded = json.dumps(data, sort_keys=True).encode()
+    data["version"] = hashlib.sha1(encoded).hexdigest()[:12]
+    return data
+
+
+# region Stored carts
+
+# How `merge_quantities` combines a quantity with the one already stored.
+MERGE_POLICIES = ("sum", "max", "replace")
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def _column(model, name):
+    return connection.ops.quote_name(model._meta.get_field(name).column)
+
+
+def _merged_quantity(policy, column):
+    existing = f"{_table(CartItem)}.{column}"
+    if policy == "sum":
+        return f"{existing} + excluded.{column}"
+    if policy == "max":
+        greatest = "MAX" if connection.vendor == "sqlite" else "GREATEST"
+        return f"{greatest}({existing}, excluded.{column})"
+    return f"excluded.{column}"
+
+
+def merge_quantities(user, quantities, policy="sum"):
+    """
+    Insert or update the cart lines of `user` in one statement per batch.
+
+    Uses `INSERT ... ON CONFLICT DO UPDATE` on the partial unique index of
+    user lines, so concurrent merges cannot lose updates and the number of
+    queries does not depend on the number of lines.
+
+    Args:
+        user (User): Owner of the cart lines.
+        quantities (dict): Quantity by product id.
+        policy (str): One of `MERGE_POLICIES`: add to the stored quantity,
+            keep the larger one, or overwrite it.
+
+    Raises:
+        ValueError: If `policy` is unknown.
+
+    Example:
+        >>> merge_quantities(user, {12: 2, 15: 1}, policy="max")
+    """
+    if policy not in MERGE_POLICIES:
+        raise ValueError(f"Unknown cart merge policy {policy!r}.")
+    if not quantities:
+        return
+
+    fields = ["user", "product", "quantity", "added_at", "updated_at"]
+    user_id, product_id, quantity, added_at, updated_at = (
+        _column(CartItem, name) for name in fields
+    )
+    now = timezone.now()
+    rows = [(user.pk, pk, n, now, now) for pk, n in quantities.items()]
+    batch_size = connection.ops.bulk_batch_size(fields, rows) or len(rows)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start : start + batch_size]
+            values = ", ".join(["(%s, %s, %s, %s, %s)"] * len(batch))
+            cursor.execute(
+                f"INSERT INTO {_table(CartItem)} "
+                f"({user_id}, {product_id}, {quantity}, {added_at}, {updated_at}) "
+                f"VALUES {values} "
+                f"ON CONFLICT ({user_id}, {product_id}) WHERE {user_id} IS NOT NULL "
+                f"DO UPDATE SET {quantity} = {_merged_quantity(policy, quantity)}, "
+                f"{updated_at} = excluded.{updated_at}",
+                [value for row in batch for value in row],
+            )
+
+
+class UserCart:
+    """
+    The stored cart of a signed-in user, read lazily.
+
+    Totals come from one aggregate query and lines are only loaded if
+    asked for, so rendering the item count does not fetch any line.
+
+    Attributes:
+        items (QuerySet): The user's `CartItem` rows.
+        lines (QuerySet): The same, annotated with `line_total`.
+    """
+
+    def __init__(self, user):
+        self.items = CartItem.objects.filter(user=user)
+        self.lines = self.items.annotate(line_total=F("quantity") * F("product__price"))
+        self._totals = None
+
+    def totals(self):
+        """
+        Return `{"total_items": int, "total_price": Decimal}`, computed once.
+        """
+        if self._totals is None:
+            self._totals = self.items.aggregate(
+                total_items=Coalesce(Sum("quantity"), 0),
+                total_price=Coalesce(
+                    Sum(F("quantity") * F("product__price")),
+                    Value(Decimal(0)),
+                    output_field=DecimalField(),
+                ),
+            )
+        return self._totals
+
+
+def add_quantity(user, product_id, quantity):
+    """
+    Add `quantity` units of a product to the cart of `user` in one statement.
+
+    The line is created or incremented with `INSERT ... SELECT ... ON
+    CONFLICT DO UPDATE`, and only if the product exists and has stock for
+    the resulting quantity, so concurrent adds neither lose increments nor
+    exceed the stock. No `Product` row is read separately.
+
+    The line is read back with `RETURNING` where the database supports it
+    (SQLite 3.35+, PostgreSQL), otherwise with a second query in the same
+    transaction.
+
+    Returns:
+        CartItem: The updated line, or None if the product does not exist
+        or has too little stock.
+    """
+    items, products = _table(CartItem), _table(Product)
+    item_id, user_id, item_product, item_quantity, added_at, updated_at = (
+        _column(CartItem, name)
+        for name in ("id", "user", "product", "quantity", "added_at", "updated_at")
+    )
+    pk, stock = _column(Product, "id"), _column(Product, "stock")
+    returning = connection.features.can_return_rows_from_bulk_insert
+    sql = (
+        f"INSERT INTO {items} "
+        f"({user_id}, {item_product}, {item_quantity}, {added_at}, {updated_at}) "
+        f"SELECT %s, {pk}, %s, %s, %s FROM {products} "
+        f"WHERE {pk} = %s AND {stock} >= %s "
+        f"ON CONFLICT ({user_id}, {item_product}) WHERE {user_id} IS NOT NULL "
+        f"DO UPDATE SET {item_quantity} = {items}.{item_quantity} + %s, "
+        f"{updated_at} = excluded.{updated_at} "
+        f"WHERE {items}.{item_quantity} + %s <= ("
+        f"SELECT {stock} FROM {products} "
+        f"WHERE {products}.{pk} = {items}.{item_product})"
+    )
+    if returning:
+        sql += f" RETURNING {item_id}, {item_quantity}"
+    now = timezone.now()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, [user.pk, quantity, now, now, product_id] + [quantity] * 3)
+        if returning:
+            row = cursor.fetchone()
+        elif cursor.rowcount:
+            row = (
+                CartItem.objects.filter(user=user, product_id=product_id)
+                .values_list("pk", "quantity")
+                .first()
+            )
+        else:
+            row = None
+    if row is None:
+        return None
+    return CartItem(pk=row[0], user=user, product_id=product_id, quantity=row[1])
+
+
+# endregion
+
+
+# region Backends
+
+
+class CartBackend:
+    """
+    Storage of one guest cart, the dict held by `Cart.cart`.
+
+    Subclasses implement `load`, `save` and `clear`.
+
+    Attributes:
+        stores_snapshots (bool): Whether `save` keeps the product snapshots.
+            Backends that only store quantities are not written to when a
+            snapshot is merely refreshed.
+    """
+
+    stores_snapshots = True
+
+    def __init__(self, request):
+        self.request = request
+        self.session = request.session
+
+    def load(self):
+        raise NotImplementedError
+
+    def save(self, cart):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class SessionCartBackend(CartBackend):
+    """
+    Keep the cart in the session under `settings.CART_SESSION_ID`.
+    """
+
+    def load(self):
+        cart = self.session.get(settings.CART_SESSION_ID)
+        if not isinstance(cart, dict):
+            # Create a new empty cart in the session
+            cart = self.session[settings.CART_SESSION_ID] = {}
+        return cart
+
+    def save(self, cart):
+        self.session[settings.CART_SESSION_ID] = cart
+        self.session.modified = True
+
+    def clear(self):
+        self.session.pop(settings.CART_SESSION_ID, None)
+        self.session.modified = True
+
+
+class KeyedCartBackend(CartBackend):
+    """
+    Base for backends storing carts outside the session.
+
+    The session only holds a random cart key under `CART_SESSION_ID`. It
+    survives the session key being cycled on login, unlike the session key.
+    """
+
+    def key(self, create=False):
+        key = self.session.get(settings.CART_SESSION_ID)
+        if not isinstance(key, str):
+            key = None
+        if key is None and create:
+            key = self.session[settings.CART_SESSION_ID] = uuid.uuid4().hex
+        return key
+
+    def clear(self):
+        key = self.key()
+        if key is not None:
+            self.delete(key)
+        self.session.pop(settings.CART_SESSION_ID, None)
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class CacheCartBackend(KeyedCartBackend):
+    """
+    Keep carts in the `settings.CART_CACHE` cache, e.g. a Redis instance
+    shared by all nodes, for `CART_TIMEOUT` seconds after the last change.
+    """
+
+    @property
+    def cache(self):
+        return caches[settings.CART_CACHE]
+
+    def load(self):
+        key = self.key()
+        if key is None:
+            return {}
+        return self.cache.get(f"cart:{key}") or {}
+
+    def save(self, cart):
+        self.cache.set(f"cart:{self.key(create=True)}", cart, settings.CART_TIMEOUT)
+
+    def delete(self, key):
+        self.cache.delete(f"cart:{key}")
+
+
+class DatabaseCartBackend(KeyedCartBackend):
+    """
+    Keep guest carts as `CartItem` rows with the cart key in `session_key`.
+
+    Only quantities are stored; snapshots are rebuilt from the catalogue
+    cache when the cart is read.
+    """
+
+    stores_snapshots = False
+
+    def items(self, key):
+        return CartItem.objects.filter(user=None, session_key=key)
+
+    def load(self):
+        key = self.key()
+        if key is None:
+            return {}
+        return {
+            str(product_id): {"quantity": quantity}
+            for product_id, quantity in self.items(key).values_list(
+                "product_id", "quantity"
+            )
+        }
+
+    def save(self, cart):
+        key = self.key(create=True)
+        quantities = {int(pk): entry["quantity"] for pk, entry in cart.items()}
+        with transaction.atomic():
+            stored = {item.product_id: item for item in self.items(key)}
+            self.items(key).exclude(product_id__in=quantities).delete()
+            changed = []
+            now = timezone.now()
+            for product_id, quantity in quantities.items():
+                item = stored.get(product_id)
+                if item is not None and item.quantity != quantity:
+                    item.quantity = quantity
+                    item.updated_at = now
+                    changed.append(item)
+            CartItem.objects.bulk_update(changed, ["quantity", "updated_at"])
+            CartItem.objects.bulk_create(
+                CartItem(session_key=key, product_id=product_id, quantity=quantity)
+                for product_id, quantity in quantities.items()
+                if product_id not in stored
+            )
+
+    def delete(self, key):
+        self.items(key).delete()
+
+
+def get_backend(request):
+    """
+    Return an instance of the `settings.CART_BACKEND` class for `request`.
+    """
+    return import_string(settings.CART_BACKEND)(request)
+
+
+def line_owner(request):
+    """
+    Return the `CartItem` filter selecting the lines of the request's cart:
+    the user's, or a guest cart kept by `DatabaseCartBackend`. Returns None
+    when the cart has no `CartItem` rows.
+    """
+    if request.user.is_authenticated:
+        return {"user": request.user}
+    backend = get_backend(request)
+    key = backend.key() if isinstance(backend, DatabaseCartBackend) else None
+    return {"user": None, "session_key": key} if key else None
+
+
+# endregion
 
 
 class Cart:
     """
-    A session-based shopping cart class.
+    A guest shopping cart class.
 
-    This class manages cart data using Django's session framework.
-    It allows adding, updating, removing, and iterating over cart items.
-    Each user's cart is stored in their session under a key defined by
-    `settings.CART_SESSION_ID`.
+    This class manages cart data stored by a `CartBackend`: the session
+    (the default), a shared cache or the database, as configured by
+    `settings.CART_BACKEND`. It allows adding, updating, removing, and
+    iterating over cart items.
 
     Attributes:
         session (SessionBase): The current user's session.
+        backend (CartBackend): Where the cart is loaded from and saved to.
         cart (dict): The dictionary that holds cart data, where keys are
             product IDs (as strings) and values are dictionaries containing
-            quantity and price information.
+            the quantity and a `snapshot()` of the product.
 
     Example:
         >>> cart = Cart(request)
         >>> cart.add(product, quantity=2)
         >>> total = cart.get_total_price()
+
+    Products are revalidated against the catalogue cache at most once per
+    instance; `summary` is memoized until the cart changes.
     """
 
     def __init__(self, request):
@@ -34,18 +407,16 @@ class Cart:
 
         Args:
             request (HttpRequest): The current HTTP request object containing
-                the session where cart data will be stored.
+                the session.
 
         Behavior:
-            - Retrieves the cart from the session if it exists.
-            - If not, creates an empty cart dictionary in the session.
+            - Loads the cart from `get_backend(request)`.
         """
         self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            # Create a new empty cart in the session
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        self.cart = cart
+        self.backend = get_backend(request)
+        self.cart = self.backend.load()
+        self._items = None
+        self._summary = None
 
     def add(self, product, quantity=1, override_quantity=False):
         """
@@ -59,14 +430,15 @@ class Cart:
 
         Behavior:
             - Converts product ID to string (since session data must be serializable).
-            - If the product is not in the cart, initializes it with price and quantity.
+            - If the product is not in the cart, initializes it with a product
+              snapshot and quantity.
             - Updates the quantity accordingly.
-            - Calls `save()` to mark the session as modified.
+            - Calls `save()` to store the cart.
         """
         product_id = str(product.id)
         if product_id not in self.cart:
-            # Store initial cart item with quantity 0 and product price as string
-            self.cart[product_id] = {"quantity": 0, "price": str(product.price)}
+            # Store initial cart item with quantity 0 and the product snapshot
+            self.cart[product_id] = {"quantity": 0, **snapshot(product)}
         if override_quantity:
             self.cart[product_id]["quantity"] = quantity
         else:
@@ -75,13 +447,37 @@ class Cart:
 
     def save(self):
         """
-        Mark the session as modified.
+        Store the cart with the backend.
 
         Behavior:
-            Ensures that Django knows the session data has changed,
-            so it will be saved at the end of the request.
+            Writes the cart (for the session backend, marks the session as
+            modified so it is saved at the end of the request) and drops the
+            memoized items and summary.
         """
-        self.session.modified = True
+        self.backend.save(self.cart)
+        self._items = None
+        self._summary = None
+
+    def update(self, quantities, products):
+        """
+        Set the quantities of several products and save once.
+
+        Args:
+            quantities (dict): New quantity by product id; 0 removes the line.
+            products (dict): Products by id, to snapshot newly added lines.
+        """
+        for product_id, quantity in quantities.items():
+            key = str(product_id)
+            if quantity <= 0:
+                self.cart.pop(key, None)
+            elif key in self.cart:
+                self.cart[key]["quantity"] = quantity
+            else:
+                self.cart[key] = {
+                    "quantity": quantity,
+                    **snapshot(products[product_id]),
+                }
+        self.save()
 
     def remove(self, product):
         """
@@ -91,8 +487,8 @@ class Cart:
             product (Product): The product instance to remove.
 
         Behavior:
-            - Deletes the product from the session-based cart if it exists.
-            - Calls `save()` to update the session.
+            - Deletes the product from the cart if it exists.
+            - Calls `save()` to store the cart.
         """
         product_id = str(product.id)
         if product_id in self.cart:
@@ -101,7 +497,7 @@ class Cart:
 
     def __iter__(self):
         """
-        Iterate over the items in the cart and fetch products from the database.
+        Iterate over the items in the cart.
 
         Yields:
             dict: Each cart item containing:
@@ -111,19 +507,76 @@ class Cart:
                 - "total_price": price * quantity
 
         Behavior:
-            - Fetches all product objects corresponding to IDs stored in the cart.
-            - Enriches cart items with full product objects and computed total prices.
-        """
-        product_ids = self.cart.keys()
-        products = Product.objects.filter(id__in=product_ids)
-        for product in products:
-            item = self.cart[
-                str(product.id)
-            ].copy()  # Make a copy to avoid mutating session
-            item["product"] = product
-            item["price"] = Decimal(item["price"])
-            item["total_price"] = item["price"] * item["quantity"]
-            yield item
+            - Looks all products up in one batched catalogue cache read, the
+              first time only (see `items()`).
+        """
+        return iter(self.items())
+
+    def items(self):
+        """
+        Return the cart items, revalidated against the catalogue.
+
+        Returns:
+            list[dict]: The items as yielded by `__iter__`.
+        """
+        if self._items is None:
+            products = catalogue_cache.get_products(self.cart) if self.cart else {}
+            if self._revalidate(products):
+                self.backend.save(self.cart)
+        return self._items
+
+    def _revalidate(self, products):
+        """
+        Build the items from `products` (`{pk: Product}`), refreshing stale
+        snapshots and dropping products that no longer exist.
+
+        Returns:
+            bool: Whether the cart must be saved.
+        """
+        items = []
+        changed = False
+        for product_id, entry in list(self.cart.items()):
+            product = products.get(int(product_id))
+            if product is None:
+                del self.cart[product_id]
+                changed = True
+                continue
+            current = snapshot(product)
+            if entry.get("version") != current["version"]:
+                entry.update(current)
+                changed = changed or self.backend.stores_snapshots
+            items.append(self._item(product))
+        self._items = items
+        return changed
+
+    def _item(self, product):
+        item = self.cart[
+            str(product.id)
+        ].copy()  # Make a copy to avoid mutating session
+        item["product"] = product
+        item["price"] = Decimal(item["price"])
+        item["total_price"] = item["price"] * item["quantity"]
+        return item
+
+    @staticmethod
+    def _summarize(items):
+        return CartSummary(
+            items=items,
+            total_items=sum(item["quantity"] for item in items),
+            total_price=sum((item["total_price"] for item in items), Decimal(0)),
+        )
+
+    @property
+    def summary(self):
+        """
+        The revalidated items with their totals, computed once.
+
+        Returns:
+            CartSummary: `(items, total_items, total_price)`.
+        """
+        if self._summary is None:
+            self._summary = self._summarize(self.items())
+        return self._summary
 
     def __len__(self):
         """
@@ -141,17 +594,103 @@ class Cart:
         Returns:
             Decimal: The sum of (price * quantity) for all items.
         """
-        return sum(
-            Decimal(item["price"]) * item["quantity"] for item in self.cart.values()
-        )
+        return self.summary.total_price
 
     def clear(self):
         """
-        Remove the cart from the session completely.
+        Remove the cart completely.
 
         Behavior:
-            - Deletes the cart entry from the session.
-            - Calls `save()` to ensure the session updates are applied.
+            - Deletes the cart from the backend and its entry from the session.
+            - Resets the memoized items and summary.
         """
-        del self.session[settings.CART_SESSION_ID]
-        self.save()
+        self.backend.clear()
+        self.cart = {}
+        self._items = None
+        self._summary = None
+
+
+def update_cart(request, changes):
+    """
+    Apply several line changes to the request's cart in one transaction.
+
+    Everything is validated before anything is written. Signed-in users'
+    lines are read with one locking query, then written with one delete
+    and one `merge_quantities` upsert. A guest cart is saved once.
+
+    Args:
+        request (HttpRequest): The current request.
+        changes (list): `(product_id, quantity, delta)` tuples with exactly
+            one of `quantity` (the new quantity; 0 removes the line) and
+            `delta` (added to the current quantity) set.
+
+    Returns:
+        UserCart | Cart: The updated cart.
+
+    Raises:
+        BulkError: With one message per rejected change.
+    """
+    if len(changes) > MAX_ITEMS:
+        raise BulkError([f"At most {MAX_ITEMS} items can be sent at once."])
+    errors = []
+    parsed = {}
+    for index, (product_id, quantity, delta) in enumerate(changes):
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            errors.append(f"{index}: Product not found")
+            continue
+        if (quantity is None) == (delta is None):
+            errors.append(f"{index}: Pass either quantity or delta")
+        elif product_id in parsed:
+            errors.append(f"{index}: Product {product_id} appears more than once")
+        else:
+            parsed[product_id] = (index, quantity, delta)
+    if errors:
+        raise BulkError(errors)
+
+    user = request.user
+    products = catalogue_cache.get_products(parsed) if parsed else {}
+    with transaction.atomic():
+        if user.is_authenticated:
+            cart = None
+            current = dict(
+                CartItem.objects.select_for_update()
+                .filter(user=user, product_id__in=parsed)
+                .values_list("product_id", "quantity")
+            )
+        else:
+            cart = Cart(request)
+            current = {
+                int(pk): entry["quantity"]
+                for pk, entry in cart.cart.items()
+                if int(pk) in parsed
+            }
+
+        quantities = {}
+        for product_id, (index, quantity, delta) in parsed.items():
+            if quantity is None:
+                quantity = current.get(product_id, 0) + delta
+            product = products.get(product_id)
+            if quantity < 0:
+                errors.append(f"{index}: Quantity cannot be negative")
+            elif quantity and product is None:
+                errors.append(f"{index}: Product not found")
+            elif quantity and quantity > product.stock:
+                errors.append(f"{index}: Not enough stock for {product.title}")
+            quantities[product_id] = quantity
+        if errors:
+            raise BulkError(errors)
+
+        if cart is not None:
+            cart.update(quantities, products)
+            return cart
+        removed = [pk for pk, quantity in quantities.items() if not quantity]
+        if removed:
+            CartItem.objects.filter(user=user, product_id__in=removed).delete()
+        merge_quantities(
+            user,
+            {pk: quantity for pk, quantity in quantities.items() if quantity},
+            policy="replace",
+        )
+    return UserCart(user)
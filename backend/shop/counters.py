@@ -0,0 +1,115 @@
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    OuterRef,
+    PositiveIntegerField,
+    Q,
+    Subquery,
+    Sum,
+    When,
+)
+from django.db.models.functions import Coalesce
+
+from shop import cache as catalogue_cache
+from shop.models import Category, Order, OrderItem, Product
+
+User = get_user_model()
+
+
+def _add(field, deltas):
+    """
+    Return an expression adding `deltas[pk]` to `field` on each row.
+    """
+    return Case(
+        *(When(pk=pk, then=F(field) + delta) for pk, delta in deltas.items()),
+        default=F(field),
+        output_field=PositiveIntegerField(),
+    )
+
+
+def move_products(facet_deltas):
+    """
+    Update `Category.product_count` and `in_stock_count` after products
+    moved between facets.
+
+    Args:
+        facet_deltas (iterable): `(facet_key, delta)` pairs as produced for
+            `shop.facets.adjust`; keys may be None.
+    """
+    products = Counter()
+    in_stock = Counter()
+    for key, delta in facet_deltas:
+        if key is None:
+            continue
+        category_id, _floor, stocked = key
+        products[category_id] += delta
+        if stocked:
+            in_stock[category_id] += delta
+    ids = [
+        pk for pk in products.keys() | in_stock.keys() if products[pk] or in_stock[pk]
+    ]
+    if not ids:
+        return
+    Category.objects.filter(pk__in=ids).update(
+        product_count=_add("product_count", products),
+        in_stock_count=_add("in_stock_count", in_stock),
+    )
+    catalogue_cache.invalidate_categories(ids, lists=False)
+
+
+def record_order(user, quantities):
+    """
+    Count a new order for `user` and its units in `Product.units_sold`.
+
+    Args:
+        user (User): The buyer, or None for a guest order.
+        quantities (dict): Units ordered by product id.
+    """
+    if quantities:
+        Product.objects.filter(pk__in=quantities).update(
+            units_sold=_add("units_sold", quantities)
+        )
+        catalogue_cache.invalidate_products(quantities, lists=False)
+    if user is not None:
+        User.objects.filter(pk=user.pk).update(order_count=F("order_count") + 1)
+
+
+# region Recount
+
+
+def _count(queryset, aggregate):
+    return Coalesce(Subquery(queryset.annotate(n=aggregate).values("n")[:1]), 0)
+
+
+def recount_categories(ids):
+    products = Product.objects.filter(category=OuterRef("pk")).values("category")
+    Category.objects.filter(pk__in=ids).update(
+        product_count=_count(products, Count("pk")),
+        in_stock_count=_count(products, Count("pk", filter=Q(stock__gt=0))),
+    )
+    catalogue_cache.invalidate_categories(ids, lists=False)
+
+
+def recount_products(ids):
+    items = OrderItem.objects.filter(product=OuterRef("pk")).values("product")
+    Product.objects.filter(pk__in=ids).update(units_sold=_count(items, Sum("quantity")))
+    catalogue_cache.invalidate_products(ids, lists=False)
+
+
+def recount_users(ids):
+    orders = Order.objects.filter(user=OuterRef("pk")).values("user")
+    User.objects.filter(pk__in=ids).update(order_count=_count(orders, Count("pk")))
+
+
+# Model and recount function per counter table, for `manage.py recount`.
+RECOUNTS = {
+    "categories": (Category, recount_categories),
+    "products": (Product, recount_products),
+    "users": (User, recount_users),
+}
+
+# endregion
@@ -0,0 +1,129 @@
+import csv
+import json
+from datetime import datetime, time, timedelta
+from itertools import groupby, islice
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from shop.models import Order
+
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+ORDER_FIELDS = ("order_id", "created_at", "status", "user_id", "user_email", "total")
+ITEM_FIELDS = ("item_id", "product_id", "product_title", "quantity", "price")
+
+# One row per order item; orders without items still give one row, with
+# the item columns empty (LEFT OUTER JOIN).
+COLUMNS = (
+    "pk",
+    "created_at",
+    "status",
+    "user_id",
+    "user__email",
+    "total",
+    "items__pk",
+    "items__product_id",
+    "items__product__title",
+    "items__quantity",
+    "items__price",
+)
+
+
+def _start_of(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def order_rows(since=None, until=None, statuses=None, chunk_size=2000):
+    """
+    Yield flat order / order item tuples, ordered by order.
+
+    Rows are fetched with `.iterator(chunk_size=...)`, which uses a
+    server-side cursor where the database supports it, so memory use does
+    not grow with the number of orders.
+
+    Args:
+        since (date): First day to include.
+        until (date): Last day to include.
+        statuses (list): Order statuses to include; all when empty.
+    """
+    orders = Order.objects.all()
+    if since:
+        orders = orders.filter(created_at__gte=_start_of(since))
+    if until:
+        orders = orders.filter(created_at__lt=_start_of(until + timedelta(days=1)))
+    if statuses:
+        orders = orders.filter(status__in=statuses)
+    rows = orders.order_by("pk", "items__pk").values_list(*COLUMNS)
+    return rows.iterator(chunk_size=chunk_size)
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def write_csv(rows):
+    """
+    Yield the header and then one CSV line per order item.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(ORDER_FIELDS + ITEM_FIELDS)
+    for row in rows:
+        yield writer.writerow(map(_csv_value, row))
+
+
+def write_ndjson(rows):
+    """
+    Yield one JSON line per order, with its items nested.
+    """
+    for _order_id, group in groupby(rows, key=lambda row: row[0]):
+        items = list(group)
+        order = dict(zip(ORDER_FIELDS, items[0][: len(ORDER_FIELDS)]))
+        order["items"] = [
+            dict(zip(ITEM_FIELDS, row[len(ORDER_FIELDS) :]))
+            for row in items
+            if row[len(ORDER_FIELDS)] is not None
+        ]
+        yield json.dumps(order, cls=DjangoJSONEncoder) + "\n"
+
+
+def export_orders(format, **filters):
+    """
+    Return an iterator of text chunks exporting orders in `format`.
+
+    Args:
+        format (str): "csv" or "ndjson".
+        **filters: Passed to `order_rows`.
+
+    Example:
+        >>> for chunk in export_orders("ndjson", statuses=["paid"]):
+        ...     out.write(chunk)
+    """
+    rows = order_rows(**filters)
+    if format == "csv":
+        return write_csv(rows)
+    return write_ndjson(rows)
+
+
+async def astream(chunks, batch_size=500):
+    """
+    Serve a sync iterator of chunks to an async consumer without reading it
+    all into memory.
+
+    Chunks are pulled `batch_size` at a time in Django's sync thread, which
+    keeps the database cursor on one connection.
+    """
+    take = sync_to_async(lambda: list(islice(chunks, batch_size)))
+    while batch := await take():
+        for chunk in batch:
+            yield chunk
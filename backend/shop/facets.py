@@ -0,0 +1,124 @@
+from bisect import bisect_right
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from shop.models import Product, ProductFacet
+
+# Lower bounds of the price histogram buckets. Changing them requires a
+# `rebuild()` so existing facet rows move to the new buckets.
+PRICE_BUCKETS = [
+    Decimal(floor) for floor in ("0", "10", "25", "50", "100", "250", "500", "1000")
+]
+
+
+def price_floor(price):
+    """
+    Return the lower bound of the histogram bucket containing `price`.
+    """
+    index = max(bisect_right(PRICE_BUCKETS, Decimal(price)) - 1, 0)
+    return PRICE_BUCKETS[index]
+
+
+def bucket_ceiling(floor):
+    """
+    Return the (exclusive) upper bound of the bucket starting at `floor`,
+    or None for the last bucket.
+    """
+    index = PRICE_BUCKETS.index(floor)
+    return PRICE_BUCKETS[index + 1] if index + 1 < len(PRICE_BUCKETS) else None
+
+
+def facet_key(product):
+    """
+    Return the facet a product is counted in, as `(category_id, floor, in_stock)`.
+    """
+    return (product.category_id, price_floor(product.price), product.stock > 0)
+
+
+def adjust(key, delta):
+    """
+    Add `delta` to the count of the facet identified by `key`.
+
+    The update is a single `F()` expression, so concurrent writers do not
+    lose increments. A missing row is created on the first increment.
+    """
+    if key is None or not delta:
+        return
+    category_id, floor, in_stock = key
+    facets = ProductFacet.objects.filter(
+        category_id=category_id, price_floor=floor, in_stock=in_stock
+    )
+    with transaction.atomic():
+        if facets.update(count=F("count") + delta) or delta < 0:
+            return
+        ProductFacet.objects.get_or_create(
+            category_id=category_id,
+            price_floor=floor,
+            in_stock=in_stock,
+            defaults={"count": 0},
+        )
+        facets.update(count=F("count") + delta)
+
+
+def move(old_key, new_key):
+    """
+    Move one product from `old_key` to `new_key`.
+    """
+    if old_key == new_key:
+        return
+    adjust(old_key, -1)
+    adjust(new_key, 1)
+
+
+def rebuild():
+    """
+    Recompute every facet from the product table.
+
+    Used to fill the table initially and to repair drift; request handling
+    only ever calls `adjust`.
+    """
+    counts = {}
+    rows = Product.objects.values_list("category_id", "price", "stock")
+    for category_id, price, stock in rows.iterator(chunk_size=2000):
+        key = (category_id, price_floor(price), stock > 0)
+        counts[key] = counts.get(key, 0) + 1
+
+    with transaction.atomic():
+        ProductFacet.objects.all().delete()
+        ProductFacet.objects.bulk_create(
+            ProductFacet(
+                category_id=category_id,
+                price_floor=floor,
+                in_stock=in_stock,
+                count=count,
+            )
+            for (category_id, floor, in_stock), count in counts.items()
+        )
+
+
+async def facet_counts(category_slug=None, in_stock_only=False):
+    """
+    Read category counts and the price histogram from the facet table.
+
+    Category counts ignore `category_slug`, so the sidebar can still show
+    the other categories; the price histogram is restricted to it.
+
+    Returns:
+        tuple: `(category_counts, price_counts)` where `category_counts`
+        maps category id to count and `price_counts` maps bucket floor to
+        count (empty buckets included).
+    """
+    facets = ProductFacet.objects.filter(count__gt=0)
+    if in_stock_only:
+        facets = facets.filter(in_stock=True)
+    categories = facets.values_list("category_id").annotate(total=Sum("count"))
+    if category_slug:
+        facets = facets.filter(category__slug=category_slug)
+    prices = facets.values_list("price_floor").annotate(total=Sum("count"))
+
+    price_counts = dict.fromkeys(PRICE_BUCKETS, 0)
+    async for floor, total in prices:
+        price_counts[price_floor(floor)] += total
+    return {pk: total async for pk, total in categories}, price_counts
@@ -0,0 +1,152 @@
+import hashlib
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from shop import cache as catalogue_cache
+from shop.models import Product
+
+logger = logging.getLogger(__name__)
+
+# Widths variants are generated at; an image narrower than one of them is
+# not upscaled, its own width is used instead.
+WIDTHS = (160, 320, 640, 1280)
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+QUALITY = 80
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.PRODUCT_IMAGE_WORKERS,
+            thread_name_prefix="product-images",
+        )
+    return _executor
+
+
+def variant_name(name, digest, width, format):
+    """
+    Return the storage name of a variant, next to the original.
+
+    Example:
+        >>> variant_name("products/lamp.png", "9f86d081884c7d65", 320, "webp")
+        'products/lamp.9f86d081884c.320w.webp'
+    """
+    stem = posixpath.splitext(name)[0]
+    return f"{stem}.{digest[:12]}.{width}w.{format}"
+
+
+def render_variants(name, data):
+    """
+    Resize an image to every width in `WIDTHS` and encode it in `FORMATS`.
+
+    Args:
+        name (str): Storage name of the original.
+        data (bytes): Its content.
+
+    Returns:
+        list[tuple]: `(variant, bytes)` pairs, where `variant` is the
+        `{"width", "format", "name"}` dict stored on the product.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    with Image.open(BytesIO(data)) as original:
+        original = ImageOps.exif_transpose(original).convert("RGB")
+        widths = sorted({min(width, original.width) for width in WIDTHS})
+        rendered = []
+        for width in widths:
+            height = max(round(original.height * width / original.width), 1)
+            image = original.resize((width, height), Image.LANCZOS)
+            for format, pil_format in FORMATS.items():
+                out = BytesIO()
+                image.save(out, pil_format, quality=QUALITY)
+                variant = {
+                    "width": width,
+                    "format": format,
+                    "name": variant_name(name, digest, width, format),
+                }
+                rendered.append((variant, out.getvalue()))
+    return rendered
+
+
+def generate_variants(product_id):
+    """
+    Create the variants of a product's current image and record them.
+
+    Variant names contain a hash of the original, so existing files are
+    reused and a replaced image never serves old variants. The result is
+    only saved if the product still has the image that was processed.
+    """
+    product = Product.objects.filter(pk=product_id).only("image").first()
+    if product is None or not product.image:
+        return
+    name = product.image.name
+    with default_storage.open(name, "rb") as original:
+        data = original.read()
+
+    variants = []
+    for variant, content in render_variants(name, data):
+        if not default_storage.exists(variant["name"]):
+            default_storage.save(variant["name"], ContentFile(content))
+        variants.append(variant)
+
+    updated = Product.objects.filter(pk=product_id, image=name).update(
+        image_variants={"source": name, "variants": variants}
+    )
+    if updated:
+        catalogue_cache.invalidate_products([product_id], lists=False)
+
+
+def _run(product_id):
+    try:
+        generate_variants(product_id)
+    except Exception:
+        logger.exception("Generating image variants of product %s failed", product_id)
+    finally:
+        close_old_connections()
+
+
+def schedule(product_id):
+    """
+    Generate variants in the background once the current transaction
+    commits. With `PRODUCT_IMAGE_WORKERS = 0` they are generated inline.
+    """
+    if settings.PRODUCT_IMAGE_WORKERS:
+        transaction.on_commit(lambda: _get_executor().submit(_run, product_id))
+    else:
+        transaction.on_commit(lambda: generate_variants(product_id))
+
+
+def needs_variants(product):
+    variants = product.image_variants or {}
+    return bool(product.image) and variants.get("source") != product.image.name
+
+
+def pick_variant(product, width, format="webp"):
+    """
+    Return the storage name of the variant closest to `width`: the
+    narrowest one at least as wide, or else the widest. Falls back to the
+    original until variants exist.
+    """
+    if not product.image:
+        return None
+    variants = [
+        variant
+        for variant in (product.image_variants or {}).get("variants", ())
+        if variant["format"] == format
+    ]
+    if not variants or needs_variants(product):
+        return product.image.name
+    wide_enough = [variant for variant in variants if variant["width"] >= width]
+    if wide_enough:
+        return min(wide_enough, key=lambda variant: variant["width"])["name"]
+    return max(variants, key=lambda variant: variant["width"])["name"]
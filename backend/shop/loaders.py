@@ -0,0 +1,246 @@
+from collections import defaultdict
+from inspect import isawaitable
+
+from django.db.models import F, Model, QuerySet
+
+from shop import cache as catalogue_cache
+from shop.models import OrderItem, Product
+
+
+class DataLoader:
+    """
+    A synchronous, per-request batching loader.
+
+    Keys are collected in a queue and resolved together by `batch_load_fn`
+    the first time one of them is requested, so a relation that is read for
+    every row of a list costs a single `IN (...)` query instead of one query
+    per row. Results are cached for the rest of the request.
+
+    Attributes:
+        batch_load_fn (callable): Receives a list of keys and returns a list
+            of values in the same order.
+
+    Example:
+        >>> loader = DataLoader(lambda ids: [Category.objects.in_bulk(ids).get(i) for i in ids])
+        >>> loader.enqueue([1, 2, 3])
+        >>> loader.load(1)  # one query for 1, 2 and 3
+    """
+
+    def __init__(self, batch_load_fn):
+        self.batch_load_fn = batch_load_fn
+        self._cache = {}
+        self._queue = {}
+
+    def enqueue(self, keys):
+        """
+        Queue keys to be fetched with the next batch.
+        """
+        for key in keys:
+            if key is not None and key not in self._cache:
+                self._queue[key] = None
+
+    def prime(self, key, value):
+        """
+        Store an already known value so it is never fetched.
+        """
+        self._cache.setdefault(key, value)
+
+    def load(self, key):
+        """
+        Return the value for `key`, fetching every queued key on a miss.
+        """
+        if key not in self._cache:
+            self._queue[key] = None
+            self.dispatch()
+        return self._cache[key]
+
+    def load_many(self, keys):
+        self.enqueue(keys)
+        return [self.load(key) for key in keys]
+
+    def dispatch(self):
+        """
+        Resolve all queued keys with a single call to `batch_load_fn`.
+        """
+        keys = [key for key in self._queue if key not in self._cache]
+        self._queue.clear()
+        if keys:
+            self._cache.update(zip(keys, self.batch_load_fn(keys)))
+
+    def clear(self, key=None):
+        if key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(key, None)
+
+
+# region Batch functions
+
+
+def load_products(ids):
+    products = catalogue_cache.get_products(ids)
+    return [products.get(pk) for pk in ids]
+
+
+def load_categories(ids):
+    categories = catalogue_cache.get_categories(ids)
+    return [categories.get(pk) for pk in ids]
+
+
+def load_products_by_category(category_ids):
+    grouped = defaultdict(list)
+    products = Product.objects.filter(category_id__in=category_ids).order_by("id")
+    for product in products:
+        grouped[product.category_id].append(product)
+    return [grouped[pk] for pk in category_ids]
+
+
+def load_items_by_order(order_ids):
+    grouped = defaultdict(list)
+    for item in OrderItem.objects.filter(order_id__in=order_ids).order_by("id"):
+        grouped[item.order_id].append(item)
+    return [grouped[pk] for pk in order_ids]
+
+
+def load_products_by_order(order_ids):
+    grouped = defaultdict(list)
+    products = (
+        Product.objects.filter(orders__id__in=order_ids)
+        .annotate(loader_order_id=F("orders__id"))
+        .order_by("id")
+        .distinct()
+    )
+    for product in products:
+        grouped[product.loader_order_id].append(product)
+    return [grouped[pk] for pk in order_ids]
+
+
+# endregion
+
+
+class ShopLoaders:
+    """
+    The set of DataLoaders used while executing one GraphQL request.
+
+    Besides the loaders themselves, this keeps track of which model instances
+    were returned together by a list field ("siblings"). When a relation is
+    requested for one instance, the keys of all its siblings are queued too,
+    so the whole level is fetched in one query.
+
+    Example:
+        >>> loaders = get_loaders(info)
+        >>> loaders.load_from(loaders.category, product)
+    """
+
+    def __init__(self):
+        self._siblings = {}
+        self.product = DataLoader(load_products)
+        self.category = DataLoader(load_categories)
+        self.products_by_category = DataLoader(
+            self._register_groups(load_products_by_category)
+        )
+        self.items_by_order = DataLoader(self._register_groups(load_items_by_order))
+        self.products_by_order = DataLoader(
+            self._register_groups(load_products_by_order)
+        )
+        self._key_fns = {
+            self.product: lambda obj: obj.product_id,
+            self.category: lambda obj: obj.category_id,
+            self.products_by_category: lambda obj: obj.pk,
+            self.items_by_order: lambda obj: obj.pk,
+            self.products_by_order: lambda obj: obj.pk,
+        }
+        self._relations = {
+            self.product: "product",
+            self.category: "category",
+            self.products_by_category: "products",
+            self.items_by_order: "items",
+            self.products_by_order: "products",
+        }
+
+    def _register_groups(self, batch_load_fn):
+        """
+        Wrap a list-valued batch function so that every row it fetches, across
+        all parents, becomes one sibling group for the next level.
+        """
+
+        def load(keys):
+            groups = batch_load_fn(keys)
+            self.register([instance for group in groups for instance in group])
+            return groups
+
+        return load
+
+    def register(self, instances):
+        """
+        Remember that `instances` were resolved as one list.
+
+        An instance keeps the first (widest) group it was registered with.
+        """
+        for instance in instances:
+            self._siblings.setdefault(id(instance), instances)
+
+    def load_from(self, loader, instance):
+        """
+        Load the relation behind `loader` for `instance`, batching its siblings.
+
+        Relations already fetched with `select_related` or `prefetch_related`
+        are reused instead of being loaded again.
+        """
+        key_fn = self._key_fns[loader]
+        relation = self._relations[loader]
+        prefetched = getattr(instance, "_prefetched_objects_cache", {})
+        if relation in instance._state.fields_cache:
+            value = instance._state.fields_cache[relation]
+            loader.prime(key_fn(instance), value)
+            return value
+        if relation in prefetched:
+            value = list(prefetched[relation])
+            loader.prime(key_fn(instance), value)
+            return value
+        siblings = self._siblings.get(id(instance), ())
+        loader.enqueue(key_fn(sibling) for sibling in siblings)
+        return loader.load(key_fn(instance))
+
+
+def get_loaders(info):
+    """
+    Return the loaders stored on `info.context`, creating them on first use.
+    """
+    context = info.context
+    loaders = getattr(context, "loaders", None)
+    if loaders is None:
+        loaders = ShopLoaders()
+        context.loaders = loaders
+    return loaders
+
+
+class LoaderMiddleware:
+    """
+    Graphene middleware that registers list results as sibling groups.
+
+    QuerySets are evaluated here instead of by graphql-core so that every
+    row of the list is known before the first child field is resolved. The
+    nodes of connection edges are registered the same way, and results of
+    async resolvers once they are awaited.
+    """
+
+    def resolve(self, next, root, info, **args):
+        result = next(root, info, **args)
+        if isawaitable(result):
+            return self.resolve_async(result, info)
+        return self.register(result, info)
+
+    async def resolve_async(self, result, info):
+        return self.register(await result, info)
+
+    @staticmethod
+    def register(result, info):
+        if isinstance(result, QuerySet):
+            result = list(result)
+        if isinstance(result, list) and result:
+            if isinstance(getattr(result[0], "node", None), Model):
+                get_loaders(info).register([edge.node for edge in result])
+            elif isinstance(result[0], Model):
+                get_loaders(info).register(result)
+        return result
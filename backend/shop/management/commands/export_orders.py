@@ -0,0 +1,47 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.exports import FORMATS, export_orders
+from shop.models import Order
+
+
+class Command(BaseCommand):
+    help = "Export orders and their items as CSV or NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=tuple(FORMATS), default="csv")
+        parser.add_argument("--since", type=date.fromisoformat, help="YYYY-MM-DD")
+        parser.add_argument("--until", type=date.fromisoformat, help="YYYY-MM-DD")
+        parser.add_argument(
+            "--status",
+            action="append",
+            choices=tuple(dict(Order.STATUS_CHOICES)),
+            help="Only orders with this status; repeatable.",
+        )
+        parser.add_argument(
+            "--output", "-o", help="File to write to; standard output by default."
+        )
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, format, since, until, status, output, chunk_size, **options):
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be positive.")
+        chunks = export_orders(
+            format,
+            since=since,
+            until=until,
+            statuses=status,
+            chunk_size=chunk_size,
+        )
+        if output is None:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            return
+
+        lines = 0
+        with open(output, "w", newline="", encoding="utf-8") as out:
+            for chunk in chunks:
+                out.write(chunk)
+                lines += 1
+        self.stderr.write(f"Wrote {lines} lines to {output}.")
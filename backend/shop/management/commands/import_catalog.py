@@ -0,0 +1,211 @@
+import csv
+import hashlib
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from shop import bulk
+from shop import cache as catalogue_cache
+from shop.models import Category, Product
+
+CENTS = Decimal("0.01")
+
+
+def read_rows(path, format):
+    """
+    Yield the rows of a CSV or JSONL feed one at a time.
+    """
+    with open(path, newline="", encoding="utf-8") as feed:
+        if format == "csv":
+            yield from csv.DictReader(feed)
+            return
+        for line in feed:
+            if line.strip():
+                yield json.loads(line)
+
+
+def parse_row(row):
+    """
+    Normalize one feed row.
+
+    Raises:
+        ValueError: If a required column is missing or malformed.
+    """
+    try:
+        item = {
+            "sku": str(row["sku"]).strip(),
+            "title": str(row["title"]).strip(),
+            "description": str(row.get("description") or ""),
+            "price": Decimal(str(row["price"])).quantize(CENTS),
+            "stock": int(row["stock"]),
+            "category_slug": str(row["category_slug"]).strip(),
+            # None when the feed has no name: existing categories keep theirs.
+            "category_name": str(row.get("category_name") or "").strip() or None,
+        }
+    except KeyError as e:
+        raise ValueError(f"missing column {e}")
+    except (TypeError, ValueError, InvalidOperation) as e:
+        raise ValueError(f"invalid value ({e})")
+    if not item["sku"] or not item["category_slug"]:
+        raise ValueError("sku and category_slug are required")
+    return item
+
+
+def checksum(category_id, title, description, price, stock):
+    values = [
+        category_id,
+        title,
+        description,
+        str(Decimal(price).quantize(CENTS)),
+        stock,
+    ]
+    return hashlib.sha1(json.dumps(values).encode()).hexdigest()
+
+
+class Command(BaseCommand):
+    help = (
+        "Import categories and products from a CSV or JSONL feed. Rows are "
+        "matched by SKU and unchanged ones are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Feed with one product per row.")
+        parser.add_argument(
+            "--format",
+            choices=("csv", "jsonl"),
+            help="Feed format; guessed from the file extension by default.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--offset",
+            type=int,
+            default=0,
+            help="Skip this many rows, to resume an interrupted import.",
+        )
+
+    def handle(self, path, format=None, batch_size=1000, offset=0, **options):
+        format = format or Path(path).suffix.lstrip(".").lower()
+        if format not in ("csv", "jsonl"):
+            raise CommandError("Pass --format csv or --format jsonl.")
+        if not 0 < batch_size <= bulk.MAX_ITEMS:
+            raise CommandError(f"--batch-size must be between 1 and {bulk.MAX_ITEMS}.")
+
+        rows = islice(read_rows(path, format), offset, None)
+        done = offset
+        written = skipped = 0
+        start = time.perf_counter()
+        while True:
+            batch = []
+            try:
+                for row in islice(rows, batch_size):
+                    batch.append(parse_row(row))
+            except ValueError as e:
+                raise CommandError(
+                    f"Row {done + len(batch) + 1}: {e}. Rows up to {done} are "
+                    f"imported; fix the feed and rerun with --offset {done}."
+                )
+            if not batch:
+                break
+
+            try:
+                changed = self.import_batch(batch)
+            except bulk.BulkError as e:
+                errors = "\n".join(f"  {error}" for error in e.errors)
+                raise CommandError(
+                    f"Batch starting at row {done + 1} was rejected:\n{errors}\n"
+                    f"Fix the feed and rerun with --offset {done}."
+                )
+            done += len(batch)
+            written += changed
+            skipped += len(batch) - changed
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{done} rows: {written} written, {skipped} unchanged "
+                f"({(done - offset) / elapsed:.0f} rows/s)"
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {done - offset} rows in {time.perf_counter() - start:.1f}s: "
+                f"{written} written, {skipped} unchanged."
+            )
+        )
+
+    def import_batch(self, batch):
+        """
+        Write the rows of `batch` that differ from the database.
+
+        Returns:
+            int: The number of products created or updated.
+        """
+        with transaction.atomic():
+            categories = self.categories(batch)
+            for item in batch:
+                item["category_id"] = categories[item["category_slug"]]
+
+            stored = {
+                sku: checksum(*values)
+                for sku, *values in Product.objects.filter(
+                    sku__in=[item["sku"] for item in batch]
+                ).values_list(
+                    "sku", "category_id", "title", "description", "price", "stock"
+                )
+            }
+            changed = [
+                item
+                for item in batch
+                if stored.get(item["sku"])
+                != checksum(
+                    item["category_id"],
+                    item["title"],
+                    item["description"],
+                    item["price"],
+                    item["stock"],
+                )
+            ]
+            if changed:
+                bulk.upsert_products(changed)
+        return len(changed)
+
+    def categories(self, batch):
+        """
+        Return category ids by slug, creating missing categories (named
+        after their slug when the feed gives no name) and renaming the ones
+        given a different name.
+        """
+        names = {}
+        for item in batch:
+            slug, name = item["category_slug"], item["category_name"]
+            if name is not None or slug not in names:
+                names[slug] = name
+        existing = {
+            category.slug: category
+            for category in Category.objects.filter(slug__in=names)
+        }
+        missing = [
+            Category(slug=slug, name=name or slug)
+            for slug, name in names.items()
+            if slug not in existing
+        ]
+        Category.objects.bulk_create(missing)
+        renamed = []
+        for slug, category in existing.items():
+            if names[slug] is not None and category.name != names[slug]:
+                category.name = names[slug]
+                renamed.append(category)
+        Category.objects.bulk_update(renamed, ["name"])
+        if missing or renamed:
+            catalogue_cache.invalidate_categories([category.pk for category in renamed])
+        ids = {category.slug: category.pk for category in existing.values()}
+        if missing:
+            ids.update(
+                Category.objects.filter(
+                    slug__in=[category.slug for category in missing]
+                ).values_list("slug", "pk")
+            )
+        return ids
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from shop import images
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = "Generate resized variants for product images that lack them."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Regenerate variants even if they are up to date.",
+        )
+
+    def handle(self, force=False, **options):
+        products = (
+            Product.objects.exclude(image="")
+            .exclude(image__isnull=True)
+            .only("image", "image_variants")
+            .order_by("pk")
+        )
+        done = failed = 0
+        for product in products.iterator(chunk_size=500):
+            if not force and not images.needs_variants(product):
+                continue
+            try:
+                images.generate_variants(product.pk)
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"Product {product.pk}: {e}")
+            else:
+                done += 1
+        self.stdout.write(
+            self.style.SUCCESS(f"Processed {done} images, {failed} failed.")
+        )
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.purge import purge_stale, stale_querysets
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete abandoned cart lines, expired sessions and stale refresh "
+        "tokens in small primary key batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "tables",
+            nargs="*",
+            help=f"Tables to purge, of {', '.join(stale_querysets())}; all by default.",
+        )
+        parser.add_argument("--batch-size", type=int, help="Rows per delete.")
+        parser.add_argument(
+            "--sleep", type=float, help="Seconds to pause between batches."
+        )
+        parser.add_argument(
+            "--every",
+            type=int,
+            metavar="SECONDS",
+            help="Keep running, purging every SECONDS seconds.",
+        )
+
+    def handle(self, tables, batch_size=None, sleep=None, every=None, **options):
+        unknown = set(tables) - set(stale_querysets())
+        if unknown:
+            raise CommandError(f"Unknown tables: {', '.join(sorted(unknown))}.")
+        if batch_size is not None and batch_size < 1:
+            raise CommandError("--batch-size must be positive.")
+        while True:
+            start = time.perf_counter()
+            results = purge_stale(tables, batch_size, sleep, report=self.report)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Purged {sum(results.values())} rows in "
+                    f"{time.perf_counter() - start:.1f}s."
+                )
+            )
+            if not every:
+                return
+            time.sleep(every)
+
+    def report(self, table, deleted, seconds):
+        self.stdout.write(f"{table}: {deleted} rows in {seconds:.1f}s")
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from shop.counters import RECOUNTS
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the denormalized counters (category product counts, units "
+        "sold, user order counts) from the source tables, in primary key batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "tables",
+            nargs="*",
+            help=f"Tables to recount, of {', '.join(RECOUNTS)}; all by default.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, tables, batch_size=1000, **options):
+        if batch_size < 1:
+            raise CommandError("--batch-size must be positive.")
+        unknown = set(tables) - set(RECOUNTS)
+        if unknown:
+            raise CommandError(f"Unknown tables: {', '.join(sorted(unknown))}.")
+        for table in tables or RECOUNTS:
+            model, recount = RECOUNTS[table]
+            start = time.perf_counter()
+            rows = 0
+            last = None
+            while True:
+                ids = model.objects.order_by("pk")
+                if last is not None:
+                    ids = ids.filter(pk__gt=last)
+                ids = list(ids.values_list("pk", flat=True)[:batch_size])
+                if not ids:
+                    break
+                with transaction.atomic():
+                    recount(ids)
+                rows += len(ids)
+                last = ids[-1]
+            self.stdout.write(
+                f"{table}: {rows} rows in {time.perf_counter() - start:.1f}s"
+            )
+        self.stdout.write(self.style.SUCCESS("Counters recounted."))
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts USING fts5("
+    "title, description, tokenize='unicode61 remove_diacritics 2')",
+    "INSERT INTO shop_product_fts (rowid, title, description) "
+    "SELECT id, title, description FROM shop_product",
+]
+SQLITE_DROP = ["DROP TABLE IF EXISTS shop_product_fts"]
+
+# The indexed expression must match shop.search.PG_DOCUMENT.
+POSTGRES_CREATE = [
+    "CREATE INDEX IF NOT EXISTS shop_product_search_idx ON shop_product "
+    "USING gin (to_tsvector('english', coalesce(title, '') || ' ' || "
+    "coalesce(description, '')))",
+]
+POSTGRES_DROP = ["DROP INDEX IF EXISTS shop_product_search_idx"]
+
+
+def run_for_vendor(sqlite, postgresql):
+    def run(apps, schema_editor):
+        statements = {"sqlite": sqlite, "postgresql": postgresql}
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0002_alter_cartitem_product"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor(SQLITE_CREATE, POSTGRES_CREATE),
+            run_for_vendor(SQLITE_DROP, POSTGRES_DROP),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_facets(apps, schema_editor):
+    from shop.facets import price_floor
+
+    Product = apps.get_model("shop", "Product")
+    ProductFacet = apps.get_model("shop", "ProductFacet")
+    counts = {}
+    rows = Product.objects.values_list("category_id", "price", "stock")
+    for category_id, price, stock in rows.iterator(chunk_size=2000):
+        key = (category_id, price_floor(price), stock > 0)
+        counts[key] = counts.get(key, 0) + 1
+    ProductFacet.objects.bulk_create(
+        ProductFacet(category_id=c, price_floor=f, in_stock=s, count=n)
+        for (c, f, s), n in counts.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0003_product_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductFacet",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("price_floor", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("in_stock", models.BooleanField()),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "category",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="facets",
+                        to="shop.category",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("category", "price_floor", "in_stock"),
+                        name="unique_product_facet",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(fill_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:34
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def count(queryset, aggregate):
+    return Coalesce(
+        Subquery(queryset.annotate(n=aggregate).values("n")[:1]),
+        0,
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Category = apps.get_model("shop", "Category")
+    Product = apps.get_model("shop", "Product")
+    OrderItem = apps.get_model("shop", "OrderItem")
+    Order = apps.get_model("shop", "Order")
+    User = apps.get_model("account", "User")
+
+    products = Product.objects.filter(category=OuterRef("pk")).values("category")
+    Category.objects.update(
+        product_count=count(products, Count("pk")),
+        in_stock_count=count(products, Count("pk", filter=Q(stock__gt=0))),
+    )
+    items = OrderItem.objects.filter(product=OuterRef("pk")).values("product")
+    Product.objects.update(units_sold=count(items, Sum("quantity")))
+    orders = Order.objects.filter(user=OuterRef("pk")).values("user")
+    User.objects.update(order_count=count(orders, Count("pk")))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0004_user_order_count"),
+        ("shop", "0006_product_image_variants"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="in_stock_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="product_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="units_sold",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
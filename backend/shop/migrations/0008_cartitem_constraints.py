@@ -0,0 +1,55 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:39
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    Fold duplicate lines of a cart into the oldest one, summing quantities.
+    """
+    CartItem = apps.get_model("shop", "CartItem")
+    for owner, is_guest in (("user", False), ("session_key", True)):
+        items = CartItem.objects.filter(user__isnull=is_guest)
+        duplicates = (
+            items.values(owner, "product")
+            .annotate(n=Count("pk"), keep=Min("pk"), quantity=Sum("quantity"))
+            .filter(n__gt=1)
+        )
+        for row in duplicates:
+            lines = items.filter(**{owner: row[owner]}, product=row["product"])
+            lines.exclude(pk=row["keep"]).delete()
+            lines.update(quantity=row["quantity"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0007_counters"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name="cartitem",
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name="cartitem",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("user__isnull", False)),
+                fields=("user", "product"),
+                name="unique_user_cart_item",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="cartitem",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("user__isnull", True)),
+                fields=("session_key", "product"),
+                name="unique_guest_cart_item",
+            ),
+        ),
+    ]
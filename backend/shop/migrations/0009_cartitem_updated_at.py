@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:58
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_updated_at(apps, schema_editor):
+    # Existing lines were last touched no earlier than they were added.
+    CartItem = apps.get_model("shop", "CartItem")
+    CartItem.objects.update(updated_at=F("added_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0008_cartitem_constraints"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cartitem",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+    ]
@@ -7,6 +7,9 @@ User = get_user_model()
 class Category(models.Model):
     name = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
+    # Maintained by `shop.counters`; `manage.py recount` repairs drift.
+    product_count = models.PositiveIntegerField(default=0, editable=False)
+    in_stock_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
@@ -16,16 +19,50 @@ class Product(models.Model):
     category = models.ForeignKey(
         Category, related_name="products", on_delete=models.CASCADE
     )
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField(default=0)
     image = models.ImageField(upload_to="products/", null=True, blank=True)
+    units_sold = models.PositiveIntegerField(default=0, editable=False)
+    # Resized copies of `image`, written by `shop.images`.
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return self.title
 
 
+class ProductFacet(models.Model):
+    """
+    Number of products per category, price bucket and stock state.
+
+    Rows are adjusted incrementally whenever a product is saved or deleted
+    (see `shop.facets`), so facet counts never need a `COUNT ... GROUP BY`
+    over the product table.
+    """
+
+    category = models.ForeignKey(
+        Category, related_name="facets", on_delete=models.CASCADE
+    )
+    price_floor = models.DecimalField(max_digits=10, decimal_places=2)
+    in_stock = models.BooleanField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["category", "price_floor", "in_stock"],
+                name="unique_product_facet",
+            )
+        ]
+
+    def __str__(self):
+        return (
+            f"{self.category_id} / {self.price_floor}+ / {self.in_stock}: {self.count}"
+        )
+
+
 class CartItem(models.Model):
     user = models.ForeignKey(
         User, related_name="cart_items", null=True, blank=True, on_delete=models.CASCADE
@@ -36,9 +73,25 @@ class CartItem(models.Model):
     )
     quantity = models.PositiveIntegerField(default=1)
     added_at = models.DateTimeField(auto_now_add=True)
+    # Also set by the raw upserts in `shop.cart` and by queryset updates,
+    # which bypass `auto_now`.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
-        unique_together = ("user", "product", "session_key")
+        # One line per product and cart. Partial, because NULLs never
+        # conflict: user carts have no session_key, guest carts no user.
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "product"],
+                condition=models.Q(user__isnull=False),
+                name="unique_user_cart_item",
+            ),
+            models.UniqueConstraint(
+                fields=["session_key", "product"],
+                condition=models.Q(user__isnull=True),
+                name="unique_guest_cart_item",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.product.title} x {self.quantity}"
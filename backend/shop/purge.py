@@ -0,0 +1,130 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from account.models import RefreshToken
+from shop.models import CartItem
+
+logger = logging.getLogger(__name__)
+
+_scheduler = None
+
+
+def stale_querysets(now=None):
+    """
+    Return the rows to purge by table name.
+
+    Each filter starts with an indexed timestamp column, so finding a batch
+    does not scan the table:
+
+    - guest cart lines untouched for longer than a session, whose cart key
+      is gone with the session; user cart lines untouched for
+      `CART_ITEM_DAYS`;
+    - expired sessions (`SESSION_SAVE_EVERY_REQUEST` writes one per visitor);
+    - expired or revoked refresh tokens, which are rejected anyway.
+    """
+    now = now or timezone.now()
+    guest_cutoff = now - timedelta(seconds=settings.SESSION_COOKIE_AGE)
+    user_cutoff = now - timedelta(days=settings.PURGE_STALE["CART_ITEM_DAYS"])
+    return {
+        "cart_items": CartItem.objects.filter(
+            Q(user__isnull=True, updated_at__lt=guest_cutoff)
+            | Q(user__isnull=False, updated_at__lt=user_cutoff)
+        ),
+        "sessions": Session.objects.filter(expire_date__lt=now),
+        "refresh_tokens": RefreshToken.objects.filter(
+            Q(expires_at__lt=now) | Q(revoked=True)
+        ),
+    }
+
+
+def purge(queryset, batch_size, sleep=0):
+    """
+    Delete the rows of `queryset` in primary key ranges of at most
+    `batch_size` rows, one short transaction each, sleeping `sleep` seconds
+    in between so other writers are not locked out.
+
+    Returns:
+        int: The number of rows deleted.
+    """
+    deleted = 0
+    last = None
+    while True:
+        batch = queryset.order_by("pk")
+        if last is not None:
+            batch = batch.filter(pk__gt=last)
+        ids = list(batch.values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            count, _ = queryset.filter(pk__gte=ids[0], pk__lte=ids[-1]).delete()
+        deleted += count
+        last = ids[-1]
+        if len(ids) < batch_size:
+            return deleted
+        time.sleep(sleep)
+
+
+def purge_stale(tables=None, batch_size=None, sleep=None, report=None):
+    """
+    Purge every table of `stale_querysets()`, or only `tables`.
+
+    Args:
+        report (callable): Called with `(table, deleted, seconds)` after
+            each table.
+
+    Returns:
+        dict: Rows deleted by table.
+    """
+    config = settings.PURGE_STALE
+    batch_size = batch_size or config["BATCH_SIZE"]
+    sleep = config["SLEEP"] if sleep is None else sleep
+    results = {}
+    for table, queryset in stale_querysets().items():
+        if tables and table not in tables:
+            continue
+        start = time.perf_counter()
+        results[table] = purge(queryset, batch_size, sleep)
+        if report:
+            report(table, results[table], time.perf_counter() - start)
+    return results
+
+
+def _run_forever(interval, stop):
+    while not stop.wait(interval):
+        try:
+            results = purge_stale()
+            logger.info("Purged stale rows: %s", results)
+        except Exception:
+            logger.exception("Purging stale rows failed")
+        finally:
+            close_old_connections()
+
+
+def start_scheduler(interval=None):
+    """
+    Run `purge_stale()` every `interval` seconds (`PURGE_STALE["INTERVAL"]`
+    by default) in a daemon thread of this process. Does nothing when the
+    interval is 0 or the scheduler already runs.
+
+    Returns:
+        threading.Event: Set it to stop the scheduler, or None.
+    """
+    global _scheduler
+    if interval is None:
+        interval = settings.PURGE_STALE["INTERVAL"]
+    if not interval or _scheduler is not None:
+        return None
+    stop = threading.Event()
+    _scheduler = threading.Thread(
+        target=_run_forever, args=(interval, stop), name="purge-stale", daemon=True
+    )
+    _scheduler.start()
+    return stop
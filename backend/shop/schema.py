@@ -1,11 +1,21 @@
-from decimal import Decimal
-
 import graphene
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
 from django.db import transaction
+from django.db.models import ProtectedError, Sum
+from django.utils import timezone
 from graphene_django import DjangoObjectType
 from graphql import GraphQLError
-from shop.cart import Cart
+
+from a_config.pagination import CountableConnection, KeysetConnectionField
+from shop import bulk, counters, images
+from shop import cache as catalogue_cache
+from shop.cart import Cart, UserCart, add_quantity, line_owner, update_cart
+from shop.facets import bucket_ceiling, facet_counts
+from shop.loaders import get_loaders
 from shop.models import CartItem, Category, Order, OrderItem, Product
+from shop.search import search_products
 
 
 # region GraphQL Types
@@ -14,11 +24,72 @@ class CategoryType(DjangoObjectType):
         model = Category
         fields = "__all__"
 
+    def resolve_products(self, info):
+        loaders = get_loaders(info)
+        return loaders.load_from(loaders.products_by_category, self)
+
+
+class ImageFormat(graphene.Enum):
+    WEBP = "webp"
+    JPEG = "jpeg"
+
 
 class ProductType(DjangoObjectType):
+    image_url = graphene.String(
+        width=graphene.Int(required=True),
+        format=ImageFormat(default_value=ImageFormat.WEBP.value),
+        description="URL of the resized variant closest to `width` pixels.",
+    )
+
     class Meta:
         model = Product
-        fields = "__all__"
+        exclude = ("image_variants",)
+
+    optimizer_hints = {"image_url": {"only": ("image", "image_variants")}}
+
+    def resolve_category(self, info):
+        loaders = get_loaders(info)
+        return loaders.load_from(loaders.category, self)
+
+    def resolve_image_url(self, info, width, format):
+        name = images.pick_variant(self, width, ImageFormat.get(format).value)
+        return default_storage.url(name) if name else None
+
+
+class ProductConnection(CountableConnection):
+    class Meta:
+        node = ProductType
+
+
+class ProductSort(graphene.Enum):
+    NEWEST = "newest"
+    PRICE_ASC = "price_asc"
+    PRICE_DESC = "price_desc"
+    TITLE = "title"
+
+
+PRODUCT_ORDERINGS = {
+    "newest": ("-pk",),
+    "price_asc": ("price", "pk"),
+    "price_desc": ("-price", "-pk"),
+    "title": ("title", "pk"),
+}
+
+
+class CategoryFacetType(graphene.ObjectType):
+    category = graphene.Field(CategoryType, required=True)
+    count = graphene.Int(required=True)
+
+
+class PriceBucketType(graphene.ObjectType):
+    min_price = graphene.Decimal(required=True)
+    max_price = graphene.Decimal()
+    count = graphene.Int(required=True)
+
+
+class ProductFacetsType(graphene.ObjectType):
+    categories = graphene.List(graphene.NonNull(CategoryFacetType), required=True)
+    price_buckets = graphene.List(graphene.NonNull(PriceBucketType), required=True)
 
 
 # class CartItemType(DjangoObjectType):
@@ -34,8 +105,17 @@ class CartItemType(DjangoObjectType):
 
     total_price = graphene.Decimal(required=True)
 
+    optimizer_hints = {"total_price": {"only": ("quantity", "product")}}
+
+    def resolve_product(self, info):
+        loaders = get_loaders(info)
+        return loaders.load_from(loaders.product, self)
+
     def resolve_total_price(self, info):
-        return self.quantity * self.product.price
+        if getattr(self, "line_total", None) is not None:
+            return self.line_total
+        loaders = get_loaders(info)
+        return self.quantity * loaders.load_from(loaders.product, self).price
 
 
 class GuestCartItemType(graphene.ObjectType):
@@ -50,89 +130,183 @@ class CartItemUnion(graphene.Union):
 
 
 class CartType(graphene.ObjectType):
+    """
+    Resolved from a `UserCart` or, for guests, a `Cart`. Each field only
+    reads what it needs: `totalItems` alone loads no line.
+    """
+
     items = graphene.List(CartItemUnion)
     total_items = graphene.Int()
     total_price = graphene.Decimal()
 
+    def resolve_items(root, info):
+        if isinstance(root, UserCart):
+            return root.lines
+        return [
+            GuestCartItemType(
+                product=item["product"],
+                quantity=item["quantity"],
+                total_price=item["total_price"],
+            )
+            for item in root.summary.items
+        ]
+
+    def resolve_total_items(root, info):
+        if isinstance(root, UserCart):
+            return root.totals()["total_items"]
+        return root.summary.total_items
+
+    def resolve_total_price(root, info):
+        if isinstance(root, UserCart):
+            return root.totals()["total_price"]
+        return root.summary.total_price
+
+
+class OrderItemType(DjangoObjectType):
+    class Meta:
+        model = OrderItem
+        fields = ("id", "product", "quantity", "price")
+
+    def resolve_product(self, info):
+        loaders = get_loaders(info)
+        return loaders.load_from(loaders.product, self)
+
 
 class OrderType(DjangoObjectType):
     class Meta:
         model = Order
         fields = "__all__"
 
+    def resolve_items(self, info):
+        loaders = get_loaders(info)
+        return loaders.load_from(loaders.items_by_order, self)
+
+    def resolve_products(self, info):
+        loaders = get_loaders(info)
+        return loaders.load_from(loaders.products_by_order, self)
+
+
+class OrderConnection(CountableConnection):
+    class Meta:
+        node = OrderType
+
 
 # endregion
 # region GraphQL Queries
 
 
 class ProductQuery(graphene.ObjectType):
+    cost_hints = {"search_products": 10, "product_facets": 5}
+
     all_categories = graphene.List(CategoryType)
     category = graphene.Field(CategoryType, id=graphene.ID(required=True))
 
-    all_products = graphene.List(ProductType)
+    all_products = KeysetConnectionField(
+        ProductConnection,
+        ordering=("pk",),
+        fetch_rows=catalogue_cache.fetch_page,
+        category_slug=graphene.String(),
+        min_price=graphene.Decimal(),
+        max_price=graphene.Decimal(),
+        in_stock=graphene.Boolean(),
+        sort=ProductSort(),
+    )
+    product_facets = graphene.Field(
+        ProductFacetsType,
+        category_slug=graphene.String(),
+        in_stock=graphene.Boolean(),
+    )
     product = graphene.Field(ProductType, id=graphene.ID(required=True))
+    search_products = KeysetConnectionField(
+        ProductConnection,
+        ordering=("-rank", "pk"),
+        query=graphene.String(required=True),
+        category_id=graphene.ID(),
+    )
 
     # Resolvers
     def resolve_all_categories(root, info):
-        return Category.objects.all()
+        return catalogue_cache.all_categories()
 
-    def resolve_category(root, info, id):
+    async def resolve_category(root, info, id):
         try:
-            return Category.objects.get(pk=id)
-        except Category.DoesNotExist:
+            categories = await catalogue_cache.aget_rows(Category, [id])
+            category = categories.get(int(id))
+        except (ValidationError, ValueError):
+            category = None
+        if category is None:
             raise GraphQLError("Category not found")
+        return category
+
+    def resolve_all_products(
+        root,
+        info,
+        category_slug=None,
+        min_price=None,
+        max_price=None,
+        in_stock=False,
+        sort=None,
+    ):
+        products = Product.objects.all()
+        if category_slug:
+            products = products.filter(category__slug=category_slug)
+        if min_price is not None:
+            products = products.filter(price__gte=min_price)
+        if max_price is not None:
+            products = products.filter(price__lte=max_price)
+        if in_stock:
+            products = products.filter(stock__gt=0)
+        if sort:
+            products = products.order_by(
+                *PRODUCT_ORDERINGS[ProductSort.get(sort).value]
+            )
+        return products
 
-    def resolve_all_products(root, info):
-        return Product.objects.all()
+    async def resolve_product_facets(root, info, category_slug=None, in_stock=False):
+        category_counts, price_counts = await facet_counts(
+            category_slug=category_slug, in_stock_only=in_stock
+        )
+        categories = await Category.objects.ain_bulk(category_counts)
+        return ProductFacetsType(
+            categories=[
+                CategoryFacetType(category=categories[pk], count=count)
+                for pk, count in category_counts.items()
+                if pk in categories
+            ],
+            price_buckets=[
+                PriceBucketType(
+                    min_price=floor, max_price=bucket_ceiling(floor), count=count
+                )
+                for floor, count in price_counts.items()
+            ],
+        )
 
-    def resolve_product(root, info, id):
+    async def resolve_product(root, info, id):
         try:
-            return Product.objects.get(pk=id)
-        except Product.DoesNotExist:
+            product = (await catalogue_cache.aget_rows(Product, [id])).get(int(id))
+        except (ValidationError, ValueError):
+            product = None
+        if product is None:
             raise GraphQLError("Product not found")
+        return product
+
+    def resolve_search_products(root, info, query, category_id=None):
+        return search_products(query, category_id=category_id)
 
 
 class CartQuery(graphene.ObjectType):
     cart = graphene.Field(CartType)
 
-    def resolve_cart(self, info):
-        print("inside cartquery)")
-
+    async def resolve_cart(root, info):
         request = info.context
-        cart = Cart(request)
-        user = request.user
-
-        if user.is_authenticated:
-            cart_items = CartItem.objects.filter(user=user).select_related("product")
-            total_items = sum(item.quantity for item in cart_items)
-            total_price = sum(item.quantity * item.product.price for item in cart_items)
-            return CartType(
-                items=cart_items, total_items=total_items, total_price=total_price
-            )
-        else:
-            cart_items = []
-            for item in cart:
-                cart_items.append(
-                    GuestCartItemType(
-                        product=item["product"],
-                        quantity=item["quantity"],
-                        total_price=Decimal(
-                            item["total_price"]
-                        ),  # ✅ wrap with Decimal
-                    )
-                )
-
-            total_items = sum(item.quantity for item in cart_items)
-            total_price = sum(
-                Decimal(item.total_price) for item in cart_items
-            )  # ✅ wrap again
-            return CartType(
-                items=cart_items, total_items=total_items, total_price=total_price
-            )
+        if request.user.is_authenticated:
+            return UserCart(request.user)
+        # Guest carts are loaded from the configured backend, which is sync.
+        return await sync_to_async(Cart)(request)
 
 
 class OrderQuery(graphene.ObjectType):
-    my_orders = graphene.List(OrderType)
+    my_orders = KeysetConnectionField(OrderConnection, ordering=("-created_at", "-pk"))
     order = graphene.Field(OrderType, id=graphene.Int(required=True))
 
     def resolve_my_orders(root, info):
@@ -141,12 +315,12 @@ class OrderQuery(graphene.ObjectType):
             raise GraphQLError("Authentication required")
         return Order.objects.filter(user=user).order_by("-created_at")
 
-    def resolve_order(self, info, id):
+    async def resolve_order(self, info, id):
         user = info.context.user
         if not user.is_authenticated:
             raise GraphQLError("Authentication required.")
         try:
-            return Order.objects.get(id=id, user=user)
+            return await Order.objects.aget(id=id, user=user)
         except Order.DoesNotExist:
             raise GraphQLError("Order not found.")
 
@@ -192,7 +366,8 @@ class UpdateCategory(graphene.Mutation):
             category.name = name
         if slug:
             category.slug = slug
-        category.save()
+        # Leave the counters alone: they are maintained with F() updates.
+        category.save(update_fields=["name", "slug"])
         return UpdateCategory(category=category)
 
 
@@ -286,7 +461,9 @@ class UpdateProduct(graphene.Mutation):
             product.price = price
         if stock is not None:
             product.stock = stock
-        product.save()
+        product.save(
+            update_fields=["category", "title", "description", "price", "stock"]
+        )
         return UpdateProduct(product=product)
 
 
@@ -308,6 +485,89 @@ class DeleteProduct(graphene.Mutation):
         return DeleteProduct(message="Product deleted successfully")
 
 
+class ProductInput(graphene.InputObjectType):
+    sku = graphene.String(required=True)
+    category_id = graphene.ID(required=True)
+    title = graphene.String(required=True)
+    description = graphene.String()
+    price = graphene.Decimal(required=True)
+    stock = graphene.Int(required=True)
+
+
+class StockDeltaInput(graphene.InputObjectType):
+    product_id = graphene.ID(required=True)
+    delta = graphene.Int(required=True)
+
+
+def bulk_error(error):
+    return GraphQLError(
+        str(error), extensions={"code": "BULK_REJECTED", "errors": error.errors}
+    )
+
+
+def require_staff(info):
+    user = info.context.user
+    if not user.is_authenticated or not user.is_staff:
+        raise GraphQLError("Admin privileges required")
+
+
+class BulkUpsertProducts(graphene.Mutation):
+    """
+    Create or update products by SKU, all or nothing.
+    """
+
+    products = graphene.List(ProductType)
+    created = graphene.Int()
+    updated = graphene.Int()
+
+    class Arguments:
+        input = graphene.List(graphene.NonNull(ProductInput), required=True)
+
+    def mutate(self, info, input):
+        require_staff(info)
+        try:
+            products, created = bulk.upsert_products(input)
+        except bulk.BulkError as e:
+            raise bulk_error(e)
+        return BulkUpsertProducts(
+            products=products, created=created, updated=len(products) - created
+        )
+
+
+class BulkAdjustStock(graphene.Mutation):
+    products = graphene.List(ProductType)
+
+    class Arguments:
+        deltas = graphene.List(graphene.NonNull(StockDeltaInput), required=True)
+
+    def mutate(self, info, deltas):
+        require_staff(info)
+        try:
+            products = bulk.adjust_stock(
+                [(item.product_id, item.delta) for item in deltas]
+            )
+        except bulk.BulkError as e:
+            raise bulk_error(e)
+        return BulkAdjustStock(products=products)
+
+
+class BulkDeleteProducts(graphene.Mutation):
+    deleted = graphene.Int()
+
+    class Arguments:
+        ids = graphene.List(graphene.NonNull(graphene.ID), required=True)
+
+    def mutate(self, info, ids):
+        require_staff(info)
+        try:
+            deleted = bulk.delete_products(ids)
+        except bulk.BulkError as e:
+            raise bulk_error(e)
+        except ProtectedError:
+            raise GraphQLError("Products that appear on orders cannot be deleted")
+        return BulkDeleteProducts(deleted=deleted)
+
+
 class AddToCart(graphene.Mutation):
     message = graphene.String()
     total_items = graphene.Int()
@@ -318,35 +578,40 @@ class AddToCart(graphene.Mutation):
         quantity = graphene.Int(required=True)
 
     def mutate(self, info, product_id, quantity):
-        print("inside add to cart")
         request = info.context
         user = request.user
-        cart = Cart(request)
-
+        if quantity < 1:
+            raise GraphQLError("Quantity must be positive")
         try:
-            product = Product.objects.get(pk=product_id)
-        except Product.DoesNotExist:
+            product_id = int(product_id)
+        except ValueError:
             raise GraphQLError("Product not found")
 
         if user.is_authenticated:
-            cart_item, created = CartItem.objects.get_or_create(
-                user=user,
-                product=product,
-                defaults={"quantity": quantity},
+            with transaction.atomic():
+                cart_item = add_quantity(user, product_id, quantity)
+                if cart_item is None:
+                    if Product.objects.filter(pk=product_id).exists():
+                        raise GraphQLError("Not enough stock")
+                    raise GraphQLError("Product not found")
+                total_items = CartItem.objects.filter(user=user).aggregate(
+                    total=Sum("quantity")
+                )["total"]
+            return AddToCart(
+                message="Product added to cart",
+                total_items=total_items,
+                cart_item=cart_item,
             )
-            if not created:
-                cart_item.quantity += quantity
-                cart_item.save()
-            total_items = CartItem.objects.filter(user=user).count()
-        else:
-            cart.add(product, quantity=quantity)
-            total_items = len(cart)
 
-        return AddToCart(
-            message="Product added to cart",
-            total_items=total_items,
-            cart_item=cart_item if user.is_authenticated else None,
-        )
+        product = catalogue_cache.get_products([product_id]).get(product_id)
+        if product is None:
+            raise GraphQLError("Product not found")
+        cart = Cart(request)
+        in_cart = cart.cart.get(str(product_id), {}).get("quantity", 0)
+        if in_cart + quantity > product.stock:
+            raise GraphQLError("Not enough stock")
+        cart.add(product, quantity=quantity)
+        return AddToCart(message="Product added to cart", total_items=len(cart))
 
 
 class UpdateCartItemQuantity(graphene.Mutation):
@@ -357,22 +622,58 @@ class UpdateCartItemQuantity(graphene.Mutation):
         quantity = graphene.Int(required=True)
 
     def mutate(self, info, cart_item_id, quantity):
-        user = info.context.user
-        session_key = info.context.session.session_key
+        if quantity < 1:
+            raise GraphQLError("Quantity must be positive")
+        owner = line_owner(info.context)
+        if owner is None:
+            raise GraphQLError("Cart item not found")
         try:
-            cart_item = CartItem.objects.get(
-                pk=cart_item_id,
-                user=user if user.is_authenticated else None,
-                session_key=session_key if not user.is_authenticated else None,
-            )
-        except CartItem.DoesNotExist:
+            lines = CartItem.objects.filter(pk=cart_item_id, **owner)
+            with transaction.atomic():
+                # One conditional UPDATE: the stock bound is checked in the
+                # same statement instead of reading the product first.
+                updated = lines.filter(product__stock__gte=quantity).update(
+                    quantity=quantity, updated_at=timezone.now()
+                )
+                if not updated:
+                    if lines.exists():
+                        raise GraphQLError("Not enough stock")
+                    raise GraphQLError("Cart item not found")
+                cart_item = lines.get()
+        except (ValidationError, ValueError):
             raise GraphQLError("Cart item not found")
-
-        cart_item.quantity = quantity
-        cart_item.save()
         return UpdateCartItemQuantity(cart_item=cart_item)
 
 
+class CartLineInput(graphene.InputObjectType):
+    product_id = graphene.ID(required=True)
+    quantity = graphene.Int()
+    delta = graphene.Int()
+
+
+class UpdateCart(graphene.Mutation):
+    """
+    Apply several line changes at once, all or nothing, and return the cart.
+
+    Each line sets a new `quantity` (0 removes it) or adds `delta`.
+    """
+
+    cart = graphene.Field(CartType)
+
+    class Arguments:
+        lines = graphene.List(graphene.NonNull(CartLineInput), required=True)
+
+    def mutate(self, info, lines):
+        try:
+            cart = update_cart(
+                info.context,
+                [(line.product_id, line.quantity, line.delta) for line in lines],
+            )
+        except bulk.BulkError as e:
+            raise bulk_error(e)
+        return UpdateCart(cart=cart)
+
+
 class RemoveFromCart(graphene.Mutation):
     message = graphene.String()
     total_items = graphene.Int()
@@ -437,29 +738,32 @@ class Checkout(graphene.Mutation):
             raise GraphQLError("Cart is empty")
 
         with transaction.atomic():
-            total = 0
-            order = Order.objects.create(user=user, total=0, status="pending")
-
-            for item in cart_items:
-                product = item.product
-                if product.stock < item.quantity:
-                    raise GraphQLError(f"Not enough stock for {product.title}")
+            lines = list(cart_items.select_related("product"))
+            quantities = {}
+            for item in lines:
+                quantities[item.product_id] = (
+                    quantities.get(item.product_id, 0) + item.quantity
+                )
+            try:
+                bulk.reserve_stock(quantities)
+            except bulk.BulkError as e:
+                raise GraphQLError(e.errors[0])
 
-                OrderItem.objects.create(
+            order = Order.objects.create(
+                user=user,
+                total=sum(item.product.price * item.quantity for item in lines),
+                status="paid",
+            )
+            OrderItem.objects.bulk_create(
+                OrderItem(
                     order=order,
-                    product=product,
+                    product=item.product,
                     quantity=item.quantity,
-                    price=product.price,
+                    price=item.product.price,
                 )
-
-                product.stock -= item.quantity
-                product.save()
-
-                total += product.price * item.quantity
-
-            order.total = total
-            order.status = "paid"
-            order.save()
+                for item in lines
+            )
+            counters.record_order(user, quantities)
 
             cart_items.delete()
 
@@ -477,11 +781,15 @@ class ShopMutation(graphene.ObjectType):
     create_product = CreateProduct.Field()
     update_product = UpdateProduct.Field()
     delete_product = DeleteProduct.Field()
+    bulk_upsert_products = BulkUpsertProducts.Field()
+    bulk_adjust_stock = BulkAdjustStock.Field()
+    bulk_delete_products = BulkDeleteProducts.Field()
 
     # CartItem Mutations
     add_to_cart = AddToCart.Field()
     update_cart_item_quantity = UpdateCartItemQuantity.Field()
     remove_from_cart = RemoveFromCart.Field()
+    update_cart = UpdateCart.Field()
 
     # Checkout
     checkout = Checkout.Field()
@@ -0,0 +1,146 @@
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from shop.models import Product
+
+FTS_TABLE = "shop_product_fts"
+
+# Must stay identical to the expression indexed in migration 0003.
+PG_DOCUMENT = (
+    """to_tsvector('english', coalesce("shop_product"."title", '') || ' ' || """
+    """coalesce("shop_product"."description", ''))"""
+)
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def search_terms(query):
+    """
+    Split user input into plain search terms.
+
+    Everything except letters, digits and underscores is dropped, so the
+    result is always a valid FTS5 / tsquery expression once formatted.
+    """
+    return WORD_RE.findall(query.lower())
+
+
+def search_products(query, category_id=None):
+    """
+    Return the products matching `query`, annotated with a relevance `rank`.
+
+    SQLite is served from the `shop_product_fts` FTS5 table (BM25, title
+    weighted over description) and PostgreSQL from the expression GIN index
+    on `PG_DOCUMENT` (`ts_rank`). Other databases fall back to `icontains`.
+    Every term matches as a prefix, so partial words typed into a search box
+    already return results. Higher `rank` means more relevant.
+
+    Args:
+        query (str): Free text typed by the user.
+        category_id (int): Optional category to restrict the results to.
+
+    Returns:
+        QuerySet: Matching products with a `rank` annotation.
+
+    Example:
+        >>> search_products("red sho").order_by("-rank")
+    """
+    terms = search_terms(query)
+    if not terms:
+        return Product.objects.none().annotate(
+            rank=Value(0.0, output_field=FloatField())
+        )
+
+    if connection.vendor == "sqlite":
+        expression = " ".join(f'"{term}"*' for term in terms)
+        products = Product.objects.filter(
+            RawSQL(
+                f'"shop_product"."id" IN (SELECT rowid FROM {FTS_TABLE} '
+                f"WHERE {FTS_TABLE} MATCH %s)",
+                [expression],
+                output_field=BooleanField(),
+            )
+        ).annotate(
+            rank=RawSQL(
+                f"SELECT -bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} "
+                f'WHERE {FTS_TABLE} MATCH %s AND rowid = "shop_product"."id"',
+                [expression],
+                output_field=FloatField(),
+            )
+        )
+    elif connection.vendor == "postgresql":
+        expression = " & ".join(f"{term}:*" for term in terms)
+        products = Product.objects.filter(
+            RawSQL(
+                f"{PG_DOCUMENT} @@ to_tsquery('english', %s)",
+                [expression],
+                output_field=BooleanField(),
+            )
+        ).annotate(
+            rank=RawSQL(
+                f"ts_rank({PG_DOCUMENT}, to_tsquery('english', %s))",
+                [expression],
+                output_field=FloatField(),
+            )
+        )
+    else:
+        condition = Q()
+        for term in terms:
+            condition &= Q(title__icontains=term) | Q(description__icontains=term)
+        products = Product.objects.filter(condition).annotate(
+            rank=Value(0.0, output_field=FloatField())
+        )
+
+    if category_id:
+        products = products.filter(category_id=category_id)
+    return products
+
+
+def _batches(rows, params_per_row):
+    """
+    Split `rows` so one statement stays below the database's parameter
+    limit. Plain `execute` calls are used rather than `executemany`, which
+    cursor wrappers such as the one of `DjangoDebugMiddleware` do not
+    support.
+    """
+    size = max(connection.features.max_query_params // params_per_row, 1)
+    for start in range(0, len(rows), size):
+        yield rows[start : start + size]
+
+
+def index_products(products):
+    """
+    Write `products` into the full-text index, replacing older entries.
+
+    Only needed on SQLite; the PostgreSQL index is maintained by the
+    database itself.
+    """
+    if connection.vendor != "sqlite":
+        return
+    products = list(products)
+    remove_products([product.pk for product in products])
+    rows = [(p.pk, p.title, p.description) for p in products]
+    with connection.cursor() as cursor:
+        for batch in _batches(rows, 3):
+            values = ", ".join(["(%s, %s, %s)"] * len(batch))
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, description) "
+                f"VALUES {values}",
+                [value for row in batch for value in row],
+            )
+
+
+def remove_products(product_ids):
+    """
+    Drop the index entries of `product_ids`.
+    """
+    if connection.vendor != "sqlite" or not product_ids:
+        return
+    with connection.cursor() as cursor:
+        for batch in _batches(list(product_ids), 1):
+            placeholders = ", ".join(["%s"] * len(batch))
+            cursor.execute(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", batch
+            )
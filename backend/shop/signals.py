@@ -1,25 +1,131 @@
+from django.conf import settings
 from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from shop.models import Product, CartItem
-from .cart import Cart
+from shop.models import Category, Product
+from shop import cache as catalogue_cache
+from shop import bulk, counters, facets, images, search
+from .cart import Cart, merge_quantities
 
 
 @receiver(user_logged_in)
 def merge_cart_on_login(sender, user, request, **kwargs):
-
     cart = Cart(request)
-    for item in cart:
-        product = item["product"]
-        quantity = item["quantity"]
+    quantities = {item["product"].pk: item["quantity"] for item in cart}
+    merge_quantities(user, quantities, settings.CART_MERGE_POLICY)
+    cart.clear()
 
-        cart_item, created = CartItem.objects.get_or_create(
-            user=user,
-            product=product,
-            defaults={"quantity": quantity},
-        )
 
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+# Fields stored in the full-text index.
+INDEXED_FIELDS = {"title", "description"}
 
-    cart.clear()
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not INDEXED_FIELDS & set(update_fields):
+        return
+    search.index_products([instance])
+
+
+@receiver(post_save, sender=Product)
+def resize_image(sender, instance, raw=False, **kwargs):
+    if not raw and images.needs_variants(instance):
+        images.schedule(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    if bulk.in_bulk_write():
+        return
+    search.remove_products([instance.pk])
+
+
+# Fields that decide which facet a product is counted in.
+FACET_FIELDS = {"category", "category_id", "price", "stock"}
+
+# Fields that decide whether and where a product appears in cached lists.
+LISTED_FIELDS = {"title", "category", "category_id", "price", "stock"}
+
+
+def _moves_facet(update_fields):
+    return update_fields is None or bool(FACET_FIELDS & set(update_fields))
+
+
+def _listing(title, category_id, price, stock):
+    return (title, category_id, price, stock > 0)
+
+
+@receiver(pre_save, sender=Product)
+def remember_facet(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Remember which facet the stored row belongs to, so `update_facets` can
+    move the product out of it, and how it was listed, so
+    `invalidate_saved_product` can tell whether cached lists changed.
+    """
+    instance._old_facet_key = None
+    instance._old_listing = None
+    if raw or instance.pk is None or not _moves_facet(update_fields):
+        return
+    old = (
+        Product.objects.filter(pk=instance.pk)
+        .values_list("title", "category_id", "price", "stock")
+        .first()
+    )
+    if old:
+        title, category_id, price, stock = old
+        instance._old_facet_key = (category_id, facets.price_floor(price), stock > 0)
+        instance._old_listing = _listing(title, category_id, price, stock)
+
+
+@receiver(post_save, sender=Product)
+def update_facets(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not _moves_facet(update_fields):
+        return
+    old_key = getattr(instance, "_old_facet_key", None)
+    new_key = facets.facet_key(instance)
+    facets.move(old_key, new_key)
+    counters.move_products([(old_key, -1), (new_key, 1)])
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_facets(sender, instance, **kwargs):
+    if bulk.in_bulk_write():
+        return
+    key = facets.facet_key(instance)
+    facets.adjust(key, -1)
+    counters.move_products([(key, -1)])
+
+
+def _changes_lists(instance, created, update_fields):
+    if created:
+        return True
+    if update_fields is not None and not LISTED_FIELDS & set(update_fields):
+        return False
+    old = getattr(instance, "_old_listing", None)
+    if old is None:
+        return True
+    return old != _listing(
+        instance.title, instance.category_id, instance.price, instance.stock
+    )
+
+
+@receiver(post_save, sender=Product)
+def invalidate_saved_product(
+    sender, instance, created=False, update_fields=None, **kwargs
+):
+    if bulk.in_bulk_write():
+        return
+    lists = _changes_lists(instance, created, update_fields)
+    catalogue_cache.invalidate_products([instance.pk], lists=lists)
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_deleted_product(sender, instance, **kwargs):
+    if bulk.in_bulk_write():
+        return
+    catalogue_cache.invalidate_products([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_cached_category(sender, instance, **kwargs):
+    catalogue_cache.invalidate_categories([instance.pk])
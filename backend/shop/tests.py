@@ -1,5 +1,58 @@
-from django.test import TestCase
-from .models import Category, Product
+import asyncio
+import csv
+import json
+import tempfile
+from decimal import Decimal
+from datetime import datetime, time, timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import (
+    AsyncRequestFactory,
+    Client as HttpClient,
+    RequestFactory,
+    TestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphene.test import Client
+from graphene_django.debug import DjangoDebugMiddleware
+from graphql import parse, validate
+from PIL import Image
+
+from a_config.async_execution import AsyncBridgeMiddleware
+from a_config.complexity import QueryComplexityRule
+from a_config.documents import documents, query_hash
+from a_config.graphql_logging import JsonFormatter
+from a_config.metrics import registry
+from a_config.pagination import apaginate, encode_cursor
+from a_config.optimizer import QueryOptimizerMiddleware
+from a_config.schema import schema
+from a_config.views import AsyncGraphQLView, LoggingGraphQLView
+from account.models import RefreshToken
+from . import cache as catalogue_cache
+from . import bulk, facets, images
+from .cart import Cart, add_quantity, merge_quantities
+from .exports import order_rows
+from .loaders import LoaderMiddleware
+from .models import CartItem, Category, Order, OrderItem, Product, ProductFacet
+from .search import FTS_TABLE, search_products
+from .signals import merge_cart_on_login
+
+User = get_user_model()
 
 
 class ProductModelTest(TestCase):
@@ -16,3 +69,1547 @@ class ProductModelTest(TestCase):
     def test_product_creation(self):
         self.assertEqual(Product.objects.count(), 1)
         self.assertEqual(self.prod.title, "Product 1")
+
+
+class ShopGraphQLTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client(
+            schema,
+            middleware=[
+                QueryOptimizerMiddleware(),
+                LoaderMiddleware(),
+                AsyncBridgeMiddleware(),
+            ],
+        )
+        self.factory = RequestFactory()
+
+    def execute(self, query, user=None, **kwargs):
+        request = self.factory.post("/graphql/")
+        request.user = user or AnonymousUser()
+        request.session = SessionStore()
+        return self.client.execute(query, context_value=request, **kwargs)
+
+
+class BatchedRelationsTest(ShopGraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        for c in range(3):
+            cat = Category.objects.create(name=f"Cat {c}", slug=f"cat-{c}")
+            for p in range(4):
+                Product.objects.create(
+                    title=f"Product {c}-{p}", price=1, stock=5, category=cat
+                )
+
+    def test_all_products_category_is_batched(self):
+        with self.assertNumQueries(2):
+            response = self.execute(
+                "{ allProducts { edges { node { title category { name } } } } }"
+            )
+        products = [e["node"] for e in response["data"]["allProducts"]["edges"]]
+        self.assertEqual(len(products), 12)
+        self.assertEqual(products[0]["category"]["name"], "Cat 0")
+
+    def test_all_categories_products_are_batched(self):
+        with self.assertNumQueries(3):
+            response = self.execute("{ allCategories { products { title } } }")
+        self.assertEqual(
+            [len(c["products"]) for c in response["data"]["allCategories"]], [4, 4, 4]
+        )
+
+    def test_my_orders_items_and_products_are_batched(self):
+        user = User.objects.create_user(
+            username="buyer", email="buyer@example.com", password="12345678"
+        )
+        products = list(Product.objects.all())
+        for n in range(3):
+            order = Order.objects.create(user=user, total=2)
+            for product in products[n : n + 2]:
+                OrderItem.objects.create(
+                    order=order, product=product, quantity=1, price=product.price
+                )
+
+        query = """
+        { myOrders { edges { node {
+            items { product { title } }
+            products { title }
+        } } } }
+        """
+        with self.assertNumQueries(3):
+            response = self.execute(query, user=user)
+        orders = [e["node"] for e in response["data"]["myOrders"]["edges"]]
+        self.assertEqual([len(o["items"]) for o in orders], [2, 2, 2])
+        self.assertEqual([len(o["products"]) for o in orders], [2, 2, 2])
+
+    def test_unrequested_columns_are_not_loaded(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.execute(
+                '{ searchProducts(query: "product") { edges { node { title } } } }'
+            )
+        sql = ctx.captured_queries[0]["sql"]
+        self.assertIn('"title"', sql)
+        self.assertNotIn('"description"', sql)
+
+
+class KeysetPaginationTest(ShopGraphQLTestCase):
+    query = """
+    query ($after: String) {
+      allProducts(first: 4, after: $after) {
+        totalCount
+        edges { node { title } }
+        pageInfo { hasNextPage endCursor }
+      }
+    }
+    """
+
+    def setUp(self):
+        super().setUp()
+        cat = Category.objects.create(name="Cat", slug="cat")
+        for p in range(10):
+            Product.objects.create(title=f"Product {p}", price=1, category=cat)
+
+    def test_pages_follow_cursor(self):
+        titles, after = [], None
+        while True:
+            page = self.execute(self.query, variables={"after": after})["data"]
+            page = page["allProducts"]
+            self.assertEqual(page["totalCount"], 10)
+            titles += [e["node"]["title"] for e in page["edges"]]
+            if not page["pageInfo"]["hasNextPage"]:
+                break
+            after = page["pageInfo"]["endCursor"]
+        self.assertEqual(titles, [f"Product {p}" for p in range(10)])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.execute(self.query, variables={"after": "not-a-cursor"})
+        self.assertEqual(response["errors"][0]["message"], "Invalid cursor")
+
+    def test_tampered_cursors_are_rejected(self):
+        for values in ({"pk": 1}, 7, [1, 2], ["abc"], [None], [[1]], [True]):
+            after = encode_cursor(values)
+            response = self.execute(self.query, variables={"after": after})
+            self.assertEqual(response["errors"][0]["message"], "Invalid cursor", values)
+
+
+class SearchProductsTest(ShopGraphQLTestCase):
+    query = """
+    query ($query: String!, $categoryId: ID, $after: String) {
+      searchProducts(query: $query, categoryId: $categoryId, first: 2, after: $after) {
+        edges { node { title } }
+        pageInfo { hasNextPage endCursor }
+      }
+    }
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.shoes = Category.objects.create(name="Shoes", slug="shoes")
+        self.hats = Category.objects.create(name="Hats", slug="hats")
+        Product.objects.create(title="Red running shoe", price=1, category=self.shoes)
+        Product.objects.create(
+            title="Blue sandal",
+            description="A light shoe for red hot days",
+            price=1,
+            category=self.shoes,
+        )
+        Product.objects.create(title="Red cap", price=1, category=self.hats)
+
+    def search(self, **variables):
+        data = self.execute(self.query, variables=variables)["data"]
+        return data["searchProducts"]
+
+    def titles(self, result):
+        return [e["node"]["title"] for e in result["edges"]]
+
+    def test_stock_only_save_does_not_reindex(self):
+        product = Product.objects.get(title="Red cap")
+        product.stock = 3
+        with CaptureQueriesContext(connection) as queries:
+            product.save(update_fields=["stock"])
+        self.assertFalse(
+            [q["sql"] for q in queries.captured_queries if FTS_TABLE in q["sql"]]
+        )
+        product.title = "Red beret"
+        product.save(update_fields=["title"])
+        self.assertEqual(self.titles(self.search(query="beret")), ["Red beret"])
+
+    def test_results_are_ranked_by_relevance(self):
+        result = self.search(query="red sho")
+        self.assertEqual(self.titles(result), ["Red running shoe", "Blue sandal"])
+        self.assertFalse(result["pageInfo"]["hasNextPage"])
+
+    def test_category_filter_and_cursor(self):
+        first = self.search(query="red", categoryId=self.shoes.id)
+        self.assertEqual(len(first["edges"]), 2)
+        self.assertFalse(first["pageInfo"]["hasNextPage"])
+
+        page = self.search(query="red")
+        rest = self.search(query="red", after=page["pageInfo"]["endCursor"])
+        self.assertEqual(len(self.titles(page) + self.titles(rest)), 3)
+
+    def test_tampered_cursor_is_rejected(self):
+        response = self.execute(
+            self.query, variables={"query": "red", "after": encode_cursor(["abc", 1])}
+        )
+        self.assertEqual(response["errors"][0]["message"], "Invalid cursor")
+
+    def test_index_follows_updates_and_deletes(self):
+        product = Product.objects.get(title="Red cap")
+        product.title = "Green beanie"
+        product.save()
+        self.assertEqual(self.titles(self.search(query="beanie")), ["Green beanie"])
+        product.delete()
+        self.assertEqual(self.titles(self.search(query="beanie")), [])
+
+    def test_punctuation_is_ignored(self):
+        self.assertEqual(self.titles(self.search(query='"(* -')), [])
+
+
+class CatalogueFilterTest(ShopGraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.shoes = Category.objects.create(name="Shoes", slug="shoes")
+        self.hats = Category.objects.create(name="Hats", slug="hats")
+        Product.objects.create(title="Boot", price=120, stock=2, category=self.shoes)
+        Product.objects.create(title="Sandal", price=15, stock=0, category=self.shoes)
+        Product.objects.create(title="Sneaker", price=60, stock=4, category=self.shoes)
+        Product.objects.create(title="Cap", price=12, stock=9, category=self.hats)
+
+    def titles(self, args):
+        query = "{ allProducts(%s) { edges { node { title } } } }" % args
+        edges = self.execute(query)["data"]["allProducts"]["edges"]
+        return [e["node"]["title"] for e in edges]
+
+    def test_filters_and_sort(self):
+        self.assertEqual(
+            self.titles('categorySlug: "shoes", inStock: true, sort: PRICE_DESC'),
+            ["Boot", "Sneaker"],
+        )
+        self.assertEqual(
+            self.titles('minPrice: "13", maxPrice: "100", sort: PRICE_ASC'),
+            ["Sandal", "Sneaker"],
+        )
+
+    def test_facets_follow_product_changes(self):
+        query = """
+        { productFacets(inStock: true) {
+            categories { category { slug } count }
+            priceBuckets { minPrice count }
+        } }
+        """
+
+        def facets():
+            data = self.execute(query)["data"]["productFacets"]
+            categories = {c["category"]["slug"]: c["count"] for c in data["categories"]}
+            buckets = {
+                b["minPrice"]: b["count"] for b in data["priceBuckets"] if b["count"]
+            }
+            return categories, buckets
+
+        self.assertEqual(
+            facets(),
+            ({"shoes": 2, "hats": 1}, {"10": 1, "50": 1, "100": 1}),
+        )
+
+        sandal = Product.objects.get(title="Sandal")
+        sandal.stock = 3
+        sandal.save()
+        Product.objects.get(title="Boot").delete()
+        self.assertEqual(facets(), ({"shoes": 2, "hats": 1}, {"10": 2, "50": 1}))
+
+    def test_title_only_save_leaves_facets_alone(self):
+        cap = Product.objects.get(title="Cap")
+        cap.title = "Beanie"
+        with CaptureQueriesContext(connection) as queries:
+            cap.save(update_fields=["title"])
+        self.assertFalse(
+            [
+                q["sql"]
+                for q in queries.captured_queries
+                if q["sql"].startswith("SELECT") and "shop_product" in q["sql"]
+            ]
+        )
+        self.assertEqual(ProductFacet.objects.filter(category=self.hats).get().count, 1)
+
+
+class CatalogueCacheTest(ShopGraphQLTestCase):
+    products_query = """
+    { allProducts(sort: PRICE_ASC) { edges { node { title price category { name } } } } }
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.cat = Category.objects.create(name="Cat", slug="cat")
+        self.cheap = Product.objects.create(title="Cheap", price=5, category=self.cat)
+        Product.objects.create(title="Dear", price=50, category=self.cat)
+
+    def titles(self):
+        edges = self.execute(self.products_query)["data"]["allProducts"]["edges"]
+        return [(e["node"]["title"], e["node"]["price"]) for e in edges]
+
+    def test_warm_reads_skip_the_database(self):
+        self.titles()
+        self.execute("{ allCategories { name } }")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles(), [("Cheap", "5.00"), ("Dear", "50.00")])
+            response = self.execute(
+                "{ allCategories { name } product(id: %d) { title } }" % self.cheap.pk
+            )
+        self.assertEqual(response["data"]["product"]["title"], "Cheap")
+
+    def test_rows_cached_with_another_field_layout_are_not_read(self):
+        names, _signature = catalogue_cache._row_layout(Product)
+        with mock.patch.object(
+            catalogue_cache, "_row_layout", return_value=(names[:-1], "old")
+        ):
+            catalogue_cache.get_products([self.cheap.pk])
+        with self.assertNumQueries(1):
+            product = catalogue_cache.get_products([self.cheap.pk])[self.cheap.pk]
+        self.assertEqual(product.title, "Cheap")
+        with self.assertNumQueries(0):
+            catalogue_cache.get_products([self.cheap.pk])
+
+    def test_writes_invalidate_rows_and_lists(self):
+        self.titles()
+        self.cheap.price = 500
+        self.cheap.save()
+        Product.objects.create(title="Mid", price=20, category=self.cat)
+        self.assertEqual(
+            self.titles(), [("Mid", "20.00"), ("Dear", "50.00"), ("Cheap", "500.00")]
+        )
+        self.cat.name = "Renamed"
+        self.cat.save()
+        response = self.execute("{ category(id: %d) { name } }" % self.cat.pk)
+        self.assertEqual(response["data"]["category"]["name"], "Renamed")
+
+    def test_stock_changes_keep_lists_warm(self):
+        self.cheap.stock = 3
+        self.cheap.save()
+        self.titles()
+        version = catalogue_cache.catalogue_version()
+        bulk.reserve_stock({self.cheap.pk: 1})
+        product = Product.objects.get(pk=self.cheap.pk)
+        product.stock = 1
+        product.save()
+        self.assertEqual(catalogue_cache.catalogue_version(), version)
+        # The cached page is still read; only the changed row is refetched.
+        with self.assertNumQueries(1):
+            self.titles()
+        self.assertEqual(
+            catalogue_cache.get_products([self.cheap.pk])[self.cheap.pk].stock, 1
+        )
+
+        bulk.reserve_stock({self.cheap.pk: 1})
+        self.assertNotEqual(catalogue_cache.catalogue_version(), version)
+
+    def test_missing_product(self):
+        response = self.execute('{ product(id: "999") { title } }')
+        self.assertEqual(response["errors"][0]["message"], "Product not found")
+
+
+class BulkCatalogueTest(ShopGraphQLTestCase):
+    upsert = """
+    mutation ($input: [ProductInput!]!) {
+        bulkUpsertProducts(input: $input) { created updated products { id title } }
+    }
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create_user(
+            username="staff", email="staff@example.com", password="pw", is_staff=True
+        )
+        self.cat = Category.objects.create(name="Lights", slug="lights")
+        self.lamp = Product.objects.create(
+            sku="LAMP", title="Lamp", price=20, stock=2, category=self.cat
+        )
+
+    def item(self, sku, title, price="5", stock=1, category=None):
+        return {
+            "sku": sku,
+            "categoryId": (category or self.cat).pk,
+            "title": title,
+            "price": price,
+            "stock": stock,
+        }
+
+    def assertFacetsConsistent(self):
+        def snapshot():
+            return set(
+                ProductFacet.objects.filter(count__gt=0).values_list(
+                    "category_id", "price_floor", "in_stock", "count"
+                )
+            )
+
+        incremental = snapshot()
+        facets.rebuild()
+        self.assertEqual(incremental, snapshot())
+
+    def test_upsert_by_sku(self):
+        response = self.execute(
+            self.upsert,
+            user=self.staff,
+            variables={
+                "input": [
+                    self.item("LAMP", "Desk lamp", price="120", stock=0),
+                    self.item("BULB", "Bulb"),
+                ]
+            },
+        )
+        result = response["data"]["bulkUpsertProducts"]
+        self.assertEqual((result["created"], result["updated"]), (1, 1))
+        self.assertEqual(result["products"][0]["id"], str(self.lamp.pk))
+        self.lamp.refresh_from_db()
+        self.assertEqual((self.lamp.title, self.lamp.stock), ("Desk lamp", 0))
+        self.assertEqual(list(search_products("desk")), [self.lamp])
+        self.assertFacetsConsistent()
+
+    def test_invalid_items_reject_the_whole_batch(self):
+        response = self.execute(
+            self.upsert,
+            user=self.staff,
+            variables={
+                "input": [
+                    self.item("BULB", "Bulb"),
+                    self.item("BULB", "Bulb", price="-1"),
+                ]
+            },
+        )
+        errors = response["errors"][0]["extensions"]["errors"]
+        self.assertEqual(len(errors), 3)
+        self.assertFalse(Product.objects.filter(sku="BULB").exists())
+
+    def test_adjust_stock_and_delete(self):
+        bulb = Product.objects.create(title="Bulb", price=1, stock=5, category=self.cat)
+        adjust = """
+        mutation ($deltas: [StockDeltaInput!]!) {
+            bulkAdjustStock(deltas: $deltas) { products { stock } }
+        }
+        """
+        response = self.execute(
+            adjust,
+            user=self.staff,
+            variables={"deltas": [{"productId": self.lamp.pk, "delta": -3}]},
+        )
+        self.assertIn(
+            "Not enough stock", response["errors"][0]["extensions"]["errors"][0]
+        )
+
+        deltas = [
+            {"productId": self.lamp.pk, "delta": -2},
+            {"productId": bulb.pk, "delta": 4},
+        ]
+        response = self.execute(adjust, user=self.staff, variables={"deltas": deltas})
+        products = response["data"]["bulkAdjustStock"]["products"]
+        self.assertEqual([p["stock"] for p in products], [0, 9])
+        self.assertFacetsConsistent()
+
+        delete = "mutation ($ids: [ID!]!) { bulkDeleteProducts(ids: $ids) { deleted } }"
+        response = self.execute(delete, variables={"ids": [bulb.pk]})
+        self.assertEqual(response["errors"][0]["message"], "Admin privileges required")
+        response = self.execute(
+            delete, user=self.staff, variables={"ids": [bulb.pk, self.lamp.pk]}
+        )
+        self.assertEqual(response["data"]["bulkDeleteProducts"]["deleted"], 2)
+        self.assertFalse(Product.objects.exists())
+        self.assertEqual(list(search_products("bulb")), [])
+        self.assertFacetsConsistent()
+
+
+class ImportCatalogTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def feed(self, name, rows):
+        path = self.directory / name
+        if name.endswith(".csv"):
+            with open(path, "w", newline="") as feed:
+                writer = csv.DictWriter(feed, fieldnames=list(rows[0]))
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            path.write_text("".join(json.dumps(row) + "\n" for row in rows))
+        return str(path)
+
+    def run_import(self, path, *args):
+        out = StringIO()
+        call_command("import_catalog", path, "--batch-size", "2", *args, stdout=out)
+        return out.getvalue()
+
+    def row(self, sku, price="9.50", stock=3, category="lamps"):
+        return {
+            "sku": sku,
+            "title": f"Product {sku}",
+            "price": price,
+            "stock": stock,
+            "category_slug": category,
+            "category_name": category.title(),
+        }
+
+    def test_unchanged_rows_are_skipped(self):
+        rows = [self.row("A"), self.row("B"), self.row("C", category="desks")]
+        output = self.run_import(self.feed("feed.csv", rows))
+        self.assertIn("3 written, 0 unchanged", output)
+        self.assertEqual(Category.objects.count(), 2)
+
+        rows[1]["price"] = "12"
+        output = self.run_import(self.feed("feed.jsonl", rows))
+        self.assertIn("1 written, 2 unchanged", output)
+        self.assertEqual(Product.objects.get(sku="B").price, 12)
+
+    def test_feed_without_category_names_keeps_existing_names(self):
+        Category.objects.create(name="Lamps & Lights", slug="lamps")
+        rows = [self.row("A"), self.row("B", category="desks")]
+        for row in rows:
+            del row["category_name"]
+        self.run_import(self.feed("feed.csv", rows))
+        self.assertEqual(
+            dict(Category.objects.values_list("slug", "name")),
+            {"lamps": "Lamps & Lights", "desks": "desks"},
+        )
+
+    def test_bad_row_reports_resume_offset(self):
+        rows = [self.row("A"), self.row("B"), self.row("C", price="free")]
+        path = self.feed("feed.jsonl", rows)
+        with self.assertRaisesMessage(CommandError, "--offset 2"):
+            self.run_import(path)
+        self.assertEqual(Product.objects.count(), 2)
+
+        rows[2]["price"] = "1"
+        output = self.run_import(self.feed("feed.jsonl", rows), "--offset", "2")
+        self.assertIn("Imported 1 rows", output)
+        self.assertEqual(Product.objects.count(), 3)
+
+
+class ExportOrdersTest(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            username="staff", email="staff@example.com", password="pw", is_staff=True
+        )
+        cat = Category.objects.create(name="Cat", slug="cat")
+        lamp = Product.objects.create(title="Lamp", price=10, stock=9, category=cat)
+        paid = Order.objects.create(user=self.staff, total=20, status="paid")
+        OrderItem.objects.create(order=paid, product=lamp, quantity=2, price=10)
+        Order.objects.create(total=0, status="cancelled")
+        self.http = HttpClient()
+
+    def test_endpoint_streams_csv_and_ndjson(self):
+        self.assertEqual(self.http.get("/exports/orders").status_code, 403)
+
+        self.http.force_login(self.staff)
+        response = self.http.get("/exports/orders")
+        self.assertTrue(response.streaming)
+        rows = list(csv.DictReader(StringIO(b"".join(response).decode())))
+        self.assertEqual([row["status"] for row in rows], ["paid", "cancelled"])
+        self.assertEqual((rows[0]["product_title"], rows[1]["item_id"]), ("Lamp", ""))
+
+        response = self.http.get(
+            "/exports/orders", {"format": "ndjson", "status": "paid"}
+        )
+        orders = [json.loads(line) for line in b"".join(response).splitlines()]
+        self.assertEqual(len(orders), 1)
+        self.assertEqual(orders[0]["items"][0]["quantity"], 2)
+
+        response = self.http.get("/exports/orders", {"since": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_command(self):
+        out = StringIO()
+        call_command(
+            "export_orders", "--format", "ndjson", "--status", "cancelled", stdout=out
+        )
+        orders = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([order["items"] for order in orders], [[]])
+
+    def test_date_range_covers_whole_local_days(self):
+        today = timezone.localdate()
+        yesterday = today - timedelta(days=1)
+        midnight = timezone.make_aware(datetime.combine(today, time.min))
+        Order.objects.filter(status="cancelled").update(
+            created_at=midnight - timedelta(microseconds=1)
+        )
+
+        def statuses(**dates):
+            return [row[2] for row in order_rows(**dates)]
+
+        self.assertEqual(statuses(since=today), ["paid"])
+        self.assertEqual(statuses(until=yesterday), ["cancelled"])
+        self.assertEqual(statuses(since=yesterday, until=today), ["paid", "cancelled"])
+
+
+@override_settings(PRODUCT_IMAGE_WORKERS=0)
+class ProductImageTest(ShopGraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        storage = FileSystemStorage(location=media.name, base_url="/media/")
+        for module in ("shop.images", "shop.schema"):
+            patcher = mock.patch(f"{module}.default_storage", storage)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.storage = storage
+        self.cat = Category.objects.create(name="Cat", slug="cat")
+
+    def upload(self, width=800, height=400):
+        out = BytesIO()
+        Image.new("RGB", (width, height), "red").save(out, "PNG")
+        return self.storage.save("products/lamp.png", ContentFile(out.getvalue()))
+
+    def test_variants_are_generated_and_picked(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                title="Lamp", price=1, category=self.cat, image=self.upload()
+            )
+        product.refresh_from_db()
+        variants = product.image_variants["variants"]
+        self.assertEqual(sorted({v["width"] for v in variants}), [160, 320, 640, 800])
+        for variant in variants:
+            self.assertTrue(self.storage.exists(variant["name"]))
+
+        query = """
+        query ($id: ID!) {
+            product(id: $id) { small: imageUrl(width: 300) big: imageUrl(width: 2000, format: JPEG) }
+        }
+        """
+        data = self.execute(query, variables={"id": product.pk})["data"]["product"]
+        self.assertRegex(data["small"], r"^/media/products/lamp\.\w{12}\.320w\.webp$")
+        self.assertTrue(data["big"].endswith(".800w.jpeg"))
+
+    def test_original_is_served_until_variants_exist(self):
+        product = Product.objects.create(
+            title="Lamp", price=1, category=self.cat, image=self.upload()
+        )
+        self.assertEqual(images.pick_variant(product, 320), product.image.name)
+
+
+class PersistedQueryTest(TestCase):
+    query = "{ allCategories { name } }"
+
+    def setUp(self):
+        cache.clear()
+        documents.clear()
+        self.http = HttpClient()
+        Category.objects.create(name="Cat", slug="cat")
+
+    def post(self, **body):
+        return self.http.post("/graphql/", body, content_type="application/json").json()
+
+    def persisted(self, sha256):
+        return {"persistedQuery": {"version": 1, "sha256Hash": sha256}}
+
+    def test_hash_is_registered_then_served(self):
+        sha256 = query_hash(self.query)
+        response = self.post(extensions=self.persisted(sha256))
+        self.assertEqual(
+            response["errors"][0]["extensions"]["code"], "PERSISTED_QUERY_NOT_FOUND"
+        )
+
+        response = self.post(query=self.query, extensions=self.persisted(sha256))
+        self.assertEqual(response["data"]["allCategories"], [{"name": "Cat"}])
+
+        response = self.post(extensions=self.persisted(sha256))
+        self.assertEqual(response["data"]["allCategories"], [{"name": "Cat"}])
+
+    def test_hash_must_match_query(self):
+        response = self.post(query=self.query, extensions=self.persisted("0" * 64))
+        self.assertIn("does not match", response["errors"][0]["message"])
+
+    def test_documents_are_parsed_once(self):
+        self.post(query=self.query)
+        document = documents.get(query_hash(self.query))
+        self.assertIsNotNone(document)
+        self.post(query=self.query)
+        self.assertIs(documents.get(query_hash(self.query)), document)
+
+        self.post(query="{ allCategories { nope } }")
+        self.assertEqual(len(documents), 1)
+
+
+class HttpCacheTest(TestCase):
+    query = "{ allCategories { name products { title } } }"
+
+    def setUp(self):
+        cache.clear()
+        documents.clear()
+        self.http = HttpClient(HTTP_ACCEPT="application/json")
+        category = Category.objects.create(name="Cat", slug="cat")
+        self.product = Product.objects.create(
+            title="Lamp", category=category, price=10, stock=1
+        )
+
+    def get(self, query=None, **headers):
+        return self.http.get("/graphql/", {"query": query or self.query}, **headers)
+
+    def test_anonymous_catalogue_query_is_revalidated(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("max-age=60", response["Cache-Control"])
+        validator = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.get(HTTP_IF_NONE_MATCH=validator)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], validator)
+
+        self.product.title = "Desk lamp"
+        self.product.save()
+        response = self.get(HTTP_IF_NONE_MATCH=validator)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], validator)
+
+    def test_private_or_uncacheable_requests_get_no_etag(self):
+        self.assertNotIn(
+            "ETag", self.get("{ allProducts { edges { node { orders { id } } } } }")
+        )
+        self.assertNotIn("ETag", self.get(HTTP_AUTHORIZATION="JWT token"))
+        response = self.http.post(
+            "/graphql/", {"query": self.query}, content_type="application/json"
+        )
+        self.assertNotIn("ETag", response)
+
+        self.http.force_login(
+            get_user_model().objects.create_user(
+                username="u", email="u@example.com", password="pw"
+            )
+        )
+        self.assertNotIn("ETag", self.get())
+
+
+class CountersTest(ShopGraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.buyer = User.objects.create_user(
+            username="buyer", email="buyer@example.com", password="pw"
+        )
+        self.cat = Category.objects.create(name="Lights", slug="lights")
+        self.other = Category.objects.create(name="Other", slug="other")
+        self.lamp = Product.objects.create(
+            title="Lamp", price=20, stock=2, category=self.cat
+        )
+        Product.objects.create(title="Bulb", price=1, stock=0, category=self.cat)
+
+    def counts(self, category):
+        category.refresh_from_db()
+        return category.product_count, category.in_stock_count
+
+    def test_category_counters_follow_products(self):
+        self.assertEqual(self.counts(self.cat), (2, 1))
+        self.lamp.stock = 0
+        self.lamp.save()
+        self.assertEqual(self.counts(self.cat), (2, 0))
+        self.lamp.category = self.other
+        self.lamp.stock = 3
+        self.lamp.save()
+        self.assertEqual(self.counts(self.cat), (1, 0))
+        self.assertEqual(self.counts(self.other), (1, 1))
+        self.lamp.delete()
+        self.assertEqual(self.counts(self.other), (0, 0))
+
+    def test_checkout_counts_units_and_orders(self):
+        CartItem.objects.create(user=self.buyer, product=self.lamp, quantity=2)
+        response = self.execute("mutation { checkout { orderId } }", user=self.buyer)
+        self.assertIsNone(response.get("errors"))
+        self.lamp.refresh_from_db()
+        self.buyer.refresh_from_db()
+        self.assertEqual(self.lamp.units_sold, 2)
+        self.assertEqual(self.buyer.order_count, 1)
+        self.assertEqual(self.counts(self.cat), (2, 0))
+
+    def test_checkout_without_enough_stock_writes_nothing(self):
+        CartItem.objects.create(user=self.buyer, product=self.lamp, quantity=3)
+        response = self.execute("mutation { checkout { orderId } }", user=self.buyer)
+        self.assertEqual(response["errors"][0]["message"], "Not enough stock for Lamp")
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.stock, 2)
+        self.assertEqual(self.lamp.units_sold, 0)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.filter(user=self.buyer).count(), 1)
+        self.assertEqual(self.counts(self.cat), (2, 1))
+
+    def test_recount_repairs_drift(self):
+        order = Order.objects.create(user=self.buyer, total=20)
+        OrderItem.objects.create(order=order, product=self.lamp, quantity=3, price=20)
+        Category.objects.update(product_count=7, in_stock_count=7)
+        out = StringIO()
+        call_command("recount", batch_size=1, stdout=out)
+        self.assertEqual(self.counts(self.cat), (2, 1))
+        self.assertEqual(self.counts(self.other), (0, 0))
+        self.lamp.refresh_from_db()
+        self.buyer.refresh_from_db()
+        self.assertEqual(self.lamp.units_sold, 3)
+        self.assertEqual(self.buyer.order_count, 1)
+        self.assertIn("categories: 2 rows", out.getvalue())
+
+
+class CartSnapshotTest(ShopGraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        cat = Category.objects.create(name="Lights", slug="lights")
+        self.lamp = Product.objects.create(
+            title="Lamp", price=20, stock=2, category=cat
+        )
+        self.bulb = Product.objects.create(title="Bulb", price=1, stock=9, category=cat)
+        self.request = self.factory.get("/")
+        self.request.session = SessionStore()
+        cart = Cart(self.request)
+        cart.add(self.lamp, quantity=2)
+        cart.add(self.bulb, quantity=3)
+
+    def test_products_are_looked_up_once(self):
+        cache.clear()
+        cart = Cart(self.request)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(cart)), 2)
+            list(cart)
+            summary = cart.summary
+            self.assertEqual(cart.get_total_price(), summary.total_price)
+        self.assertEqual(summary.total_items, 5)
+        self.assertEqual(summary.total_price, Decimal("43"))
+
+    def test_stale_snapshots_are_refreshed(self):
+        self.lamp.price = 25
+        self.lamp.save()
+        self.bulb.delete()
+        summary = Cart(self.request).summary
+        self.assertEqual([item["product"].title for item in summary.items], ["Lamp"])
+        self.assertEqual(summary.total_price, Decimal("50"))
+        stored = self.request.session[settings.CART_SESSION_ID]
+        self.assertEqual(list(stored), [str(self.lamp.pk)])
+        self.assertEqual(stored[str(self.lamp.pk)]["price"], "25.00")
+
+    def test_guest_totals_skip_deleted_products(self):
+        self.bulb.delete()
+        self.request.user = AnonymousUser()
+        response = self.client.execute(
+            "{ cart { totalItems totalPrice } }", context_value=self.request
+        )
+        self.assertEqual(
+            response["data"]["cart"], {"totalItems": 2, "totalPrice": "40.00"}
+        )
+
+
+class CartBackendTest(TestCase):
+    backends = (
+        "shop.cart.SessionCartBackend",
+        "shop.cart.CacheCartBackend",
+        "shop.cart.DatabaseCartBackend",
+    )
+
+    def setUp(self):
+        cat = Category.objects.create(name="Lights", slug="lights")
+        self.lamp = Product.objects.create(
+            title="Lamp", price=20, stock=2, category=cat
+        )
+        self.bulb = Product.objects.create(title="Bulb", price=1, stock=9, category=cat)
+
+    def request(self):
+        request = RequestFactory().get("/")
+        request.session = SessionStore()
+        return request
+
+    def test_backends_round_trip(self):
+        for backend in self.backends:
+            with self.subTest(backend=backend), override_settings(CART_BACKEND=backend):
+                request = self.request()
+                cart = Cart(request)
+                cart.add(self.lamp, quantity=2)
+                cart.add(self.bulb)
+                cart.remove(self.bulb)
+                # The cart key or data survives a new session key on login.
+                request.session.cycle_key()
+
+                summary = Cart(request).summary
+                self.assertEqual(summary.total_items, 2)
+                self.assertEqual(summary.total_price, Decimal("40"))
+
+                Cart(request).clear()
+                self.assertEqual(len(Cart(request)), 0)
+                self.assertFalse(CartItem.objects.exists())
+
+    @override_settings(CART_BACKEND="shop.cart.DatabaseCartBackend")
+    def test_database_backend_stores_quantities(self):
+        request = self.request()
+        Cart(request).add(self.lamp, quantity=3)
+        item = CartItem.objects.get()
+        self.assertIsNone(item.user)
+        self.assertEqual(item.session_key, request.session[settings.CART_SESSION_ID])
+        self.assertEqual(item.quantity, 3)
+
+
+class CartMergeTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="buyer", email="buyer@example.com", password="pw"
+        )
+        cat = Category.objects.create(name="Lights", slug="lights")
+        self.products = [
+            Product.objects.create(title=f"P{n}", price=1, stock=9, category=cat)
+            for n in range(10)
+        ]
+
+    def login_with_cart(self, products, quantity=2):
+        request = RequestFactory().get("/")
+        request.session = SessionStore()
+        cart = Cart(request)
+        for product in products:
+            cart.add(product, quantity=quantity)
+        merge_cart_on_login(sender=User, user=self.user, request=request)
+        return request
+
+    def quantities(self):
+        return dict(
+            CartItem.objects.filter(user=self.user).values_list(
+                "product_id", "quantity"
+            )
+        )
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        counts = []
+        for size in (1, 10):
+            CartItem.objects.all().delete()
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.login_with_cart(self.products[:size])
+            counts.append(len(queries))
+            self.assertEqual(len(self.quantities()), size)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_merge_policies(self):
+        lamp = self.products[0]
+        for policy, expected in (("sum", 5), ("max", 3), ("replace", 2)):
+            with self.subTest(policy=policy), override_settings(
+                CART_MERGE_POLICY=policy
+            ):
+                CartItem.objects.all().delete()
+                CartItem.objects.create(user=self.user, product=lamp, quantity=3)
+                request = self.login_with_cart([lamp, self.products[1]])
+                self.assertEqual(
+                    self.quantities(), {lamp.pk: expected, self.products[1].pk: 2}
+                )
+                self.assertEqual(len(Cart(request)), 0)
+
+
+class CartUpsertTest(ShopGraphQLTestCase):
+    add = """
+    mutation ($id: ID!, $quantity: Int!) {
+        addToCart(productId: $id, quantity: $quantity) {
+            totalItems
+            cartItem { id quantity }
+        }
+    }
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username="buyer", email="buyer@example.com", password="pw"
+        )
+        cat = Category.objects.create(name="Lights", slug="lights")
+        self.lamp = Product.objects.create(
+            title="Lamp", price=20, stock=5, category=cat
+        )
+
+    def add_to_cart(self, quantity, product=None):
+        return self.execute(
+            self.add,
+            user=self.user,
+            variables={"id": (product or self.lamp).pk, "quantity": quantity},
+        )
+
+    def test_add_increments_in_one_statement(self):
+        self.add_to_cart(2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.add_to_cart(3)
+        data = response["data"]["addToCart"]
+        self.assertEqual(data["totalItems"], 5)
+        self.assertEqual(data["cartItem"]["quantity"], 5)
+        self.assertEqual(CartItem.objects.get().quantity, 5)
+        statements = [query["sql"] for query in queries.captured_queries]
+        self.assertFalse(
+            [sql for sql in statements if sql.startswith('SELECT "shop_product"')]
+        )
+
+    def test_stock_bounds(self):
+        self.add_to_cart(4)
+        response = self.add_to_cart(2)
+        self.assertEqual(response["errors"][0]["message"], "Not enough stock")
+        self.assertEqual(CartItem.objects.get().quantity, 4)
+
+    def test_add_without_returning_support(self):
+        features = type(connection.features)
+        with mock.patch.object(features, "can_return_rows_from_bulk_insert", False):
+            first = add_quantity(self.user, self.lamp.pk, 2)
+            line = add_quantity(self.user, self.lamp.pk, 3)
+            self.assertIsNone(add_quantity(self.user, self.lamp.pk, 1))
+        self.assertEqual((line.pk, line.quantity), (first.pk, 5))
+        self.assertEqual(CartItem.objects.get().quantity, 5)
+
+        item = CartItem.objects.get()
+        update = """
+        mutation ($id: ID!, $quantity: Int!) {
+            updateCartItemQuantity(cartItemId: $id, quantity: $quantity) {
+                cartItem { quantity }
+            }
+        }
+        """
+        response = self.execute(
+            update, user=self.user, variables={"id": item.pk, "quantity": 6}
+        )
+        self.assertEqual(response["errors"][0]["message"], "Not enough stock")
+        response = self.execute(
+            update, user=self.user, variables={"id": item.pk, "quantity": 5}
+        )
+        self.assertEqual(
+            response["data"]["updateCartItemQuantity"]["cartItem"]["quantity"], 5
+        )
+
+    def test_missing_product(self):
+        response = self.execute(
+            self.add, user=self.user, variables={"id": 999, "quantity": 1}
+        )
+        self.assertEqual(response["errors"][0]["message"], "Product not found")
+
+
+class CartTotalsTest(ShopGraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username="buyer", email="buyer@example.com", password="pw"
+        )
+        cat = Category.objects.create(name="Lights", slug="lights")
+        for n, price in enumerate(("2.50", "10")):
+            product = Product.objects.create(
+                title=f"P{n}", price=price, stock=9, category=cat
+            )
+            CartItem.objects.create(user=self.user, product=product, quantity=n + 2)
+
+    def test_total_items_loads_no_lines(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.execute("{ cart { totalItems } }", user=self.user)
+        self.assertEqual(response["data"]["cart"]["totalItems"], 5)
+        self.assertEqual(len(queries), 1)
+        self.assertIn("SUM", queries[0]["sql"])
+
+    def test_totals_and_line_totals_from_the_database(self):
+        query = """
+        { cart { totalItems totalPrice items { ... on CartItemType { quantity totalPrice } } } }
+        """
+        with self.assertNumQueries(2):
+            response = self.execute(query, user=self.user)
+        cart = response["data"]["cart"]
+        self.assertEqual(cart["totalItems"], 5)
+        self.assertEqual(Decimal(cart["totalPrice"]), Decimal("35"))
+        self.assertEqual(
+            [Decimal(item["totalPrice"]) for item in cart["items"]],
+            [Decimal("5"), Decimal("30")],
+        )
+
+    def test_empty_cart(self):
+        CartItem.objects.all().delete()
+        response = self.execute("{ cart { totalItems totalPrice } }", user=self.user)
+        self.assertEqual(response["data"]["cart"], {"totalItems": 0, "totalPrice": "0"})
+
+
+class UpdateCartTest(ShopGraphQLTestCase):
+    mutation = """
+    mutation ($lines: [CartLineInput!]!) {
+        updateCart(lines: $lines) {
+            cart {
+                totalItems
+                items {
+                    ... on CartItemType { quantity product { id } }
+                    ... on GuestCartItemType { quantity product { id } }
+                }
+            }
+        }
+    }
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username="buyer", email="buyer@example.com", password="pw"
+        )
+        cat = Category.objects.create(name="Lights", slug="lights")
+        self.lamp, self.bulb, self.shade = (
+            Product.objects.create(title=title, price=1, stock=5, category=cat)
+            for title in ("Lamp", "Bulb", "Shade")
+        )
+
+    def lines(self):
+        return [
+            {"productId": self.lamp.pk, "delta": 1},
+            {"productId": self.bulb.pk, "quantity": 0},
+            {"productId": self.shade.pk, "quantity": 4},
+        ]
+
+    def quantities(self, response):
+        items = response["data"]["updateCart"]["cart"]["items"]
+        return {int(item["product"]["id"]): item["quantity"] for item in items}
+
+    def test_user_cart(self):
+        for product in (self.lamp, self.bulb):
+            CartItem.objects.create(user=self.user, product=product, quantity=2)
+        response = self.execute(
+            self.mutation, user=self.user, variables={"lines": self.lines()}
+        )
+        self.assertEqual(self.quantities(response), {self.lamp.pk: 3, self.shade.pk: 4})
+        self.assertEqual(response["data"]["updateCart"]["cart"]["totalItems"], 7)
+
+    def test_guest_cart(self):
+        request = self.factory.post("/graphql/")
+        request.user = AnonymousUser()
+        request.session = SessionStore()
+        cart = Cart(request)
+        cart.add(self.lamp, quantity=2)
+        cart.add(self.bulb, quantity=2)
+        response = self.client.execute(
+            self.mutation, context_value=request, variables={"lines": self.lines()}
+        )
+        self.assertEqual(self.quantities(response), {self.lamp.pk: 3, self.shade.pk: 4})
+        self.assertEqual(len(Cart(request)), 7)
+
+    def test_rejects_all_changes_on_error(self):
+        CartItem.objects.create(user=self.user, product=self.lamp, quantity=2)
+        lines = [
+            {"productId": self.lamp.pk, "quantity": 1},
+            {"productId": self.bulb.pk, "delta": 6},
+            {"productId": self.shade.pk, "quantity": 1, "delta": 1},
+        ]
+        response = self.execute(
+            self.mutation, user=self.user, variables={"lines": lines}
+        )
+        self.assertEqual(
+            response["errors"][0]["extensions"]["errors"],
+            ["2: Pass either quantity or delta"],
+        )
+        lines.pop()
+        response = self.execute(
+            self.mutation, user=self.user, variables={"lines": lines}
+        )
+        self.assertEqual(
+            response["errors"][0]["extensions"]["errors"],
+            ["1: Not enough stock for Bulb"],
+        )
+        self.assertEqual(CartItem.objects.get().quantity, 2)
+
+
+class PurgeStaleTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="buyer", email="buyer@example.com", password="pw"
+        )
+        cat = Category.objects.create(name="Lights", slug="lights")
+        self.products = [
+            Product.objects.create(title=f"P{n}", price=1, stock=9, category=cat)
+            for n in range(3)
+        ]
+
+    def test_purges_only_stale_rows(self):
+        now = timezone.now()
+        old = now - timedelta(days=365)
+        for n, product in enumerate(self.products):
+            CartItem.objects.create(session_key=f"guest-{n}", product=product)
+        CartItem.objects.create(user=self.user, product=self.products[0])
+        CartItem.objects.filter(session_key__in=["guest-0", "guest-1"]).update(
+            added_at=old, updated_at=old
+        )
+        for n in range(3):
+            SessionStore().create()
+        Session.objects.update(expire_date=old)
+        SessionStore().create()
+        RefreshToken.objects.create(user=self.user, expires_at=old)
+        RefreshToken.objects.create(user=self.user, revoked=True)
+        fresh = RefreshToken.objects.create(user=self.user)
+
+        out = StringIO()
+        call_command("purge_stale", batch_size=1, sleep=0, stdout=out)
+
+        self.assertEqual(
+            set(CartItem.objects.values_list("session_key", flat=True)),
+            {"guest-2", None},
+        )
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertEqual(list(RefreshToken.objects.all()), [fresh])
+        report = out.getvalue()
+        for line in (
+            "cart_items: 2 rows",
+            "sessions: 3 rows",
+            "refresh_tokens: 2 rows",
+        ):
+            self.assertIn(line, report)
+
+    def test_old_lines_updated_recently_survive(self):
+        old = timezone.now() - timedelta(days=365)
+        merge_quantities(self.user, {p.pk: 1 for p in self.products})
+        CartItem.objects.update(added_at=old, updated_at=old)
+        add_quantity(self.user, self.products[0].pk, 1)
+        merge_quantities(self.user, {self.products[1].pk: 3}, policy="replace")
+
+        call_command("purge_stale", batch_size=1, sleep=0, stdout=StringIO())
+
+        self.assertEqual(
+            set(CartItem.objects.values_list("product", flat=True)),
+            {self.products[0].pk, self.products[1].pk},
+        )
+
+
+class DebugModeTest(TestCase):
+    @override_settings(DEBUG=True)
+    def test_debug_sql_middleware_leaves_no_wrapped_cursor(self):
+        view = LoggingGraphQLView.as_view(middleware=[DjangoDebugMiddleware()])
+        request = RequestFactory().post(
+            "/graphql/",
+            {"query": "{ allCategories { name } }"},
+            content_type="application/json",
+        )
+        request.user = AnonymousUser()
+        request.session = SessionStore()
+        self.assertEqual(view(request).status_code, 200)
+        self.assertFalse(hasattr(connection, "_graphene_cursor"))
+        Category.objects.create(name="After", slug="after")
+
+
+class BatchedOperationsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.http = HttpClient()
+        category = Category.objects.create(name="Cat", slug="cat")
+        self.product = Product.objects.create(
+            title="Lamp", category=category, price=10, stock=5
+        )
+
+    def post(self, body):
+        return self.http.post("/graphql/", body, content_type="application/json")
+
+    def test_operations_share_the_request_in_order(self):
+        cart = "{ cart { totalItems } }"
+        add = "mutation ($id: ID!) { addToCart(productId: $id, quantity: 2) { totalItems } }"
+        response = self.post(
+            [
+                {"id": "1", "query": cart},
+                {"id": "2", "query": add, "variables": {"id": self.product.pk}},
+                {"id": "3", "query": cart},
+            ]
+        )
+        results = response.json()
+        self.assertEqual([result["id"] for result in results], ["1", "2", "3"])
+        self.assertEqual(results[0]["data"]["cart"]["totalItems"], 0)
+        self.assertEqual(results[2]["data"]["cart"]["totalItems"], 2)
+
+    def test_batch_size_is_limited(self):
+        with self.settings(GRAPHQL_BATCH_MAX_SIZE=2):
+            response = self.post([{"query": "{ allCategories { name } }"}] * 3)
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_entries_must_be_objects(self):
+        response = self.post([1, 2])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()["errors"][0]["message"],
+            "Every operation of a batch must be an object.",
+        )
+
+    async def test_async_batch_entries_must_be_objects(self):
+        request = AsyncRequestFactory().post(
+            "/graphql/",
+            [{"query": "{ allCategories { name } }"}, 2],
+            content_type="application/json",
+        )
+        request.user = AnonymousUser()
+        request.session = SessionStore()
+        response = await AsyncGraphQLView.as_view()(request)
+        self.assertEqual(response.status_code, 400)
+
+
+class QueryComplexityTest(TestCase):
+    def errors(self, query):
+        return validate(schema.graphql_schema, parse(query), [QueryComplexityRule])
+
+    def test_cyclic_nesting_is_rejected(self):
+        errors = self.errors("""
+            query ($n: Int) { myOrders(first: $n) { edges { node {
+                products { orders { products { orders { products { title } } } } }
+            } } } }
+            """)
+        self.assertEqual(errors[0].extensions["code"], "QUERY_TOO_COMPLEX")
+
+        errors = self.errors(
+            "{ allCategories { products { category { products { category {"
+            " products { category { products { category { products { title }"
+            " } } } } } } } } } }"
+        )
+        self.assertIn("QUERY_TOO_DEEP", [e.extensions["code"] for e in errors])
+
+    def test_fragment_cycles_terminate(self):
+        errors = self.errors(
+            "{ allCategories { ...C } } fragment C on CategoryType { products {"
+            " category { ...C } } }"
+        )
+        self.assertEqual(errors, [])
+
+    def test_cost_is_reported(self):
+        response = (
+            HttpClient()
+            .post(
+                "/graphql/",
+                {
+                    "query": "query ($n: Int) { allProducts(first: $n) "
+                    "{ edges { node { title } } } }",
+                    "variables": {"n": 5},
+                },
+                content_type="application/json",
+            )
+            .json()
+        )
+        # allProducts + 5 * (edges + node + title)
+        self.assertEqual(response["extensions"]["cost"]["cost"], 16)
+        self.assertEqual(response["extensions"]["cost"]["depth"], 4)
+
+    def test_first_is_clamped_to_the_page_size_cap(self):
+        errors = self.errors(
+            "{ allProducts(first: 1000000000) { edges { node { title } } } }"
+        )
+        self.assertEqual(errors, [])
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+        cat = Category.objects.create(name="Cat", slug="cat")
+        Product.objects.create(title="Shoe", price=10, category=cat)
+
+    def test_operations_and_resolvers_are_recorded(self):
+        http = HttpClient()
+        http.post(
+            "/graphql/",
+            {
+                "query": "query Catalogue { allProducts { edges { node {"
+                " title category { name } } } } }"
+            },
+            content_type="application/json",
+        )
+        with self.settings(METRICS_TOKEN="secret"):
+            response = http.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+        metrics = response.content.decode()
+
+        self.assertIn(
+            'graphql_operation_duration_seconds_count{operation="Catalogue"} 1',
+            metrics,
+        )
+        self.assertIn(
+            'graphql_resolver_sql_queries_count{field="Query.allProducts"} 1',
+            metrics,
+        )
+        self.assertIn('field="ProductType.category"', metrics)
+        self.assertNotIn('field="ProductType.title"', metrics)
+
+        queries = [
+            line
+            for line in metrics.splitlines()
+            if line.startswith("graphql_operation_sql_queries_sum")
+        ]
+        self.assertEqual(
+            queries, ['graphql_operation_sql_queries_sum{operation="Catalogue"} 2']
+        )
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_token_is_required_when_configured(self):
+        http = HttpClient()
+        self.assertEqual(http.get("/metrics").status_code, 403)
+        response = http.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(response.status_code, 403)
+        response = http.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_only_staff_without_token(self):
+        http = HttpClient()
+        self.assertEqual(http.get("/metrics").status_code, 403)
+        http.force_login(
+            User.objects.create_user(username="u", email="u@example.com", password="pw")
+        )
+        self.assertEqual(http.get("/metrics").status_code, 403)
+        http.force_login(
+            User.objects.create_user(
+                username="staff",
+                email="staff@example.com",
+                password="pw",
+                is_staff=True,
+            )
+        )
+        self.assertEqual(http.get("/metrics").status_code, 200)
+
+
+class OperationLoggingTest(TestCase):
+    register = """
+    mutation Register($email: String!, $password: String!) {
+        register(email: $email, password1: $password, password2: $password) {
+            success
+        }
+    }
+    """
+
+    def post(self, **body):
+        return HttpClient().post("/graphql/", body, content_type="application/json")
+
+    @override_settings(GRAPHQL_LOGGING={"MODE": "variables"})
+    def test_one_redacted_line_per_operation(self):
+        with self.assertLogs("graphql.operations") as logs:
+            self.post(
+                query=self.register,
+                variables={"email": "a@example.com", "password": "hunter22"},
+            )
+        (record,) = logs.records
+        self.assertEqual(record.graphql["operation"], "Register")
+        self.assertEqual(record.graphql["variables"]["password"], "[REDACTED]")
+        self.assertEqual(record.graphql["variables"]["email"], "a@example.com")
+        self.assertNotIn("hunter22", JsonFormatter().format(record))
+
+    @override_settings(GRAPHQL_LOGGING={"SAMPLE_RATE": 0})
+    def test_sampling_keeps_failures(self):
+        with self.assertLogs("graphql.operations") as logs:
+            self.post(query="{ allCategories { name } }")
+            self.post(query='{ product(id: "999") { title } }')
+        (record,) = logs.records
+        self.assertEqual(record.graphql["status"], "error")
+        self.assertNotIn("variables", record.graphql)
+
+
+class AsyncViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cat = Category.objects.create(name="Cat", slug="cat")
+        self.product = Product.objects.create(
+            title="Shoe", price=10, stock=3, category=self.cat
+        )
+        self.user = User.objects.create_user(
+            username="buyer", email="buyer@example.com", password="12345678"
+        )
+        self.view = AsyncGraphQLView.as_view()
+
+    async def post(self, query, user=None, **variables):
+        request = AsyncRequestFactory().post(
+            "/graphql/",
+            {"query": query, "variables": variables},
+            content_type="application/json",
+        )
+        request.user = user or AnonymousUser()
+        request.session = SessionStore()
+        response = await self.view(request)
+        return json.loads(response.content)
+
+    async def test_catalogue_queries(self):
+        response = await self.post(
+            """
+            query ($id: ID!) {
+                allProducts { totalCount edges { node { title category { name } } } }
+                product(id: $id) { title }
+                productFacets { categories { count } }
+            }
+            """,
+            id=self.product.pk,
+        )
+        self.assertNotIn("errors", response)
+        data = response["data"]
+        self.assertEqual(data["allProducts"]["totalCount"], 1)
+        node = data["allProducts"]["edges"][0]["node"]
+        self.assertEqual(node, {"title": "Shoe", "category": {"name": "Cat"}})
+        self.assertEqual(data["product"]["title"], "Shoe")
+        self.assertEqual(data["productFacets"]["categories"], [{"count": 1}])
+
+    async def test_cart_and_orders(self):
+        await CartItem.objects.acreate(user=self.user, product=self.product, quantity=2)
+        order = await Order.objects.acreate(user=self.user, total=10)
+        await OrderItem.objects.acreate(
+            order=order, product=self.product, quantity=1, price=10
+        )
+        response = await self.post(
+            """
+            query ($id: Int!) {
+                cart { totalItems items { ... on CartItemType { product { title } } } }
+                myOrders { edges { node { items { product { title } } } } }
+                order(id: $id) { total }
+            }
+            """,
+            user=self.user,
+            id=order.pk,
+        )
+        self.assertNotIn("errors", response)
+        data = response["data"]
+        self.assertEqual(data["cart"]["totalItems"], 2)
+        self.assertEqual(data["cart"]["items"], [{"product": {"title": "Shoe"}}])
+        orders = data["myOrders"]["edges"]
+        self.assertEqual(orders[0]["node"]["items"][0]["product"]["title"], "Shoe")
+        self.assertEqual(data["order"]["total"], "10.00")
+
+    @override_settings(
+        PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"]
+    )
+    async def test_mutations_run_through_the_bridge(self):
+        register = """
+        mutation {
+            register(email: "new@example.com", password1: "pw-123456", password2: "pw-123456") {
+                success
+            }
+        }
+        """
+        response = await self.post(register)
+        self.assertNotIn("errors", response)
+        self.assertTrue(response["data"]["register"]["success"])
+        self.assertEqual(len(mail.outbox), 1)
+        user = await User.objects.aget(email="new@example.com")
+        self.assertTrue(user.check_password("pw-123456"))
+
+    async def test_lookups_overlap_on_the_event_loop(self):
+        both_started = asyncio.Event()
+        started = []
+
+        async def gated_rows(model, ids):
+            started.append(ids)
+            if len(started) == 2:
+                both_started.set()
+            # Returns once the other lookup has started, or gives up.
+            await asyncio.wait_for(both_started.wait(), 5)
+            return {self.product.pk: self.product}
+
+        query = "query ($id: ID!) { a: product(id: $id) { title } b: product(id: $id) { title } }"
+        with mock.patch("shop.cache.aget_rows", gated_rows):
+            response = await self.post(query, id=self.product.pk)
+        self.assertNotIn("errors", response)
+        self.assertEqual(response["data"]["b"], {"title": "Shoe"})
+        self.assertEqual(len(started), 2)
+
+    async def test_batched_queries_run_concurrently(self):
+        all_started = asyncio.Event()
+        started = []
+
+        async def gated_paginate(*args):
+            started.append(args)
+            if len(started) == 3:
+                all_started.set()
+            # Returns once every query of the batch is paging, or gives up.
+            await asyncio.wait_for(all_started.wait(), 5)
+            return await apaginate(*args)
+
+        query = "{ allProducts { edges { node { title } } } }"
+        request = AsyncRequestFactory().post(
+            "/graphql/",
+            [{"query": query}] * 3,
+            content_type="application/json",
+        )
+        request.user = AnonymousUser()
+        request.session = SessionStore()
+        with mock.patch("a_config.pagination.apaginate", gated_paginate):
+            response = await self.view(request)
+        results = json.loads(response.content)
+        titles = [
+            r["data"]["allProducts"]["edges"][0]["node"]["title"] for r in results
+        ]
+        self.assertEqual(titles, ["Shoe"] * 3)
@@ -0,0 +1,45 @@
+from datetime import date
+
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    StreamingHttpResponse,
+)
+
+from shop.exports import FORMATS, astream, export_orders
+from shop.models import Order
+
+
+def export_orders_view(request):
+    """
+    Stream orders and their items as CSV or NDJSON. Staff only.
+
+    Query parameters: `format` ("csv" or "ndjson"), `since` and `until`
+    (ISO dates, inclusive) and `status` (repeatable).
+    """
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return HttpResponseForbidden()
+
+    format = request.GET.get("format", "csv")
+    statuses = request.GET.getlist("status")
+    try:
+        since, until = (
+            date.fromisoformat(request.GET[name]) if request.GET.get(name) else None
+            for name in ("since", "until")
+        )
+    except ValueError:
+        return HttpResponseBadRequest("since and until must be ISO dates.")
+    if format not in FORMATS:
+        return HttpResponseBadRequest("format must be csv or ndjson.")
+    if not set(statuses) <= set(dict(Order.STATUS_CHOICES)):
+        return HttpResponseBadRequest("Unknown status.")
+
+    chunks = export_orders(format, since=since, until=until, statuses=statuses)
+    if isinstance(request, ASGIRequest):
+        # Django would read a sync iterator into memory before serving it
+        # over ASGI.
+        chunks = astream(chunks)
+    response = StreamingHttpResponse(chunks, content_type=FORMATS[format])
+    response["Content-Disposition"] = f'attachment; filename="orders.{format}"'
+    return response
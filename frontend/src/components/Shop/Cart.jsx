@@ -2,7 +2,7 @@ import React, { useEffect } from 'react';
 import { useQuery, useMutation } from '@apollo/client';
 import { Link } from 'react-router-dom';
 import { GET_CART } from '../../graphql/queries';
-import { UPDATE_CART_ITEM_QUANTITY, REMOVE_FROM_CART } from '../../graphql/mutations';
+import { UPDATE_CART } from '../../graphql/mutations';
 import Swal from 'sweetalert2';
 
 // Extract base URL from VITE_API_URL (removes /graphql/)
@@ -22,48 +22,40 @@ function Cart() {
         }
     });
 
-    // Mutation to update item quantity
-    const [updateCartItemQuantity, { loading: updateLoading }] = useMutation(UPDATE_CART_ITEM_QUANTITY, {
-        refetchQueries: [{ query: GET_CART }],
-        awaitRefetchQueries: true, // Ensures cart is refreshed before UI updates
-        onError: (err) => {
-            console.error("❌ Error updating quantity:", err.message);
-            Swal.fire('Error', err.message, 'error');
-        },
-    });
-
-    // Mutation to remove item from cart
-    const [removeFromCart, { loading: removeLoading }] = useMutation(REMOVE_FROM_CART, {
-        refetchQueries: [{ query: GET_CART }],
-        awaitRefetchQueries: true, // ✅ Fixes last-item-not-disappearing bug
-        onCompleted: () => {
-            console.log("🗑️ Item removed from cart");
-            Swal.fire({
-                title: 'Removed from Cart!',
-                icon: 'success',
-                timer: 1500,
-                showConfirmButton: false,
-            });
+    // One mutation for quantity changes and removals; it returns the cart,
+    // which is written straight into the GET_CART cache entry.
+    const [updateCart, { loading: updateLoading }] = useMutation(UPDATE_CART, {
+        update: (cache, { data: result }) => {
+            cache.writeQuery({ query: GET_CART, data: { cart: result.updateCart.cart } });
         },
         onError: (err) => {
-            console.error("❌ Error removing item:", err.message);
+            console.error("❌ Error updating cart:", err.message);
             Swal.fire('Error', err.message, 'error');
         },
     });
 
     // Handle quantity change
-    const handleUpdateQuantity = (cartItemId, quantity) => {
-        console.log(`🔧 Updating quantity for item ${cartItemId} to ${quantity}`);
+    const handleUpdateQuantity = (productId, quantity) => {
+        console.log(`🔧 Updating quantity for product ${productId} to ${quantity}`);
         if (quantity < 1) return;
-        updateCartItemQuantity({
-            variables: { cartItemId, quantity: parseInt(quantity) },
+        updateCart({
+            variables: { lines: [{ productId, quantity: parseInt(quantity) }] },
         });
     };
 
     // Handle item removal
     const handleRemoveFromCart = async (productId) => {
         console.log(`🗑️ Removing product ${productId} from cart`);
-        await removeFromCart({ variables: { productId } });
+        const result = await updateCart({ variables: { lines: [{ productId, quantity: 0 }] } });
+        if (result.data) {
+            console.log("🗑️ Item removed from cart");
+            Swal.fire({
+                title: 'Removed from Cart!',
+                icon: 'success',
+                timer: 1500,
+                showConfirmButton: false,
+            });
+        }
     };
 
     // Log loading and error states
@@ -143,17 +135,17 @@ function Cart() {
                                     type="number"
                                     value={item.quantity}
                                     min="1"
-                                    onChange={(e) => handleUpdateQuantity(item.id, e.target.value)}
+                                    onChange={(e) => handleUpdateQuantity(item.product.id, e.target.value)}
                                     disabled={updateLoading}
                                     className="w-16 p-2 border rounded-md text-center"
                                 />
                                 {/* Remove button */}
                                 <button
                                     onClick={() => handleRemoveFromCart(item.product.id)}
-                                    disabled={removeLoading}
+                                    disabled={updateLoading}
                                     className="py-2 px-4 bg-red-600 text-white font-medium rounded-md hover:bg-red-700 focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-red-500 transition-colors"
                                 >
-                                    {removeLoading ? 'Removing...' : 'Remove'}
+                                    {updateLoading ? 'Updating...' : 'Remove'}
                                 </button>
                             </div>
                         </li>
@@ -4,8 +4,12 @@ import { GET_PRODUCTS, GET_CART } from '../../graphql/queries';
 import { ADD_TO_CART } from '../../graphql/mutations';
 import Swal from 'sweetalert2';
 
+const PAGE_SIZE = 24;
+
 function ProductList() {
-    const { loading, error, data } = useQuery(GET_PRODUCTS);
+    const { loading, error, data, fetchMore } = useQuery(GET_PRODUCTS, {
+        variables: { first: PAGE_SIZE },
+    });
     const [addToCart] = useMutation(ADD_TO_CART, {
         refetchQueries: [{ query: GET_CART }],
         onCompleted: () => {
@@ -26,24 +30,35 @@ function ProductList() {
         return words + (text.split(' ').length > 8 ? '...' : '');
     };
 
+    const loadMore = () =>
+        fetchMore({
+            variables: { first: PAGE_SIZE, after: data.allProducts.pageInfo.endCursor },
+            updateQuery: (prev, { fetchMoreResult }) => ({
+                allProducts: {
+                    ...fetchMoreResult.allProducts,
+                    edges: [...prev.allProducts.edges, ...fetchMoreResult.allProducts.edges],
+                },
+            }),
+        });
+
     if (loading) return <p className="text-center mt-20 text-gray-600 text-lg">Loading products...</p>;
     if (error) return <p className="text-center mt-20 text-red-600 text-lg">Error: {error.message}</p>;
 
     return (
         <div className="pt-20 max-w-7xl mx-auto p-6">
             <h2 className="text-3xl font-bold mb-8 text-center text-gray-900">Our Products</h2>
-            {data.allProducts.length === 0 ? (
+            {data.allProducts.edges.length === 0 ? (
                 <p className="text-center text-gray-600">No products available.</p>
             ) : (
                 <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-3 gap-6">
-                    {data.allProducts.map((product) => (
+                    {data.allProducts.edges.map(({ node: product }) => (
                         <div
                             key={product.id}
                             className="bg-white rounded-lg shadow-inner shadow-md hover:shadow-inner hover:shadow-lg transition-all duration-300 overflow-hidden w-full flex flex-col"
                         >
                             <Link to={`/products/${product.id}`} className="w-full h-48">
                                 <img
-                                    src={product.image ? `http://localhost:5000/media/${product.image}` : 'https://placehold.co/400x300'}
+                                    src={product.imageUrl ? `http://localhost:5000${product.imageUrl}` : 'https://placehold.co/400x300'}
                                     alt={product.title}
                                     className="w-full h-48 object-cover"
                                 />
@@ -75,6 +90,16 @@ function ProductList() {
                     ))}
                 </div>
             )}
+            {data.allProducts.pageInfo.hasNextPage && (
+                <div className="text-center mt-8">
+                    <button
+                        onClick={loadMore}
+                        className="py-2 px-6 bg-gray-100 text-gray-800 font-medium rounded-md hover:bg-gray-200 transition-colors"
+                    >
+                        Load more
+                    </button>
+                </div>
+            )}
         </div>
     );
 }
@@ -107,3 +107,43 @@ export const REMOVE_FROM_CART = gql`
     }
   }
 `;
+
+// Apply several cart line changes at once; returns the whole cart so the
+// cart page can update without refetching.
+export const UPDATE_CART = gql`
+  mutation UpdateCart($lines: [CartLineInput!]!) {
+    updateCart(lines: $lines) {
+      cart {
+        items {
+          ... on CartItemType {
+            product {
+              id
+              title
+              price
+              image
+              __typename
+            }
+            quantity
+            totalPrice
+            __typename
+          }
+          ... on GuestCartItemType {
+            product {
+              id
+              title
+              price
+              image
+              __typename
+            }
+            quantity
+            totalPrice
+            __typename
+          }
+          __typename
+        }
+        totalItems
+        totalPrice
+      }
+    }
+  }
+`;
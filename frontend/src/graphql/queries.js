@@ -2,17 +2,26 @@ import { gql } from '@apollo/client';
 
 
 export const GET_PRODUCTS = gql`
-  query GetProducts {
-    allProducts {
-      id
-      title
-      price
-      description
-      image
-      stock
-      category {
-        id
-        name
+  query GetProducts($first: Int, $after: String) {
+    allProducts(first: $first, after: $after) {
+      edges {
+        node {
+          id
+          title
+          price
+          description
+          image
+          imageUrl(width: 480)
+          stock
+          category {
+            id
+            name
+          }
+        }
+      }
+      pageInfo {
+        hasNextPage
+        endCursor
       }
     }
   }
@@ -1,15 +1,56 @@
 import React from 'react';
 import ReactDOM from 'react-dom/client';
-import { ApolloProvider, ApolloClient, InMemoryCache, HttpLink } from '@apollo/client';
+import { ApolloProvider, ApolloClient, InMemoryCache, HttpLink, split } from '@apollo/client';
+import { BatchHttpLink } from '@apollo/client/link/batch-http';
+import { createPersistedQueryLink } from '@apollo/client/link/persisted-queries';
+import { getMainDefinition } from '@apollo/client/utilities';
 import { BrowserRouter } from 'react-router-dom';
 import App from './App.jsx';
 import './index.css';
 
+// Send a sha256 of each query instead of its text; the server asks for the
+// full query only the first time it sees a hash.
+const sha256 = async (query) => {
+  const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(query));
+  return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('');
+};
+
+const httpOptions = {
+  uri: import.meta.env.VITE_API_URL, // Use env variable
+  credentials: 'include',
+};
+
+// Root fields the server lets browsers cache (GRAPHQL_HTTP_CACHE).
+const CATALOGUE_FIELDS = new Set([
+  'allProducts',
+  'product',
+  'allCategories',
+  'category',
+  'searchProducts',
+  'productFacets',
+]);
+
+const isCatalogueQuery = ({ query }) => {
+  const definition = getMainDefinition(query);
+  return (
+    definition.operation === 'query' &&
+    definition.selectionSet.selections.every(
+      (selection) => selection.kind === 'Field' && CATALOGUE_FIELDS.has(selection.name.value)
+    )
+  );
+};
+
+// Catalogue queries go out one by one as GET so the browser can revalidate
+// them with their ETag; everything else issued in the same tick is sent as
+// one batched POST.
 export const client = new ApolloClient({
-  link: new HttpLink({
-    uri: import.meta.env.VITE_API_URL, // Use env variable
-    credentials: 'include',
-  }),
+  link: split(
+    isCatalogueQuery,
+    createPersistedQueryLink({ sha256, useGETForHashedQueries: true }).concat(
+      new HttpLink(httpOptions)
+    ),
+    createPersistedQueryLink({ sha256 }).concat(new BatchHttpLink(httpOptions))
+  ),
   cache: new InMemoryCache(),
 });
 